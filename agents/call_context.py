@@ -0,0 +1,39 @@
+"""
+模型调用的上下文
+记录当前任务所属的模拟和正在进行的模型调用，供各层模型客户端包装共享
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# 当前任务所属的模拟，由对话运行器在模拟开始时设置；限流器据此在模拟之间轮流分配配额
+current_simulation: ContextVar[str] = ContextVar("current_simulation", default="default")
+
+
+class CallMetrics:
+    """单次模型调用的统计，耗时均从调用开始计时（包含排队等待）"""
+
+    __slots__ = ("started", "queue_wait", "time_to_first_token", "latency", "prompt_tokens",
+                 "completion_tokens", "cached", "local_cache_tokens", "provider_cached_tokens", "requests")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.queue_wait = 0.0
+        self.time_to_first_token: Optional[float] = None
+        self.latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached = False
+        # 命中本地响应缓存（agents.model_cache）时省下的令牌数，不是服务商的提示缓存
+        self.local_cache_tokens = 0
+        # 服务商提示缓存命中的提示令牌数（usage.prompt_tokens_details.cached_tokens），已包含在 prompt_tokens 中
+        self.provider_cached_tokens = 0
+        # 实际发出的 HTTP 请求数，大于 1 说明客户端重试过
+        self.requests = 0
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+# 当前任务中正在进行的模型调用，内层的限流、缓存客户端和 HTTP 钩子据此补充统计
+current_call: ContextVar[Optional[CallMetrics]] = ContextVar("current_call", default=None)
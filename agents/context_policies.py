@@ -0,0 +1,210 @@
+"""
+智能体上下文策略
+限制每次模型请求携带的对话记录，让长时间模拟中每轮的提示令牌数保持稳定，而不是随轮数线性增长
+
+可用策略:
+    full       完整对话记录（默认，与原先的行为相同）
+    window     只保留最近的消息，总令牌数不超过上限
+    head_tail  固定保留开头的若干条消息（通常是场景任务），其余预算留给最近的消息
+    summary    在 head_tail 的基础上，把被移出窗口的消息滚动总结成一段摘要
+"""
+import os
+import logging
+from typing import Any, List, Mapping, Optional
+
+from autogen_core.model_context import ChatCompletionContext, UnboundedChatCompletionContext
+from autogen_core.models import ChatCompletionClient, LLMMessage, SystemMessage, UserMessage
+
+from agents.token_counter import load_encoding, count_message_tokens, count_text_tokens
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_POLICIES = ("full", "window", "head_tail", "summary")
+DEFAULT_CONTEXT_POLICY = os.getenv("CONTEXT_POLICY", "full")
+
+# 对话记录的令牌预算（不含智能体的系统消息）
+CONTEXT_TOKEN_LIMIT = int(os.getenv("CONTEXT_TOKEN_LIMIT", "4000"))
+
+# head_tail 和 summary 策略固定保留的开头消息数
+CONTEXT_HEAD_MESSAGES = int(os.getenv("CONTEXT_HEAD_MESSAGES", "1"))
+
+# summary 策略：超出预算时把最近消息压缩到预算的这个比例以下，避免每轮都重新总结
+SUMMARY_TARGET_RATIO = 0.5
+
+# 摘要的最大令牌数
+SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PROMPT = """请把下面的团队对话总结成一段简洁的摘要，保留每个人的主要观点、已经做出的决定、分工和尚未解决的问题，不要添加对话中没有的内容。
+
+{previous}对话记录：
+{transcript}"""
+
+
+def _format_transcript(messages: List[LLMMessage]) -> str:
+    lines = []
+    for message in messages:
+        source = getattr(message, "source", None) or type(message).__name__
+        lines.append(f"{source}: {message.content}")
+    return "\n".join(lines)
+
+
+class TokenBudgetContext(ChatCompletionContext):
+    """
+    按令牌预算截取对话记录
+
+    保留开头的 head_messages 条消息，再从最新的消息往前取，直到用完 token_limit；
+    最新的一条消息总是保留，即使它本身就超出预算。
+    """
+
+    def __init__(
+        self,
+        model: str,
+        token_limit: int = CONTEXT_TOKEN_LIMIT,
+        head_messages: int = 0,
+        initial_messages: Optional[List[LLMMessage]] = None
+    ):
+        super().__init__(initial_messages)
+        self.model = model
+        self.token_limit = token_limit
+        self.head_messages = max(head_messages, 0)
+        self._encoding = None
+
+    def count(self, messages: List[LLMMessage]) -> int:
+        """计算消息列表的令牌数"""
+        return count_message_tokens(messages, self._encoding)
+
+    def _split(self, budget: int) -> tuple:
+        """
+        把对话记录分成开头、被移出窗口的中间部分和最近部分
+
+        返回:
+            tuple: (开头消息, 中间消息, 最近消息)
+        """
+        head = self._messages[:self.head_messages]
+        rest = self._messages[self.head_messages:]
+        remaining = budget - self.count(head)
+        start = len(rest)
+        while start > 0:
+            cost = self.count([rest[start - 1]])
+            if cost > remaining and start < len(rest):
+                break
+            remaining -= cost
+            start -= 1
+        return head, rest[:start], rest[start:]
+
+    async def get_messages(self) -> List[LLMMessage]:
+        self._encoding = await load_encoding(self.model)
+        head, _, tail = self._split(self.token_limit)
+        return head + tail
+
+
+class SummaryContext(TokenBudgetContext):
+    """
+    滚动摘要
+
+    对话记录超出预算时，用模型把移出窗口的消息连同上一次的摘要总结成新的摘要，
+    放在开头消息之后；总结时把最近消息压缩到预算的一半以下，因此不会每轮都调用模型总结。
+    总结失败时退化为 head_tail 截取。
+    生成摘要用单独的非流式客户端，不经过智能体的 MetricsChatCompletionClient，因此不计入该智能体的发言统计。
+    """
+
+    def __init__(
+        self,
+        model: str,
+        model_client: ChatCompletionClient,
+        token_limit: int = CONTEXT_TOKEN_LIMIT,
+        head_messages: int = CONTEXT_HEAD_MESSAGES,
+        initial_messages: Optional[List[LLMMessage]] = None
+    ):
+        super().__init__(model, token_limit, head_messages, initial_messages)
+        self.model_client = model_client
+        self.summary = ""
+        # 已经总结进摘要的消息数（不含开头消息）
+        self.summarized = 0
+        self.summaries = 0
+
+    def _summary_message(self) -> List[LLMMessage]:
+        if not self.summary:
+            return []
+        return [SystemMessage(content=f"此前对话的摘要：\n{self.summary}")]
+
+    async def get_messages(self) -> List[LLMMessage]:
+        self._encoding = await load_encoding(self.model)
+        head = self._messages[:self.head_messages]
+        pending = self._messages[self.head_messages + self.summarized:]
+        if self.count(head + self._summary_message() + pending) <= self.token_limit:
+            return head + self._summary_message() + pending
+
+        budget = int(self.token_limit * SUMMARY_TARGET_RATIO) - count_text_tokens(self.summary, self._encoding)
+        _, folded, _ = self._split(max(budget, 0))
+        folded = folded[self.summarized:]
+        if folded:
+            try:
+                await self._summarize(folded)
+                self.summarized += len(folded)
+            except Exception as e:
+                logger.warning(f"总结对话失败，改为直接截取: {e}")
+                head, _, tail = self._split(self.token_limit)
+                return head + tail
+        pending = self._messages[self.head_messages + self.summarized:]
+        return head + self._summary_message() + pending
+
+    async def _summarize(self, messages: List[LLMMessage]) -> None:
+        previous = f"已有摘要：\n{self.summary}\n\n" if self.summary else ""
+        prompt = SUMMARY_PROMPT.format(previous=previous, transcript=_format_transcript(messages))
+        result = await self.model_client.create(
+            [UserMessage(content=prompt, source="System")],
+            extra_create_args={"max_tokens": SUMMARY_MAX_TOKENS}
+        )
+        if not isinstance(result.content, str) or not result.content.strip():
+            raise ValueError("模型没有返回摘要")
+        self.summary = result.content.strip()
+        self.summaries += 1
+        logger.info(f"已总结 {len(messages)} 条消息，摘要 {count_text_tokens(self.summary, self._encoding)} 令牌")
+
+    async def clear(self) -> None:
+        await super().clear()
+        self.summary = ""
+        self.summarized = 0
+
+    async def save_state(self) -> Mapping[str, Any]:
+        state = dict(await super().save_state())
+        state["summary"] = self.summary
+        state["summarized"] = self.summarized
+        return state
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        await super().load_state(state)
+        self.summary = state.get("summary", "")
+        self.summarized = state.get("summarized", 0)
+
+
+def create_model_context(
+    policy: Optional[str],
+    model: str,
+    model_client: ChatCompletionClient,
+    token_limit: Optional[int] = None
+) -> ChatCompletionContext:
+    """
+    按策略名称创建智能体的上下文
+
+    参数:
+        policy: 策略名称，见 CONTEXT_POLICIES，为空时读取 CONTEXT_POLICY 环境变量
+        model: 模型名称，用于选择 tiktoken 编码
+        model_client: summary 策略用来生成摘要的模型客户端，应为非流式且不带发言统计的共享客户端
+        token_limit: 令牌预算，为空时读取 CONTEXT_TOKEN_LIMIT 环境变量
+
+    返回:
+        ChatCompletionContext: 上下文
+    """
+    policy = policy or DEFAULT_CONTEXT_POLICY
+    token_limit = token_limit or CONTEXT_TOKEN_LIMIT
+    if policy == "full":
+        return UnboundedChatCompletionContext()
+    if policy == "window":
+        return TokenBudgetContext(model, token_limit)
+    if policy == "head_tail":
+        return TokenBudgetContext(model, token_limit, CONTEXT_HEAD_MESSAGES)
+    if policy == "summary":
+        return SummaryContext(model, model_client, token_limit)
+    raise ValueError(f"未知的上下文策略: {policy}. 可用策略: {list(CONTEXT_POLICIES)}")
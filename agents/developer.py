@@ -5,7 +5,8 @@ import os
 import asyncio
 from autogen_agentchat.agents import AssistantAgent
 from autogen_core.models import ChatCompletionClient
-from autogen_ext.models.openai import OpenAIChatCompletionClient
+from agents.model_clients import get_model_client
+from agents.context_policies import create_model_context
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -15,7 +16,13 @@ def create_developer_agent(
     name="Developer",  # 使用英文名称
     display_name="开发人员",  # 保留中文显示名称
     traits="技术专注、解决问题能力强",
-    relationships={"经理": "尊重", "设计师": "协作"}
+    relationships={"经理": "尊重", "设计师": "协作"},
+    model_client_stream=None,
+    temperature=0.7,
+    seed=42,
+    use_cache=True,
+    context_policy=None,
+    context_token_limit=None
 ):
     """
     创建一个开发人员代理
@@ -25,6 +32,12 @@ def create_developer_agent(
         display_name (str): 代理显示名称（中文）
         traits (str): 代理的性格特征
         relationships (dict): 代理与其他代理的关系
+        model_client_stream (bool): 是否以流式方式调用模型，默认读取 MODEL_CLIENT_STREAM 环境变量
+        temperature (float): 采样温度
+        seed (int): 采样随机种子
+        use_cache (bool): 是否使用模型响应缓存（需启用 MODEL_CACHE）
+        context_policy (str): 上下文策略（full/window/head_tail/summary），默认读取 CONTEXT_POLICY 环境变量
+        context_token_limit (int): 上下文的令牌预算，默认读取 CONTEXT_TOKEN_LIMIT 环境变量
     
     返回:
         AssistantAgent: 开发人员代理实例
@@ -59,21 +72,38 @@ def create_developer_agent(
     api_base = os.getenv("OPENAI_API_BASE", "https://api.vveai.com/v1")
     model_name = os.getenv("MODEL_NAME", "gpt-4o-mini")
     api_token = os.getenv("API_TOKEN", "")
+    if model_client_stream is None:
+        model_client_stream = os.getenv("MODEL_CLIENT_STREAM", "true").lower() == "true"
     
-    # 创建模型客户端
-    model_client = OpenAIChatCompletionClient(
+    # 取得共享的模型客户端，参数相同的智能体复用同一客户端及其连接池
+    model_client = get_model_client(
         model=model_name,
         base_url=api_base,
         api_key=api_token,
-        seed=42,
-        temperature=0.7
+        temperature=temperature,
+        seed=seed,
+        stream=model_client_stream,
+        use_cache=use_cache,
+        agent_name=name
+    )
+    # summary 策略生成摘要用单独的非流式客户端，不计入智能体的发言统计
+    summary_client = get_model_client(
+        model=model_name,
+        base_url=api_base,
+        api_key=api_token,
+        temperature=temperature,
+        seed=seed,
+        stream=False,
+        use_cache=use_cache
     )
     
     # 创建智能体
     agent = AssistantAgent(
         name=name,
         system_message=system_message,
-        model_client=model_client
+        model_client=model_client,
+        model_client_stream=model_client_stream,
+        model_context=create_model_context(context_policy, model_name, summary_client, context_token_limit)
     )
     
     # 添加显示名称属性
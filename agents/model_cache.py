@@ -0,0 +1,330 @@
+"""
+模型响应缓存
+按 (模型, 采样参数, 完整消息列表) 缓存模型回复：内存中保留最近使用的条目，可选地持久化到磁盘，条目在 TTL 后过期
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional, Sequence, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,
+    ModelInfo,
+    RequestUsage
+)
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from agents.call_context import current_call
+
+logger = logging.getLogger(__name__)
+
+# 是否缓存模型回复
+CACHE_ENABLED = os.getenv("MODEL_CACHE", "false").lower() == "true"
+
+# 内存中保留的条目数量
+CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "1024"))
+
+# 条目的有效期（秒），0 表示不过期
+CACHE_TTL = float(os.getenv("MODEL_CACHE_TTL", "86400"))
+
+# 磁盘缓存目录，为空时只使用内存缓存
+CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "")
+
+# 只缓存正常结束的回复，被截断或出错的回复下次仍然请求模型
+CACHEABLE_FINISH_REASONS = ("stop", "function_calls")
+
+
+class ResponseCache:
+    """
+    两级响应缓存
+
+    内存层是按最近使用排序的 OrderedDict，超出 max_entries 后淘汰最久未使用的条目；
+    磁盘层每个条目一个 JSON 文件，内存未命中时读取，命中后重新放回内存层。
+    """
+
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL, directory: str = CACHE_DIR):
+        self.max_entries = max(max_entries, 1)
+        self.ttl = ttl
+        self.directory = directory
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存条目
+
+        参数:
+            key: 缓存键
+
+        返回:
+            dict: 序列化的 CreateResult，未命中或已过期时返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self._is_fresh(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+            self.expired += 1
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+            self.disk_hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """写入缓存条目，同时写入磁盘层"""
+        entry = (time.time(), value)
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+        self.stores += 1
+
+    def clear(self) -> None:
+        """清空内存层，磁盘层的文件保留"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中、未命中、淘汰次数和命中率"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "enabled": CACHE_ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "disk": bool(self.directory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expired": self.expired
+        }
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl <= 0 or time.time() - created_at < self.ttl
+
+    def _remember(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取磁盘缓存失败: {path}: {e}")
+            return None
+        if not self._is_fresh(data["created_at"]):
+            self.expired += 1
+            os.remove(path)
+            return None
+        return data["created_at"], data["result"]
+
+    def _write_disk(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，避免并发读取到写了一半的条目
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"created_at": entry[0], "result": entry[1]}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"写入磁盘缓存失败: {path}: {e}")
+
+
+# 进程内共享的响应缓存
+response_cache = ResponseCache()
+
+
+def request_key(
+    params: Dict[str, Any],
+    messages: Sequence[LLMMessage],
+    tools: Sequence[Tool | ToolSchema],
+    json_output: Optional[bool | type[BaseModel]],
+    extra_create_args: Mapping[str, Any]
+) -> str:
+    """
+    计算模型请求的键，参数和消息完全相同的请求得到相同的键
+
+    参数:
+        params: 模型参数（模型名称、API 地址、采样温度、随机种子等）
+        messages: 完整的消息列表
+        tools: 可调用的工具
+        json_output: 输出格式
+        extra_create_args: 额外的请求参数
+
+    返回:
+        str: SHA-256 十六进制摘要
+    """
+    if isinstance(json_output, type):
+        json_output = json_output.model_json_schema()
+    data = {
+        "params": params,
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [tool.schema if isinstance(tool, Tool) else tool for tool in tools],
+        "json_output": json_output,
+        "extra_create_args": extra_create_args
+    }
+    serialized = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ChatCompletionClientWrapper(ChatCompletionClient):
+    """包装另一个模型客户端，除 create/create_stream 外的方法都转交给被包装的客户端"""
+
+    def __init__(self, client: ChatCompletionClient):
+        self.client = client
+
+    async def close(self) -> None:
+        # 被包装的客户端由模型客户端注册表统一关闭
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self.client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self.client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return self.client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.client.model_info
+
+
+class CachedChatCompletionClient(ChatCompletionClientWrapper):
+    """
+    带缓存的模型客户端
+
+    包装一个模型客户端，缓存键由模型参数和完整的消息列表、工具、输出格式计算得到。
+    命中缓存时不请求模型，返回的 CreateResult 标记为 cached，用量记为 0；
+    流式调用命中时把完整回复作为一个分片发出。
+    """
+
+    def __init__(self, client: ChatCompletionClient, params: Dict[str, Any], cache: ResponseCache = response_cache):
+        """
+        参数:
+            client: 被包装的模型客户端
+            params: 参与缓存键计算的模型参数（模型名称、API 地址、采样温度、随机种子等）
+            cache: 响应缓存
+        """
+        super().__init__(client)
+        self.params = params
+        self.cache = cache
+
+    def _lookup(self, key: str) -> Optional[CreateResult]:
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        result = CreateResult.model_validate(cached)
+        result.cached = True
+        call = current_call.get()
+        if call is not None:
+            call.cached = True
+            call.local_cache_tokens += result.usage.prompt_tokens + result.usage.completion_tokens
+        result.usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        return result
+
+    def _store(self, key: str, result: CreateResult) -> None:
+        if result.finish_reason in CACHEABLE_FINISH_REASONS:
+            self.cache.set(key, result.model_dump(mode="json"))
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> CreateResult:
+        key = request_key(self.params, messages, tools, json_output, extra_create_args)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        result = await self.client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        )
+        self._store(key, result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key = request_key(self.params, messages, tools, json_output, extra_create_args)
+        cached = self._lookup(key)
+        if cached is not None:
+            if isinstance(cached.content, str) and cached.content:
+                yield cached.content
+            yield cached
+            return
+        async for item in self.client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        ):
+            if isinstance(item, CreateResult):
+                self._store(key, item)
+            yield item
@@ -0,0 +1,251 @@
+"""
+模型请求录制与回放
+record 模式把每次模型请求的回复、流式分片及其耗时追加写入磁带文件；
+replay 模式从磁带文件返回回复，不访问网络，可以按原始耗时或立即回放
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncGenerator, Deque, Dict, List, Mapping, Optional, Sequence, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from agents.model_cache import ChatCompletionClientWrapper, request_key
+
+logger = logging.getLogger(__name__)
+
+# 磁带文件路径，为空时不录制也不回放
+CASSETTE_PATH = os.getenv("MODEL_CASSETTE", "")
+
+# 磁带模式：record 录制真实请求，replay 从磁带回放
+CASSETTE_MODES = ("record", "replay")
+CASSETTE_MODE = os.getenv("MODEL_CASSETTE_MODE", "replay")
+
+# 回放耗时：recorded 按录制时的首字延迟和分片间隔回放，none 立即回放
+CASSETTE_LATENCIES = ("recorded", "none")
+CASSETTE_LATENCY = os.getenv("MODEL_CASSETTE_LATENCY", "none")
+
+
+class CassetteMissError(Exception):
+    """回放时磁带中没有匹配的请求"""
+
+
+class Cassette:
+    """
+    模型请求磁带
+
+    磁带文件每行一条 JSON 记录，按请求键（模型参数 + 完整消息列表的摘要）匹配。
+    同一请求录制了多次时按录制顺序依次回放，用完后重复最后一条。
+    """
+
+    def __init__(self, path: str, mode: str = CASSETTE_MODE, latency: str = CASSETTE_LATENCY):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"未知的磁带模式: {mode}. 可用模式: {list(CASSETTE_MODES)}")
+        if latency not in CASSETTE_LATENCIES:
+            raise ValueError(f"未知的回放耗时: {latency}. 可用选项: {list(CASSETTE_LATENCIES)}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._interactions: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode == "replay":
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _load(self) -> None:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                interaction = json.loads(line)
+                self._interactions.setdefault(interaction["key"], deque()).append(interaction)
+        total = sum(len(interactions) for interactions in self._interactions.values())
+        logger.info(f"已加载磁带: {self.path}，{total} 条记录，{len(self._interactions)} 个不同请求")
+
+    def record(self, interaction: Dict[str, Any]) -> None:
+        """追加一条记录，每条记录单独写入一行，进程中途退出时已录制的记录仍然有效"""
+        line = json.dumps(interaction, ensure_ascii=False) + "\n"
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+        self.recorded += 1
+
+    def play(self, key: str) -> Dict[str, Any]:
+        """
+        取出请求对应的记录
+
+        参数:
+            key: 请求键
+
+        返回:
+            dict: 录制的记录
+
+        异常:
+            CassetteMissError: 磁带中没有该请求
+        """
+        interactions = self._interactions.get(key)
+        if interactions:
+            interaction = interactions.popleft()
+            self._last[key] = interaction
+        elif key in self._last:
+            interaction = self._last[key]
+        else:
+            self.misses += 1
+            raise CassetteMissError(f"磁带 {self.path} 中没有匹配的模型请求: {key[:12]}")
+        self.replayed += 1
+        return interaction
+
+    def stats(self) -> Dict[str, Any]:
+        """返回磁带模式和录制、回放、未命中次数"""
+        return {
+            "path": self.path,
+            "mode": self.mode,
+            "latency": self.latency,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses
+        }
+
+
+def _summarize(messages: Sequence[LLMMessage]) -> str:
+    """最后一条消息的开头，便于在磁带文件中辨认请求"""
+    if not messages:
+        return ""
+    content = getattr(messages[-1], "content", "")
+    return content[:200] if isinstance(content, str) else str(content)[:200]
+
+
+class CassetteChatCompletionClient(ChatCompletionClientWrapper):
+    """
+    录制或回放模型请求的客户端
+
+    record 模式下请求照常发给被包装的客户端，回复和每个流式分片相对请求开始的时间一起写入磁带；
+    replay 模式下不调用被包装的客户端。
+    """
+
+    def __init__(self, client: ChatCompletionClient, params: Dict[str, Any], cassette: Cassette):
+        """
+        参数:
+            client: 被包装的模型客户端
+            params: 参与请求键计算的模型参数
+            cassette: 磁带
+        """
+        super().__init__(client)
+        self.params = params
+        self.cassette = cassette
+
+    def _interaction(
+        self,
+        key: str,
+        messages: Sequence[LLMMessage],
+        stream: bool,
+        chunks: List[List[Any]],
+        result: CreateResult,
+        latency: float
+    ) -> Dict[str, Any]:
+        return {
+            "key": key,
+            "params": self.params,
+            "stream": stream,
+            "message_count": len(messages),
+            "last_message": _summarize(messages),
+            "chunks": chunks,
+            "latency": round(latency, 4),
+            "result": result.model_dump(mode="json"),
+            "recorded_at": datetime.now().isoformat()
+        }
+
+    async def _wait_until(self, started: float, offset: float) -> None:
+        if self.cassette.latency == "recorded":
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> CreateResult:
+        key = request_key(self.params, messages, tools, json_output, extra_create_args)
+        started = time.monotonic()
+        if self.cassette.mode == "replay":
+            interaction = self.cassette.play(key)
+            await self._wait_until(started, interaction["latency"])
+            return CreateResult.model_validate(interaction["result"])
+
+        result = await self.client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        )
+        self.cassette.record(self._interaction(key, messages, False, [], result, time.monotonic() - started))
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key = request_key(self.params, messages, tools, json_output, extra_create_args)
+        started = time.monotonic()
+        if self.cassette.mode == "replay":
+            interaction = self.cassette.play(key)
+            for offset, chunk in interaction["chunks"]:
+                await self._wait_until(started, offset)
+                yield chunk
+            await self._wait_until(started, interaction["latency"])
+            yield CreateResult.model_validate(interaction["result"])
+            return
+
+        # 分片记为 [相对请求开始的秒数, 内容]
+        chunks: List[List[Any]] = []
+        async for item in self.client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        ):
+            if isinstance(item, CreateResult):
+                latency = time.monotonic() - started
+                self.cassette.record(self._interaction(key, messages, True, chunks, item, latency))
+            else:
+                chunks.append([round(time.monotonic() - started, 4), item])
+            yield item
+
+
+def load_cassette() -> Optional[Cassette]:
+    """按 MODEL_CASSETTE 等环境变量创建磁带，未配置时返回 None"""
+    if not CASSETTE_PATH:
+        return None
+    cassette = Cassette(CASSETTE_PATH)
+    logger.info(f"模型请求磁带: {CASSETTE_PATH}（{cassette.mode}）")
+    return cassette
+
+
+# 进程内共享的磁带
+active_cassette = load_cassette()
@@ -0,0 +1,324 @@
+"""
+共享的模型客户端
+同一进程内按 (base_url, 模型, 采样参数) 复用模型客户端，同一 base_url 的客户端共用一个保持长连接的 HTTP 连接池
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+import httpx
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+from pydantic import BaseModel
+
+from agents.model_cache import ChatCompletionClientWrapper, CachedChatCompletionClient, response_cache, CACHE_ENABLED
+from agents.model_cassette import CassetteChatCompletionClient, active_cassette
+from agents.rate_limiter import RateLimitedChatCompletionClient, rate_limiter
+from agents.turn_metrics import MetricsChatCompletionClient, capture_provider_usage, count_http_request
+
+logger = logging.getLogger(__name__)
+
+# HTTP 连接池上限：总连接数、保持的空闲长连接数，以及空闲长连接的保留时间（秒）
+MAX_CONNECTIONS = int(os.getenv("MODEL_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("MODEL_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("MODEL_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# 模型请求超时（秒）和建立连接的超时（秒）
+REQUEST_TIMEOUT = float(os.getenv("MODEL_HTTP_TIMEOUT", "600"))
+CONNECT_TIMEOUT = float(os.getenv("MODEL_HTTP_CONNECT_TIMEOUT", "10"))
+
+# 启动时预先建立的连接数，0 表示不预热
+PREWARM_CONNECTIONS = int(os.getenv("MODEL_CLIENT_PREWARM", "0"))
+
+
+class StreamUsageChatCompletionClient(ChatCompletionClientWrapper):
+    """
+    流式调用时要求返回用量统计的模型客户端
+
+    stream_options 只对流式请求有效，写进 OpenAIChatCompletionClient 的构造参数会让同一客户端的非流式请求
+    （例如生成摘要）也带上 stream_options 而被 OpenAI 拒绝，因此只在 create_stream 中附加。
+    """
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> CreateResult:
+        return await self.client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        )
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        async for item in self.client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args={"stream_options": {"include_usage": True}, **extra_create_args},
+            cancellation_token=cancellation_token
+        ):
+            yield item
+
+
+class ModelClientRegistry:
+    """
+    模型客户端注册表
+
+    参数相同的智能体共用一个 OpenAIChatCompletionClient，同一 base_url 的客户端共用一个 httpx.AsyncClient，
+    因此多个模拟的智能体复用已建立的 TCP/TLS 连接，不必每次创建模拟都重新握手。
+    共享客户端按需逐层包装：流式客户端先包一层 StreamUsageChatCompletionClient（只在流式请求上要求返回用量），
+    配置 RATE_LIMIT_RPM/RATE_LIMIT_TPM 时再包一层 RateLimitedChatCompletionClient，
+    启用 MODEL_CACHE 时再包一层 CachedChatCompletionClient（命中缓存不占用限流配额），
+    配置 MODEL_CASSETTE 时最外层是 CassetteChatCompletionClient：录制时命中缓存的回复同样写入磁带，
+    回放时不经过缓存和限流。
+    指定智能体名称时，再为该智能体单独包一层 MetricsChatCompletionClient 统计每轮发言的耗时和用量。
+    连接池绑定创建它的事件循环；在新的事件循环中取客户端时（例如工作进程中的新任务）会重新建立连接池。
+    """
+
+    def __init__(self):
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+        self._model_clients: Dict[Tuple[Any, ...], ChatCompletionClient] = {}
+        self._cached_clients: Dict[Tuple[Any, ...], CachedChatCompletionClient] = {}
+        self._cassette_clients: Dict[Tuple[Any, ...], CassetteChatCompletionClient] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 正在关闭的旧连接池任务，保留引用避免任务被回收
+        self._closing: Set[asyncio.Task] = set()
+        self.created = 0
+        self.reused = 0
+
+    def get(
+        self,
+        model: str,
+        base_url: str,
+        api_key: str,
+        temperature: float,
+        seed: int,
+        stream: bool,
+        use_cache: bool = True
+    ) -> ChatCompletionClient:
+        """
+        取得参数对应的共享模型客户端，不存在时创建
+
+        参数:
+            model: 模型名称
+            base_url: API 地址
+            api_key: API 密钥
+            temperature: 采样温度
+            seed: 采样随机种子
+            stream: 是否流式调用，流式调用时要求在最后一个分片中返回用量统计（只附加在 create_stream 请求上）
+            use_cache: 是否使用响应缓存，仅在启用 MODEL_CACHE 时生效
+
+        返回:
+            ChatCompletionClient: 共享的模型客户端
+        """
+        self._check_loop()
+        # 密钥只以摘要参与比较，避免出现在统计信息中
+        key_digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+        key = (base_url, model, key_digest, temperature, seed, stream)
+        # 流式与非流式调用的回复可以互相复用，缓存键和磁带的请求键不区分 stream
+        params = {"base_url": base_url, "model": model, "temperature": temperature, "seed": seed}
+        client = self._model_clients.get(key)
+        if client is not None:
+            self.reused += 1
+        else:
+            client = self._create(model, base_url, api_key, temperature, seed, stream)
+            if stream:
+                client = StreamUsageChatCompletionClient(client)
+            if rate_limiter.enabled:
+                client = RateLimitedChatCompletionClient(client, model, rate_limiter)
+            self._model_clients[key] = client
+
+        use_cache = use_cache and CACHE_ENABLED
+        if use_cache:
+            cached_client = self._cached_clients.get(key)
+            if cached_client is None:
+                cached_client = CachedChatCompletionClient(client, params, response_cache)
+                self._cached_clients[key] = cached_client
+            client = cached_client
+        if active_cassette is None:
+            return client
+
+        cassette_key = key + (use_cache,)
+        cassette_client = self._cassette_clients.get(cassette_key)
+        if cassette_client is None:
+            # 磁带不记录 API 地址，录制的磁带可以在其他环境中回放
+            cassette_params = {"model": model, "temperature": temperature, "seed": seed}
+            cassette_client = CassetteChatCompletionClient(client, cassette_params, active_cassette)
+            self._cassette_clients[cassette_key] = cassette_client
+        return cassette_client
+
+    def _create(
+        self,
+        model: str,
+        base_url: str,
+        api_key: str,
+        temperature: float,
+        seed: int,
+        stream: bool
+    ) -> OpenAIChatCompletionClient:
+        """创建使用共享连接池的模型客户端"""
+        client = OpenAIChatCompletionClient(
+            model=model,
+            base_url=base_url,
+            api_key=api_key,
+            seed=seed,
+            temperature=temperature,
+            http_client=self._http_client(base_url)
+        )
+        self.created += 1
+        logger.info(f"创建模型客户端: {model} @ {base_url}（temperature={temperature}, seed={seed}, stream={stream}）")
+        return client
+
+    async def prewarm(self, base_url: str, api_key: str, connections: int = PREWARM_CONNECTIONS) -> int:
+        """
+        预先建立到 base_url 的长连接，让第一条模型请求不必等待 TCP/TLS 握手
+
+        参数:
+            base_url: API 地址
+            api_key: API 密钥
+            connections: 并发建立的连接数
+
+        返回:
+            int: 成功建立的连接数
+        """
+        if connections <= 0:
+            return 0
+        if active_cassette is not None and active_cassette.mode == "replay":
+            logger.info("回放模式不访问网络，跳过预热")
+            return 0
+        self._check_loop()
+        http_client = self._http_client(base_url)
+        url = f"{base_url.rstrip('/')}/models"
+        headers = {"Authorization": f"Bearer {api_key}"}
+
+        async def warm() -> bool:
+            try:
+                # 只需要建立连接，不关心响应内容
+                response = await http_client.get(url, headers=headers, timeout=CONNECT_TIMEOUT)
+                await response.aclose()
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"预热模型连接失败: {e}")
+                return False
+
+        results = await asyncio.gather(*(warm() for _ in range(connections)))
+        warmed = sum(results)
+        logger.info(f"已预热模型连接: {warmed}/{connections} @ {base_url}")
+        return warmed
+
+    async def close(self) -> None:
+        """关闭所有连接池"""
+        for http_client in self._http_clients.values():
+            await http_client.aclose()
+        self._http_clients.clear()
+        self._model_clients.clear()
+        self._cached_clients.clear()
+        self._cassette_clients.clear()
+        self._loop = None
+
+    def stats(self) -> Dict[str, Any]:
+        """返回客户端数量、复用次数和连接池配置"""
+        return {
+            "model_clients": len(self._model_clients),
+            "http_pools": len(self._http_clients),
+            "created": self.created,
+            "reused": self.reused,
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": KEEPALIVE_EXPIRY,
+            "cache": response_cache.stats(),
+            "cassette": active_cassette.stats() if active_cassette is not None else None,
+            "rate_limiter": rate_limiter.stats()
+        }
+
+    def _http_client(self, base_url: str) -> httpx.AsyncClient:
+        http_client = self._http_clients.get(base_url)
+        if http_client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT),
+                follow_redirects=True,
+                # 统计每次模型调用实际发出的请求数（用于计算重试次数）和服务商提示缓存命中的令牌数
+                event_hooks={"request": [count_http_request], "response": [capture_provider_usage]}
+            )
+            self._http_clients[base_url] = http_client
+        return http_client
+
+    def _check_loop(self) -> None:
+        """事件循环变化后丢弃旧的连接池，旧连接无法在新的事件循环中使用"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._loop is loop:
+            return
+        if self._loop is not None and self._http_clients:
+            logger.info("事件循环已变化，重新建立模型连接池")
+            task = loop.create_task(self._close_stale(list(self._http_clients.values())))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+            self._http_clients.clear()
+            self._model_clients.clear()
+            self._cached_clients.clear()
+            self._cassette_clients.clear()
+        self._loop = loop
+
+    async def _close_stale(self, http_clients: List[httpx.AsyncClient]) -> None:
+        """关闭旧事件循环留下的连接池，旧事件循环已关闭时连接无法正常关闭，记录后丢弃"""
+        for http_client in http_clients:
+            try:
+                await http_client.aclose()
+            except Exception as e:
+                logger.info(f"丢弃无法关闭的旧连接池: {e}")
+
+
+# 进程内共享的模型客户端注册表
+model_client_registry = ModelClientRegistry()
+
+
+def get_model_client(
+    model: str,
+    base_url: str,
+    api_key: str,
+    temperature: float = 0.7,
+    seed: int = 42,
+    stream: bool = True,
+    use_cache: bool = True,
+    agent_name: Optional[str] = None
+) -> ChatCompletionClient:
+    """
+    从进程内共享的注册表取得模型客户端，参数见 ModelClientRegistry.get
+
+    指定 agent_name 时返回该智能体专用的 MetricsChatCompletionClient，每轮发言的统计按智能体名称记录。
+    """
+    client = model_client_registry.get(model, base_url, api_key, temperature, seed, stream, use_cache)
+    if agent_name is None:
+        return client
+    return MetricsChatCompletionClient(client, agent_name)
@@ -0,0 +1,328 @@
+"""
+模型请求限流
+进程内所有模拟共用每分钟请求数（RPM）和每分钟令牌数（TPM）两个令牌桶，
+请求前用 tiktoken 估算令牌数，各模拟轮流获得配额，避免并发模拟把服务商的额度打满后收到 429。
+配置的 RPM/TPM 是服务商给的总额度，多个 uvicorn worker 或模拟工作进程各自限流时按进程数均分
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, AsyncGenerator, Deque, Dict, Mapping, Optional, Sequence, Tuple, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from agents.model_cache import ChatCompletionClientWrapper
+from agents.token_counter import load_encoding, count_message_tokens
+from agents.call_context import current_call, current_simulation
+
+logger = logging.getLogger(__name__)
+
+# 每分钟请求数和令牌数上限，0 表示不限制
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "0"))
+
+# 请求前预留的回复令牌数，请求结束后按实际用量多退少补
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("RATE_LIMIT_COMPLETION_ESTIMATE", "256"))
+
+
+def _limiter_processes() -> int:
+    """共用同一份额度、各自限流的进程数：uvicorn worker 数（WEB_CONCURRENCY）乘以每个 worker 的模拟工作进程数"""
+    configured = int(os.getenv("RATE_LIMIT_PROCESSES", "0"))
+    if configured > 0:
+        return configured
+    processes = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+    if os.getenv("SIMULATION_EXECUTOR", "inline") == "process":
+        # 模拟在工作进程中运行，每个工作进程有自己的限流器，进程数与执行槽位数相同
+        processes *= max(int(os.getenv("MAX_CONCURRENT_SIMULATIONS", "4")), 1)
+    return processes
+
+# 分摊额度的进程数，RATE_LIMIT_PROCESSES 可以覆盖自动推算的值
+RATE_LIMIT_PROCESSES = _limiter_processes()
+
+# 平滑平均等待时间的系数
+WAIT_SMOOTHING = 0.2
+
+class TokenBucket:
+    """按每分钟速率连续补充的令牌桶，容量为一分钟的配额"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """返回桶里攒够 amount 个令牌还需要的秒数"""
+        self.refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0.0) / self.rate
+
+    def consume(self, amount: float) -> None:
+        # 允许欠账：实际用量超过预估时余额可以为负，之后的请求相应推迟
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "consumed", "future", "enqueued_at")
+
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        # 放行时实际从令牌桶扣除的令牌数，超过桶容量的请求只扣除一桶
+        self.consumed = 0
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class RateLimiter:
+    """
+    公平排队的限流器
+
+    每个模拟有自己的等待队列，模拟之间按轮转顺序获得配额，同一模拟内先到先得；
+    轮到的请求配额不足时整体等待，不让小请求插队，避免大请求被饿死。
+    调度不需要常驻协程：有请求加入或配额补足时才检查队首，配额不足时用 call_later 定时重试。
+    """
+
+    def __init__(self, rpm: int = RATE_LIMIT_RPM, tpm: int = RATE_LIMIT_TPM, processes: int = RATE_LIMIT_PROCESSES):
+        """
+        参数:
+            rpm: 所有进程合计的每分钟请求数，0 表示不限制
+            tpm: 所有进程合计的每分钟令牌数，0 表示不限制
+            processes: 分摊额度的进程数，本进程只使用 1/processes 的额度
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.processes = max(processes, 1)
+        self._requests = TokenBucket(rpm / self.processes) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm / self.processes) if tpm > 0 else None
+        if self.enabled and self.processes > 1:
+            logger.info(f"模型请求限流按 {self.processes} 个进程均分额度（RPM {rpm}，TPM {tpm}）")
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.granted = 0
+        self.throttled = 0
+        self.average_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._requests is not None or self._tokens is not None
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, tokens: int, owner: Optional[str] = None) -> Tuple[float, int]:
+        """
+        等待一个请求的配额
+
+        参数:
+            tokens: 预估的令牌数（提示 + 预留的回复）
+            owner: 请求所属的模拟，默认取 current_simulation
+
+        返回:
+            tuple: (等待的秒数, 实际扣除的令牌数)，请求结束后把后者交给 settle
+        """
+        if not self.enabled:
+            return 0.0, 0
+        owner = owner or current_simulation.get()
+        waiter = _Waiter(tokens, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(owner, deque()).append(waiter)
+        self._schedule()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._remove(owner, waiter)
+            raise
+        waited = time.monotonic() - waiter.enqueued_at
+        if waited > 0.001:
+            self.throttled += 1
+        self.average_wait += WAIT_SMOOTHING * (waited - self.average_wait)
+        self.max_wait = max(self.max_wait, waited)
+        return waited, waiter.consumed
+
+    def settle(self, consumed: int, actual: int) -> None:
+        """
+        请求结束后按实际令牌用量修正令牌桶
+
+        参数:
+            consumed: acquire 返回的实际扣除的令牌数
+            actual: 请求实际使用的令牌数
+        """
+        if self._tokens is not None and actual:
+            self._tokens.consume(actual - consumed)
+
+    def estimated_wait(self, tokens: int = COMPLETION_TOKENS_ESTIMATE) -> float:
+        """估算一个新请求现在加入时大约需要等待的秒数"""
+        pending = [waiter.tokens for queue in self._queues.values() for waiter in queue] + [tokens]
+        delays = []
+        if self._requests is not None:
+            delays.append(max(len(pending) - self._requests.tokens, 0) / self._requests.rate)
+        if self._tokens is not None:
+            self._tokens.refill()
+            delays.append(max(sum(pending) - self._tokens.tokens, 0) / self._tokens.rate)
+        return round(max(delays, default=0.0), 2)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回限流配置、剩余配额、排队请求数和等待时间"""
+        if self._requests is not None:
+            self._requests.refill()
+        if self._tokens is not None:
+            self._tokens.refill()
+        return {
+            "enabled": self.enabled,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "processes": self.processes,
+            "available_requests": round(self._requests.tokens, 1) if self._requests is not None else None,
+            "available_tokens": round(self._tokens.tokens) if self._tokens is not None else None,
+            "waiting": self.waiting,
+            "waiting_by_simulation": {owner: len(queue) for owner, queue in self._queues.items()},
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "average_wait": round(self.average_wait, 3),
+            "max_wait": round(self.max_wait, 3),
+            "estimated_wait": self.estimated_wait() if self.enabled else 0.0
+        }
+
+    def _delay(self, tokens: int) -> float:
+        delay = 0.0
+        if self._requests is not None:
+            delay = max(delay, self._requests.delay(1))
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.delay(tokens))
+        return delay
+
+    def _schedule(self) -> None:
+        """按轮转顺序放行队首请求，配额不足时定时重试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queues:
+            owner, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():
+                # 已取消、尚未移出队列的请求
+                queue.popleft()
+                if not queue:
+                    del self._queues[owner]
+                continue
+            delay = self._delay(waiter.tokens)
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._schedule)
+                return
+            queue.popleft()
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                waiter.consumed = int(min(waiter.tokens, self._tokens.capacity))
+                self._tokens.consume(waiter.consumed)
+            self.granted += 1
+            waiter.future.set_result(None)
+            # 放行后把该模拟移到轮转队尾
+            del self._queues[owner]
+            if queue:
+                self._queues[owner] = queue
+
+    def _remove(self, owner: str, waiter: _Waiter) -> None:
+        queue = self._queues.get(owner)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[owner]
+        self._schedule()
+
+
+# 进程内共享的限流器
+rate_limiter = RateLimiter()
+
+
+class RateLimitedChatCompletionClient(ChatCompletionClientWrapper):
+    """
+    限流的模型客户端
+
+    请求前用 tiktoken 估算提示令牌数并预留 COMPLETION_TOKENS_ESTIMATE 个回复令牌，
+    从限流器取得配额后再调用被包装的客户端，结束后按实际用量修正。
+    """
+
+    def __init__(self, client: ChatCompletionClient, model: str, limiter: RateLimiter = rate_limiter):
+        """
+        参数:
+            client: 被包装的模型客户端
+            model: 模型名称，用于选择 tiktoken 编码
+            limiter: 限流器
+        """
+        super().__init__(client)
+        self.model = model
+        self.limiter = limiter
+
+    async def _acquire(self, messages: Sequence[LLMMessage]) -> int:
+        encoding = await load_encoding(self.model)
+        estimated = count_message_tokens(messages, encoding) + COMPLETION_TOKENS_ESTIMATE
+        waited, consumed = await self.limiter.acquire(estimated)
+        call = current_call.get()
+        if call is not None:
+            call.queue_wait += waited
+        if waited > 1:
+            logger.info(f"模型请求等待配额 {waited:.1f} 秒（{current_simulation.get()}，预估 {estimated} 令牌）")
+        return consumed
+
+    def _settle(self, consumed: int, result: CreateResult) -> None:
+        if result.usage is not None:
+            self.limiter.settle(consumed, result.usage.prompt_tokens + result.usage.completion_tokens)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> CreateResult:
+        consumed = await self._acquire(messages)
+        result = await self.client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        )
+        self._settle(consumed, result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        consumed = await self._acquire(messages)
+        async for item in self.client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        ):
+            if isinstance(item, CreateResult):
+                self._settle(consumed, item)
+            yield item
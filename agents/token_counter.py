@@ -0,0 +1,101 @@
+"""
+令牌计数
+用 tiktoken 估算消息的令牌数；编码文件无法加载时（例如离线环境）按字符数估算
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Sequence
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 未知模型使用的编码
+DEFAULT_ENCODING = "o200k_base"
+
+# 每条消息的格式开销（角色、分隔符）
+TOKENS_PER_MESSAGE = 4
+
+# 已加载的编码，值为 None 表示加载失败、改用字符估算
+_encodings: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_encoding(model: str):
+    """
+    取得模型对应的 tiktoken 编码，首次调用会读取（必要时下载）编码文件
+
+    参数:
+        model: 模型名称
+
+    返回:
+        tiktoken.Encoding: 编码，无法加载时返回 None
+    """
+    with _lock:
+        if model in _encodings:
+            return _encodings[model]
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+            except Exception as e:
+                logger.warning(f"无法加载 {model} 的 tiktoken 编码，改为按字符估算令牌数: {e}")
+        _encodings[model] = encoding
+        return encoding
+
+
+async def load_encoding(model: str):
+    """在线程中加载编码，避免读取或下载编码文件时阻塞事件循环"""
+    if model in _encodings:
+        return _encodings[model]
+    return await asyncio.to_thread(get_encoding, model)
+
+
+def count_text_tokens(text: str, encoding=None) -> int:
+    """
+    计算文本的令牌数
+
+    参数:
+        text: 文本
+        encoding: tiktoken 编码，为空时按字符估算（中日韩字符每字约 1 个令牌，其他字符约每 4 个 1 个令牌）
+
+    返回:
+        int: 令牌数
+    """
+    if not text:
+        return 0
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    wide = sum(1 for char in text if ord(char) > 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def count_message_tokens(messages: Sequence[Any], encoding=None) -> int:
+    """
+    计算消息列表的令牌数
+
+    参数:
+        messages: LLMMessage 列表（SystemMessage、UserMessage、AssistantMessage 等）
+        encoding: tiktoken 编码
+
+    返回:
+        int: 令牌数
+    """
+    total = 0
+    for message in messages:
+        content = getattr(message, "content", "")
+        if not isinstance(content, str):
+            content = str(content)
+        total += TOKENS_PER_MESSAGE + count_text_tokens(content, encoding)
+        source = getattr(message, "source", None)
+        if source:
+            total += count_text_tokens(source, encoding)
+    return total
+
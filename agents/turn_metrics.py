@@ -0,0 +1,254 @@
+"""
+每轮发言的耗时与用量统计
+记录每个智能体每轮发言的模型耗时（排队等待、首字延迟、总耗时）、提示和回复令牌数、本地缓存和服务商提示缓存命中、重试次数，
+附在对应的 agent_message 上推送给前端并随对话记录保存
+"""
+import json
+from collections import defaultdict
+from typing import Any, AsyncGenerator, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import httpx
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient, CreateResult, LLMMessage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel
+
+from agents.model_cache import ChatCompletionClientWrapper
+from agents.call_context import CallMetrics, current_call, current_simulation
+
+
+async def count_http_request(request: httpx.Request) -> None:
+    """httpx 请求钩子：累计当前模型调用实际发出的请求数"""
+    call = current_call.get()
+    if call is not None:
+        call.requests += 1
+
+
+def _cached_tokens(payload: Any) -> int:
+    """从 chat/completions 响应（或流式分片）的 usage 中取出服务商提示缓存命中的令牌数"""
+    usage = payload.get("usage") if isinstance(payload, dict) else None
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or 0
+
+
+def _record_cached_tokens(call: CallMetrics, data: bytes) -> None:
+    try:
+        call.provider_cached_tokens += _cached_tokens(json.loads(data))
+    except ValueError:
+        pass
+
+
+class _UsageCaptureStream(httpx.AsyncByteStream):
+    """原样转发流式响应，同时逐行查找带 usage 的分片"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, call: CallMetrics):
+        self.stream = stream
+        self.call = call
+
+    async def __aiter__(self):
+        buffer = b""
+        async for chunk in self.stream:
+            yield chunk
+            *lines, buffer = (buffer + chunk).split(b"\n")
+            for line in lines:
+                if line.startswith(b"data:") and b"cached_tokens" in line:
+                    _record_cached_tokens(self.call, line[len(b"data:"):])
+
+    async def aclose(self) -> None:
+        await self.stream.aclose()
+
+
+async def capture_provider_usage(response: httpx.Response) -> None:
+    """
+    httpx 响应钩子：记录当前模型调用中服务商提示缓存命中的令牌数
+
+    AutoGen 的 CreateResult 只保留提示和回复令牌数，prompt_tokens_details 只能从原始响应中取得：
+    非流式响应在这里读完后解析，流式响应在转发分片的同时查找最后带 usage 的分片。
+    """
+    call = current_call.get()
+    if call is None or response.status_code != 200 or not response.request.url.path.endswith("/chat/completions"):
+        return
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        response.stream = _UsageCaptureStream(response.stream, call)
+    else:
+        await response.aread()
+        _record_cached_tokens(call, response.content)
+
+
+class TurnMetricsRecorder:
+    """
+    按 (模拟ID, 智能体名称) 暂存模型调用的统计
+
+    智能体的一轮发言可能包含多次模型调用（例如调用工具后再次回复），运行器收到该智能体的消息时取出并合并。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Tuple[str, str], List[CallMetrics]] = defaultdict(list)
+
+    def record(self, simulation_id: str, agent_name: str, call: CallMetrics) -> None:
+        self._calls[(simulation_id, agent_name)].append(call)
+
+    def pop(self, simulation_id: str, agent_name: str) -> Optional[Dict[str, Any]]:
+        """
+        取出智能体自上一条消息以来的调用统计
+
+        参数:
+            simulation_id: 模拟ID
+            agent_name: 智能体名称
+
+        返回:
+            dict: 合并后的本轮统计，没有模型调用时（例如手动发送的消息）返回 None
+        """
+        calls = self._calls.pop((simulation_id, agent_name), None)
+        if not calls:
+            return None
+        first_token = [call.time_to_first_token for call in calls if call.time_to_first_token is not None]
+        return {
+            "model_calls": len(calls),
+            "queue_wait": round(sum(call.queue_wait for call in calls), 3),
+            "time_to_first_token": round(first_token[-1], 3) if first_token else None,
+            "latency": round(sum(call.latency for call in calls), 3),
+            "prompt_tokens": sum(call.prompt_tokens for call in calls),
+            "completion_tokens": sum(call.completion_tokens for call in calls),
+            "cached": all(call.cached for call in calls),
+            "local_cache_tokens": sum(call.local_cache_tokens for call in calls),
+            "provider_cached_tokens": sum(call.provider_cached_tokens for call in calls),
+            "retries": sum(max(call.requests - 1, 0) for call in calls)
+        }
+
+    def discard(self, simulation_id: str) -> None:
+        """丢弃模拟剩余的统计（模拟被取消时最后一轮没有对应的消息）"""
+        for key in [key for key in self._calls if key[0] == simulation_id]:
+            del self._calls[key]
+
+
+# 进程内共享的统计暂存
+turn_metrics = TurnMetricsRecorder()
+
+
+def summarize_turns(messages: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    按智能体汇总消息上的统计，用于容量规划和按场景的成本报表
+
+    参数:
+        messages: 带 metrics 字段的 agent_message 列表
+
+    返回:
+        dict: {智能体名称: {turns, latency, average_latency, average_time_to_first_token, ...}}
+    """
+    summary: Dict[str, Dict[str, Any]] = {}
+    for message in messages:
+        metrics = message.get("metrics")
+        if not metrics:
+            continue
+        agent = summary.setdefault(message["sender"], {
+            "turns": 0, "latency": 0.0, "queue_wait": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            "cached_turns": 0, "local_cache_tokens": 0, "provider_cached_tokens": 0, "retries": 0, "_first_token": []
+        })
+        agent["turns"] += 1
+        agent["latency"] += metrics["latency"]
+        agent["queue_wait"] += metrics["queue_wait"]
+        agent["prompt_tokens"] += metrics["prompt_tokens"]
+        agent["completion_tokens"] += metrics["completion_tokens"]
+        agent["cached_turns"] += int(metrics["cached"])
+        agent["local_cache_tokens"] += metrics["local_cache_tokens"]
+        agent["provider_cached_tokens"] += metrics.get("provider_cached_tokens", 0)
+        agent["retries"] += metrics["retries"]
+        if metrics["time_to_first_token"] is not None:
+            agent["_first_token"].append(metrics["time_to_first_token"])
+
+    for agent in summary.values():
+        first_token = agent.pop("_first_token")
+        agent["latency"] = round(agent["latency"], 3)
+        agent["queue_wait"] = round(agent["queue_wait"], 3)
+        agent["average_latency"] = round(agent["latency"] / agent["turns"], 3)
+        agent["average_time_to_first_token"] = round(sum(first_token) / len(first_token), 3) if first_token else None
+    return summary
+
+
+class MetricsChatCompletionClient(ChatCompletionClientWrapper):
+    """
+    统计模型调用的客户端
+
+    每个智能体一个，包在共享客户端的最外层；调用期间通过 current_call 让内层客户端补充排队等待、缓存和重试信息，
+    调用结束后按当前模拟和智能体名称记入 turn_metrics。
+    """
+
+    def __init__(self, client: ChatCompletionClient, agent_name: str, recorder: TurnMetricsRecorder = turn_metrics):
+        """
+        参数:
+            client: 共享的模型客户端
+            agent_name: 智能体名称
+            recorder: 统计暂存
+        """
+        super().__init__(client)
+        self.agent_name = agent_name
+        self.recorder = recorder
+
+    def _finish(self, call: CallMetrics, result: CreateResult) -> None:
+        call.latency = call.elapsed()
+        call.cached = call.cached or result.cached
+        if result.usage is not None:
+            call.prompt_tokens = result.usage.prompt_tokens
+            call.completion_tokens = result.usage.completion_tokens
+        self.recorder.record(current_simulation.get(), self.agent_name, call)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> CreateResult:
+        call = CallMetrics()
+        token = current_call.set(call)
+        try:
+            result = await self.client.create(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token
+            )
+        finally:
+            current_call.reset(token)
+        self._finish(call, result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Any = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        call = CallMetrics()
+        # 流式调用在两次分片之间会把控制权交还给智能体，因此每次进入内层生成器前重新设置 current_call
+        stream = self.client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token
+        ).__aiter__()
+        while True:
+            token = current_call.set(call)
+            try:
+                item = await stream.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                current_call.reset(token)
+            if isinstance(item, CreateResult):
+                self._finish(call, item)
+            elif call.time_to_first_token is None:
+                call.time_to_first_token = call.elapsed()
+            yield item
@@ -9,10 +9,9 @@ import asyncio
 import logging
 import traceback
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Sequence
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
@@ -25,19 +24,23 @@ sys_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if sys_path not in sys.path:
     sys.path.append(sys_path)
 
-# 导入 AutoGen 0.4 组件
-from autogen_agentchat.agents import AssistantAgent
-from autogen_agentchat.teams import RoundRobinGroupChat
-from autogen_agentchat.messages import TextMessage
-from autogen_core import CancellationToken
-from autogen_core.models import UserMessage, AssistantMessage
-
 # 导入自定义模块
-from agents.manager import create_manager_agent
-from agents.developer import create_developer_agent
-from agents.designer import create_designer_agent
-from utils.logging_utils import save_conversation
+from utils.event_hub import EventHub, EventFrame, OVERFLOW_POLICIES
+from utils.broker import create_broker
+from utils.heartbeat import HeartbeatWheel
+from utils.event_codec import encode_batch, encode_sse_batch, MAX_BATCH_EVENTS
+from utils.sse_response import EventSourceResponse, negotiate_encoding
+from utils.simulation_manager import Simulation, SimulationManager, STATUS_FAILED, STATUS_COMPLETED, STATUS_STOPPING
+from utils.job_queue import QueueFullError, PRIORITY_CLASSES
+from utils.process_pool import SimulationProcessPool, WorkerCrashedError, DEFAULT_EXECUTOR, EXECUTOR_TYPES
 from conversations.scenarios import get_scenario, list_scenarios
+from conversations.runner import run_conversation, build_agent_message, TEAM_MODES
+from conversations.batch import BatchRun
+from conversations.termination import resolve_termination
+from conversations.checkpoint import checkpoint_store, CHECKPOINT_AUTO_RESUME
+from agents.model_clients import model_client_registry, PREWARM_CONNECTIONS
+from agents.context_policies import CONTEXT_POLICIES
+from agents.turn_metrics import summarize_turns
 
 # 配置日志
 logging.basicConfig(
@@ -71,28 +74,126 @@ class ScenarioModel(BaseModel):
 
 class SimulationRequest(BaseModel):
     scenario_id: str
+    # 排队优先级：interactive（界面发起）或 batch（批量任务）
+    priority: str = "interactive"
+    # 为 False 时本次模拟不使用模型响应缓存
+    use_cache: bool = True
+    # 智能体的上下文策略（full/window/head_tail/summary）和令牌预算，为空时使用环境变量配置
+    context_policy: Optional[str] = None
+    context_token_limit: Optional[int] = None
+    # 群聊模式（round_robin/parallel），为空时依次发言（round_robin）
+    team_mode: Optional[str] = None
+    # 终止条件（max_turns、deadline、token_budget、cost_limit、stop_keywords、consensus_marker、idle_turns），
+    # 未指定的项使用环境变量，共识标记和空转轮数只在这里指定时启用
+    termination: Optional[Dict[str, Any]] = None
 
 class SimulationResponse(BaseModel):
     success: bool
     message: str
+    simulation_id: Optional[str] = None
+    queue_position: Optional[int] = None
+    eta_seconds: Optional[float] = None
+
+class BatchRequest(BaseModel):
+    scenarios: List[str]
+    # 人设矩阵：{人设名称: {智能体名称: {"display_name", "traits", "relationships"}}}
+    personas: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None
+    temperatures: Optional[List[float]] = None
+    seeds: Optional[List[int]] = None
+    repeats: int = 1
+    concurrency: Optional[int] = None
+    use_cache: bool = True
+    context_policy: Optional[str] = None
+    context_token_limit: Optional[int] = None
+    team_mode: Optional[str] = None
+    termination: Optional[Dict[str, Any]] = None
+
+class SimulationStatusModel(BaseModel):
+    simulation_id: str
+    scenario_id: str
+    status: str
+    is_running: bool
+    priority_class: str
+    headless: bool
+    usage: Dict[str, int]
+    queue_position: Optional[int] = None
+    message_count: int
+    error: Optional[str] = None
+    stop_reason: Optional[Dict[str, Any]] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+def publish_queue_status(simulation_id: str, position: int, eta: Optional[float]) -> None:
+    """向模拟的事件频道推送排队位置和预计等待时间"""
+    simulation = simulation_manager.get(simulation_id)
+    if simulation is None or simulation.headless:
+        return
+    event_hub.publish_event(simulation_id, "queue_status", {
+        "status": "started" if position == 0 else "queued",
+        "position": position,
+        "eta_seconds": eta
+    })
+
+# 模拟注册表，每个模拟拥有独立的任务、消息记录和取消令牌；新模拟先进入优先级队列
+simulation_manager = SimulationManager(on_queue_update=publish_queue_status)
+
+# 批量任务，键为批次ID
+batch_runs: Dict[str, BatchRun] = {}
+
+# 模拟工作进程池，SIMULATION_EXECUTOR=process 时启用，进程数与执行槽位数相同
+if DEFAULT_EXECUTOR not in EXECUTOR_TYPES:
+    raise ValueError(f"未知的模拟执行方式: {DEFAULT_EXECUTOR}. 可用方式: {list(EXECUTOR_TYPES)}")
+simulation_process_pool = (
+    SimulationProcessPool(simulation_manager.max_concurrent, run_conversation)
+    if DEFAULT_EXECUTOR == "process" else None
+)
 
-# 全局变量
-active_simulation = None
-connected_clients = set()
-simulation_task = None
-message_history = []
+# 事件代理，多 worker 部署时通过 EVENT_BROKER=unix 在进程间转发事件
+event_broker = create_broker()
 
-# SSE事件队列
-event_queue = asyncio.Queue()
+# SSE事件广播中心，每个客户端拥有独立的缓冲区
+event_hub = EventHub(broker=event_broker)
 
-# 智能体显示名称映射
-AGENT_DISPLAY_NAMES = {
-    "Manager": "经理",
-    "SeniorDev": "资深开发",
-    "JuniorDev": "初级开发",
-    "Designer": "设计师",
-    "System": "系统"
-}
+# 所有SSE连接共享的心跳调度器
+heartbeat_wheel = HeartbeatWheel()
+
+# SSE 批量模式允许的最大时间窗口（毫秒）
+MAX_BATCH_WINDOW_MS = 1000
+
+@app.on_event("startup")
+async def start_event_broker():
+    """启动事件代理"""
+    await event_broker.start(event_hub)
+    logger.info(f"事件代理已启动: {event_broker.kind}")
+
+@app.on_event("startup")
+async def prewarm_model_clients():
+    """按 MODEL_CLIENT_PREWARM 预先建立模型连接，在进程内执行模拟时才有意义"""
+    if PREWARM_CONNECTIONS > 0 and simulation_process_pool is None:
+        await model_client_registry.prewarm(
+            os.getenv("OPENAI_API_BASE", "https://api.vveai.com/v1"),
+            os.getenv("API_TOKEN", "")
+        )
+
+@app.on_event("startup")
+async def resume_checkpoints():
+    """按 CHECKPOINT_AUTO_RESUME 恢复上次进程退出时仍在运行的模拟"""
+    if not CHECKPOINT_AUTO_RESUME:
+        return
+    for summary in checkpoint_store.list():
+        try:
+            _resume_simulation(summary["simulation_id"])
+        except (ValueError, QueueFullError) as e:
+            logger.warning(f"自动恢复模拟 {summary['simulation_id']} 失败: {e}")
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    """停止事件代理和模拟工作进程，关闭模型连接池"""
+    await event_broker.stop()
+    if simulation_process_pool is not None:
+        await simulation_process_pool.shutdown()
+    await model_client_registry.close()
 
 # 获取所有场景
 @app.get("/api/scenarios", response_model=List[ScenarioModel])
@@ -137,59 +238,212 @@ async def get_scenarios():
         raise HTTPException(status_code=500, detail=str(e))
 
 # 启动模拟
-@app.post("/api/simulation/start", response_model=SimulationResponse)
-async def start_simulation(request: SimulationRequest, background_tasks: BackgroundTasks):
-    """启动模拟对话"""
-    global active_simulation, simulation_task, message_history
+@app.post("/api/simulations", response_model=SimulationResponse)
+async def create_simulation(request: SimulationRequest):
+    """
+    提交一个新的模拟，返回其ID和排队位置
     
-    if active_simulation:
-        logger.warning("尝试启动模拟，但已有模拟正在运行")
-        return {"success": False, "message": "已有模拟正在运行"}
+    没有空闲执行槽位时模拟进入队列，排队位置和预计等待时间通过 queue_status 事件推送；
+    队列已满时返回 429，Retry-After 为预计的等待秒数。
+    """
+    scenario_text, options = _simulation_options(request)
+    try:
+        return _start_simulation(request.scenario_id, scenario_text, request.priority, options)
+    except QueueFullError as e:
+        logger.warning(f"拒绝启动模拟: {e}")
+        headers = {"Retry-After": str(int(e.retry_after or 1))}
+        raise HTTPException(status_code=429, detail=str(e), headers=headers)
+
+def _simulation_options(request: SimulationRequest) -> Tuple[str, Dict[str, Any]]:
+    """
+    校验启动模拟的请求
+
+    参数:
+        request: 启动模拟的请求
+
+    返回:
+        tuple: (场景文本, 传给对话运行器的选项)
+
+    异常:
+        HTTPException: 场景不存在时为 404，其余参数无效时为 400
+    """
+    if request.priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"未知的优先级类别: {request.priority}")
+    if request.context_policy is not None and request.context_policy not in CONTEXT_POLICIES:
+        raise HTTPException(status_code=400, detail=f"未知的上下文策略: {request.context_policy}")
+    if request.team_mode is not None and request.team_mode not in TEAM_MODES:
+        raise HTTPException(status_code=400, detail=f"未知的群聊模式: {request.team_mode}")
+    try:
+        scenario_text = get_scenario(request.scenario_id)
+    except ValueError:
+        logger.error(f"未找到指定场景: {request.scenario_id}")
+        raise HTTPException(status_code=404, detail="未找到指定场景")
+    try:
+        resolve_termination(request.termination)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"终止条件无效: {e}")
+    options = {
+        "use_cache": request.use_cache,
+        "context_policy": request.context_policy,
+        "context_token_limit": request.context_token_limit,
+        "team_mode": request.team_mode,
+        "termination": request.termination
+    }
+    return scenario_text, options
+
+# 获取模拟列表
+@app.get("/api/simulations", response_model=List[SimulationStatusModel])
+async def list_simulations():
+    """获取本进程登记的所有模拟及其状态"""
+    return [simulation.to_dict() for simulation in simulation_manager.list()]
+
+# 获取模拟状态
+@app.get("/api/simulations/{simulation_id}", response_model=SimulationStatusModel)
+async def get_simulation(simulation_id: str):
+    """获取指定模拟的状态"""
+    simulation = simulation_manager.get(simulation_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="未找到指定的模拟")
+    return simulation.to_dict()
+
+# 停止指定模拟
+@app.post("/api/simulations/{simulation_id}/stop", response_model=SimulationResponse)
+async def stop_simulation_by_id(simulation_id: str):
+    """停止指定模拟"""
+    simulation = simulation_manager.get(simulation_id)
+    if simulation is None:
+        raise HTTPException(status_code=404, detail="未找到指定的模拟")
+    return _stop_simulation(simulation)
+
+# 从检查点恢复模拟
+@app.post("/api/simulations/{simulation_id}/resume", response_model=SimulationResponse)
+async def resume_simulation(simulation_id: str):
+    """
+    从最近的检查点恢复模拟，沿用原来的模拟ID和运行参数
     
+    已完成的发言不会重新生成；恢复前的消息会重新推送，重新连接的前端可以看到完整的对话。
+    """
+    simulation = simulation_manager.get(simulation_id)
+    if simulation is not None and simulation.is_active:
+        raise HTTPException(status_code=409, detail="模拟仍在运行")
     try:
-        # 获取场景
+        response = _resume_simulation(simulation_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except QueueFullError as e:
+        logger.warning(f"拒绝恢复模拟: {e}")
+        headers = {"Retry-After": str(int(e.retry_after or 1))}
+        raise HTTPException(status_code=429, detail=str(e), headers=headers)
+    if response is None:
+        raise HTTPException(status_code=404, detail="未找到该模拟的检查点")
+    return response
+
+# 获取可恢复的检查点
+@app.get("/api/checkpoints")
+async def list_checkpoints():
+    """列出可以恢复的模拟检查点，按保存时间降序"""
+    return checkpoint_store.list()
+
+# 启动模拟（兼容旧接口）
+@app.post("/api/simulation/start", response_model=SimulationResponse)
+async def start_simulation(request: SimulationRequest):
+    """启动模拟对话，参数与 POST /api/simulations 相同"""
+    try:
+        # 获取场景并校验其余参数
         logger.info(f"获取场景: {request.scenario_id}")
-        scenario_text = get_scenario(request.scenario_id)
-        if not scenario_text:
-            logger.error(f"未找到指定场景: {request.scenario_id}")
-            return {"success": False, "message": "未找到指定场景"}
-        
-        # 清空消息历史
-        message_history = []
-        
-        # 在后台任务中运行模拟
-        logger.info(f"启动模拟: {request.scenario_id}")
-        background_tasks.add_task(run_simulation, request.scenario_id, scenario_text)
-        
-        return {"success": True, "message": "模拟已启动"}
+        scenario_text, options = _simulation_options(request)
+        return _start_simulation(request.scenario_id, scenario_text, request.priority, options)
+    except HTTPException:
+        raise
+    except QueueFullError as e:
+        logger.warning(f"尝试启动模拟，但{e}")
+        return {"success": False, "message": str(e)}
     except Exception as e:
         logger.error(f"启动模拟时出错: {e}")
         return {"success": False, "message": f"启动模拟时出错: {str(e)}"}
 
-# 停止模拟
+# 停止模拟（兼容旧接口）
 @app.post("/api/simulation/stop", response_model=SimulationResponse)
-async def stop_simulation():
-    """停止当前运行的模拟"""
-    global active_simulation, simulation_task
-    
-    if not active_simulation:
+async def stop_simulation(simulation_id: Optional[str] = None):
+    """停止指定的模拟，未指定时停止最近启动的运行中模拟"""
+    simulation = simulation_manager.get(simulation_id) if simulation_id else simulation_manager.latest_active()
+    if simulation is None or not simulation.is_active:
         logger.info("尝试停止模拟，但当前没有运行中的模拟")
         return {"success": True, "message": "当前没有运行中的模拟"}
+    return _stop_simulation(simulation)
+
+def _start_simulation(
+    scenario_id: str,
+    scenario_text: str,
+    priority: str = "interactive",
+    options: Optional[Dict[str, Any]] = None,
+    headless: bool = False,
+    simulation_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """登记模拟、开启其事件频道并提交到执行队列，无界面模拟不开启频道"""
+    simulation = simulation_manager.create(scenario_id, scenario_text, priority, options, headless, simulation_id)
     
+    # 为本次模拟开启独立的事件频道，事件ID在频道内单调递增；排队期间即可订阅
+    if not headless:
+        event_hub.open_channel(simulation.id)
+    
+    logger.info(f"提交模拟: {scenario_id} ({simulation.id})，优先级: {priority}")
     try:
-        logger.info("停止模拟")
-        if simulation_task and not simulation_task.done():
-            simulation_task.cancel()
-        
-        active_simulation = None
+        position = simulation_manager.submit(simulation, run_simulation)
+    except QueueFullError:
+        event_hub.close_channel(simulation.id)
+        raise
+    
+    if position == 0:
+        return {"success": True, "message": "模拟已启动", "simulation_id": simulation.id, "queue_position": 0}
+    return {
+        "success": True,
+        "message": f"模拟已加入队列，前方还有 {position - 1} 个模拟",
+        "simulation_id": simulation.id,
+        "queue_position": position,
+        "eta_seconds": simulation_manager.queue.eta(position)
+    }
+
+def _resume_simulation(simulation_id: str) -> Optional[Dict[str, Any]]:
+    """
+    读取检查点并以原来的模拟ID重新提交
+    
+    返回:
+        dict: 与 _start_simulation 相同，没有检查点时返回 None
+    
+    异常:
+        ValueError: 检查点损坏或版本不兼容
+    """
+    checkpoint = checkpoint_store.load(simulation_id)
+    if checkpoint is None:
+        return None
+    logger.info(f"从检查点恢复模拟: {simulation_id}，已完成 {checkpoint['turns']} 条发言")
+    options = {**checkpoint["options"], "checkpoint": checkpoint}
+    return _start_simulation(
+        checkpoint["scenario_id"],
+        checkpoint["scenario_text"],
+        checkpoint.get("priority_class") or "interactive",
+        options,
+        checkpoint.get("headless", False),
+        simulation_id
+    )
+
+def _stop_simulation(simulation: Simulation) -> Dict[str, Any]:
+    """取消模拟并通知订阅者"""
+    try:
+        logger.info(f"停止模拟: {simulation.id}")
+        if not simulation_manager.stop(simulation.id):
+            return {"success": True, "message": "模拟已结束", "simulation_id": simulation.id}
         
         # 发送模拟状态更新
-        await event_queue.put({
-            "event": "simulation_status",
-            "data": {"is_running": False}
-        })
-        
-        return {"success": True, "message": "模拟已停止"}
+        _simulation_emitter(simulation)("simulation_status", {"is_running": False}, True)
+        if simulation.started_at is None:
+            # 从队列中取消的模拟，或已出队但尚未开始执行、会被 SimulationManager 跳过的模拟，
+            # 都不会经过 run_simulation 的清理，直接关闭其频道并丢弃检查点
+            event_hub.close_channel(simulation.id)
+            checkpoint_store.delete(simulation.id)
+        
+        return {"success": True, "message": "模拟已停止", "simulation_id": simulation.id}
     except Exception as e:
         logger.error(f"停止模拟时出错: {e}")
         return {"success": False, "message": f"停止模拟时出错: {str(e)}"}
@@ -286,11 +540,12 @@ async def get_history_by_id(history_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 # 手动发送智能体消息到前端
-async def send_agent_message(agent_name: str, content: str) -> bool:
+async def send_agent_message(simulation: Simulation, agent_name: str, content: str) -> bool:
     """
     手动发送智能体消息到前端
     
     参数:
+        simulation: 模拟，消息记入其消息记录并只发布到该模拟的事件频道
         agent_name: 智能体名称
         content: 消息内容
         
@@ -298,31 +553,9 @@ async def send_agent_message(agent_name: str, content: str) -> bool:
         bool: 是否发送成功
     """
     try:
-        # 获取显示名称
-        display_name = AGENT_DISPLAY_NAMES.get(agent_name, agent_name)
-        
-        # 构造消息对象
-        message_id = str(datetime.now().timestamp())
-        timestamp = datetime.now().isoformat()
-        
-        sse_message = {
-            "id": message_id,
-            "sender": agent_name,
-            "sender_display_name": display_name,
-            "content": content,
-            "timestamp": timestamp
-        }
-        
-        # 添加到消息历史
-        message_history.append(sse_message)
-        
-        # 发送到SSE事件队列
-        logger.info(f"发送消息: {agent_name} ({display_name}): {content[:50]}...")
-        await event_queue.put({
-            "event": "agent_message",
-            "data": sse_message
-        })
-        logger.info(f"消息已发送到SSE队列: {message_id}")
+        sse_message = build_agent_message(agent_name, content)
+        logger.info(f"发送消息: {agent_name} ({sse_message['sender_display_name']}): {content[:50]}...")
+        _simulation_emitter(simulation)("agent_message", sse_message, True)
         return True
     except Exception as e:
         logger.error(f"发送消息失败: {e}")
@@ -330,12 +563,67 @@ async def send_agent_message(agent_name: str, content: str) -> bool:
 
 # SSE事件流
 @app.get("/api/events")
-async def event_stream(request: Request):
-    """SSE事件流，用于向前端推送实时消息"""
+async def event_stream(
+    request: Request,
+    simulation_id: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    buffer_size: Optional[int] = None,
+    overflow_policy: Optional[str] = None,
+    batch_ms: Optional[int] = None
+):
+    """
+    SSE事件流，用于向前端推送实时消息
+    
+    指定 simulation_id 时只接收该模拟的事件，否则接收所有模拟的事件。
+    浏览器自动重连时会携带 Last-Event-ID 请求头，此时只补发断线期间错过的事件；
+    无法设置请求头的客户端也可以通过 last_event_id 查询参数指定。
+    buffer_size 和 overflow_policy 可覆盖该连接的缓冲区容量和溢出策略。
+    batch_ms 开启批量模式：在该时间窗口内发布的事件合并为一个 batch 事件，data 为事件信封数组。
+    """
+    return _event_stream_response(request, simulation_id, last_event_id, buffer_size, overflow_policy, batch_ms)
+
+# 指定模拟的SSE事件流
+@app.get("/api/simulations/{simulation_id}/events")
+async def simulation_event_stream(
+    request: Request,
+    simulation_id: str,
+    last_event_id: Optional[str] = None,
+    buffer_size: Optional[int] = None,
+    overflow_policy: Optional[str] = None,
+    batch_ms: Optional[int] = None
+):
+    """只推送指定模拟事件的SSE事件流，参数含义同 /api/events"""
+    return _event_stream_response(request, simulation_id, last_event_id, buffer_size, overflow_policy, batch_ms)
+
+def _event_stream_response(
+    request: Request,
+    simulation_id: Optional[str],
+    last_event_id: Optional[str],
+    buffer_size: Optional[int],
+    overflow_policy: Optional[str],
+    batch_ms: Optional[int]
+) -> EventSourceResponse:
+    """构造SSE事件流响应"""
+    resume_from = request.headers.get("last-event-id") or last_event_id
+    if overflow_policy is not None and overflow_policy not in OVERFLOW_POLICIES:
+        raise HTTPException(status_code=400, detail=f"未知的溢出策略: {overflow_policy}")
+    if batch_ms is not None and not 0 < batch_ms <= MAX_BATCH_WINDOW_MS:
+        raise HTTPException(status_code=400, detail=f"batch_ms 必须在 1 到 {MAX_BATCH_WINDOW_MS} 之间")
+    if simulation_id is not None and not event_hub.has_channel(simulation_id):
+        raise HTTPException(status_code=404, detail="未找到指定的模拟")
+    is_running = _is_simulation_running(simulation_id)
+    
     async def generate():
-        client_id = id(asyncio.current_task())
-        connected_clients.add(client_id)
-        logger.info(f"客户端连接: {client_id}")
+        # 订阅与读取回放缓冲区之间没有 await，保证补发的事件与后续事件之间无缝衔接
+        try:
+            subscriber = event_hub.subscribe(simulation_id, buffer_size=buffer_size, overflow_policy=overflow_policy)
+        except KeyError:
+            logger.warning(f"模拟 {simulation_id} 的事件频道已释放")
+            return
+        missed_frames = event_hub.replay_since(resume_from, simulation_id)
+        subscriber.last_event_id = missed_frames[-1].event_id if missed_frames else resume_from
+        client_id = subscriber.id
+        logger.info(f"客户端连接: {client_id}（模拟: {simulation_id or '全部'}）")
         
         try:
             # 发送初始连接成功消息
@@ -344,248 +632,287 @@ async def event_stream(request: Request):
             yield connection_message
             
             # 发送当前模拟状态
-            status_message = f"event: simulation_status\ndata: {{\"is_running\": {json.dumps(active_simulation is not None)}}}\n\n"
-            logger.info(f"发送状态消息: is_running={active_simulation is not None}")
-            yield status_message
+            status_frame = EventFrame("simulation_status", {"is_running": is_running})
+            logger.info(f"发送状态消息: is_running={is_running}")
+            yield status_frame.payload
             
-            # 发送测试消息
-            test_message = {
-                "id": str(datetime.now().timestamp()),
-                "sender": "System",
-                "sender_display_name": "系统",
-                "content": "SSE连接已建立，等待智能体消息...",
-                "timestamp": datetime.now().isoformat()
-            }
-            test_message_str = f"event: agent_message\ndata: {json.dumps(test_message)}\n\n"
-            logger.info(f"发送测试消息")
-            yield test_message_str
+            if resume_from:
+                # 断线重连：只补发错过的事件
+                logger.info(f"客户端 {client_id} 从事件 {resume_from} 恢复，补发 {len(missed_frames)} 个事件")
+                for frame in missed_frames:
+                    yield frame.payload
+            else:
+                # 发送测试消息
+                test_message = {
+                    "id": str(datetime.now().timestamp()),
+                    "sender": "System",
+                    "sender_display_name": "系统",
+                    "content": "SSE连接已建立，等待智能体消息...",
+                    "timestamp": datetime.now().isoformat()
+                }
+                logger.info(f"发送测试消息")
+                yield EventFrame("agent_message", test_message).payload
             
-            # 持续监听事件队列
+            # 持续监听该客户端自己的事件缓冲区
+            # 空闲时挂起在 subscriber.get() 上不产生唤醒；断开由 EventSourceResponse 从 ASGI 通道感知，
+            # 保活心跳由共享的时间轮写入缓冲区
+            heartbeat_wheel.add(subscriber)
             while True:
-                # 检查客户端是否断开连接
-                if await request.is_disconnected():
-                    logger.info(f"客户端断开连接: {client_id}")
-                    break
-                    
                 try:
-                    # 使用超时，以便可以检查客户端是否断开连接
-                    event = await asyncio.wait_for(event_queue.get(), timeout=1.0)
+                    if batch_ms:
+                        # 批量模式：收到第一个事件后等待一个时间窗口，把窗口内积压的事件合并为一帧写出
+                        await subscriber.wait()
+                        await asyncio.sleep(batch_ms / 1000)
+                        frames = await subscriber.get_batch(MAX_BATCH_EVENTS)
+                        logger.debug(f"发送批量事件: {len(frames)} 个")
+                        yield encode_sse_batch(frames)
+                    else:
+                        frame = await subscriber.get()
+                        
+                        # 帧已在发布时编码，直接写出共享的字节
+                        logger.debug(f"发送事件: {frame.event}")
+                        yield frame.payload
                     
-                    if "event" in event and "data" in event:
-                        event_type = event["event"]
-                        event_data = json.dumps(event["data"])
-                        event_message = f"event: {event_type}\ndata: {event_data}\n\n"
-                        logger.info(f"发送事件: {event_type}")
-                        yield event_message
-                except asyncio.TimeoutError:
-                    # 发送心跳以保持连接
-                    yield ":\n\n"
+                    # 积压过多被断开的慢速客户端，发送完恢复提示后关闭连接
+                    if subscriber.closed and not subscriber.buffer:
+                        logger.warning(f"客户端 {client_id} 消费过慢，已断开，恢复位置: {subscriber.last_event_id}")
+                        break
                 except Exception as e:
                     logger.error(f"处理事件时出错: {e}")
                     error_message = f"event: error\ndata: {{\"message\": \"{str(e)}\"}}\n\n"
                     yield error_message
         finally:
-            if client_id in connected_clients:
-                connected_clients.remove(client_id)
-                logger.info(f"客户端断开连接: {client_id}")
+            heartbeat_wheel.remove(subscriber)
+            event_hub.unsubscribe(subscriber)
+            logger.info(f"客户端断开连接: {client_id}")
     
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Access-Control-Allow-Origin": "*",
-            "X-Accel-Buffering": "no"
-        }
-    )
+    # 按 Accept-Encoding 协商流式压缩，压缩上下文在连接期间持续保留
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    return EventSourceResponse(generate(), encoding=encoding)
+
+def _is_simulation_running(simulation_id: Optional[str]) -> bool:
+    """指定模拟（为空时表示任意模拟）是否正在运行，模拟可能运行在其他 worker 上"""
+    return event_hub.is_open(simulation_id)
+
+# WebSocket事件流
+@app.websocket("/api/ws")
+async def websocket_events(websocket: WebSocket):
+    """
+    WebSocket事件流，与SSE共用同一套事件信封和发布路径
+    
+    客户端发送JSON文本控制消息，一个连接可以同时订阅多个模拟：
+        {"action": "subscribe", "simulation_id": "...", "last_event_id": "..."}
+        {"action": "unsubscribe", "simulation_id": "..."}
+    simulation_id 为空时订阅所有模拟。
+    服务端只发送二进制帧，每帧包含一批长度前缀编码的事件信封（见 utils/event_codec.py）。
+    """
+    await websocket.accept()
+    subscriber = event_hub.create_subscriber()
+    client_id = subscriber.id
+    logger.info(f"WebSocket客户端连接: {client_id}")
+    
+    async def send_loop():
+        """把订阅者缓冲区中积压的事件合并成一个二进制帧发送"""
+        while True:
+            frames = await subscriber.get_batch(MAX_BATCH_EVENTS)
+            await websocket.send_bytes(encode_batch(frames))
+            
+            # 积压过多被断开的慢速客户端，发送完恢复提示后关闭连接
+            if subscriber.closed and not subscriber.buffer:
+                logger.warning(f"WebSocket客户端 {client_id} 消费过慢，已断开，恢复位置: {subscriber.last_event_id}")
+                await websocket.close(code=1013)
+                return
+    
+    sender = asyncio.create_task(send_loop())
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                # 文本帧不是合法JSON时抛出 ValueError，二进制帧没有 text 字段时抛出 KeyError
+                subscriber.put(EventFrame("error", {"message": "控制消息必须是JSON"}))
+                continue
+            _handle_ws_control(subscriber, message)
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket客户端断开连接: {client_id}")
+    finally:
+        sender.cancel()
+        event_hub.unsubscribe(subscriber)
+
+def _handle_ws_control(subscriber, message: Dict[str, Any]) -> None:
+    """处理WebSocket客户端的订阅控制消息，应答同样以事件信封的形式写入缓冲区"""
+    if not isinstance(message, dict):
+        subscriber.put(EventFrame("error", {"message": "控制消息必须是JSON对象"}))
+        return
+    action = message.get("action")
+    simulation_id = message.get("simulation_id") or None
+    
+    if action == "subscribe":
+        if simulation_id is not None and not event_hub.has_channel(simulation_id):
+            subscriber.put(EventFrame("error", {"message": "未找到指定的模拟", "simulation_id": simulation_id}))
+            return
+        # 加入频道与读取回放缓冲区之间没有 await，补发的事件与后续事件无缝衔接
+        event_hub.join(subscriber, simulation_id)
+        subscriber.put(EventFrame("subscribed", {
+            "simulation_id": simulation_id,
+            "is_running": _is_simulation_running(simulation_id)
+        }))
+        for frame in event_hub.replay_since(message.get("last_event_id"), simulation_id):
+            subscriber.put(frame)
+    elif action == "unsubscribe":
+        event_hub.leave(subscriber, simulation_id)
+        subscriber.put(EventFrame("unsubscribed", {"simulation_id": simulation_id}))
+    else:
+        subscriber.put(EventFrame("error", {"message": f"未知的操作: {action}"}))
+
+# 提交批量任务
+@app.post("/api/batches")
+async def create_batch(request: BatchRequest):
+    """
+    无界面地运行 场景 × 人设 × 温度 × 种子 矩阵
+    
+    每次运行作为 batch 优先级的无界面模拟进入执行队列，与界面发起的模拟共用执行槽位，
+    同一批次最多 concurrency 次运行同时进行。对话记录和报告保存在 conversations_log/batches/<批次ID>/。
+    """
+    try:
+        batch = BatchRun(**request.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    batch_runs[batch.id] = batch
+    asyncio.get_running_loop().create_task(batch.run(lambda run: _execute_batch_run(batch, run)))
+    logger.info(f"批量任务已提交: {batch.id}，共 {len(batch.runs)} 次运行")
+    return {"batch_id": batch.id, "total_runs": len(batch.runs), "concurrency": batch.concurrency}
+
+# 获取批量任务列表
+@app.get("/api/batches")
+async def list_batches():
+    """获取所有批量任务的汇总报告"""
+    return [batch.report(include_runs=False) for batch in batch_runs.values()]
+
+# 获取批量任务报告
+@app.get("/api/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """获取批量任务的报告，包括每次运行的明细"""
+    batch = batch_runs.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="未找到指定的批量任务")
+    return batch.report()
+
+async def _execute_batch_run(batch: BatchRun, run: Dict[str, Any]) -> Dict[str, Any]:
+    """把一次批量运行作为无界面模拟提交到执行队列，等待其结束"""
+    try:
+        scenario_text = get_scenario(run["scenario_id"])
+    except ValueError as e:
+        # BatchRun 已校验场景，这里只防止场景在批次运行期间被移除
+        return {"messages": [], "usage": {"prompt_tokens": 0, "completion_tokens": 0}, "error": str(e), "turn_metrics": summarize_turns([]), "stop_reason": None}
+    while True:
+        try:
+            response = _start_simulation(run["scenario_id"], scenario_text, "batch", batch.run_options(run), headless=True)
+            break
+        except QueueFullError as e:
+            # 队列已满时等待空位，而不是让批次失败
+            await asyncio.sleep(e.retry_after or 1)
+    
+    simulation = simulation_manager.get(response["simulation_id"])
+    run["simulation_id"] = simulation.id
+    await simulation.finished.wait()
+    error = simulation.error or (None if simulation.status == STATUS_COMPLETED else f"模拟状态: {simulation.status}")
+    return {
+        "messages": simulation.messages,
+        "usage": simulation.usage,
+        "error": error,
+        "turn_metrics": summarize_turns(simulation.messages),
+        "stop_reason": simulation.stop_reason
+    }
+
+# SSE订阅者统计
+@app.get("/api/events/stats")
+async def event_stream_stats():
+    """获取SSE订阅者数量、缓冲区积压和各溢出策略的触发次数"""
+    stats = event_hub.stats()
+    stats["heartbeats_sent"] = heartbeat_wheel.sent
+    stats["broker"] = event_broker.stats()
+    stats["simulations"] = simulation_manager.stats()
+    stats["executor"] = simulation_process_pool.stats() if simulation_process_pool is not None else {"type": "inline"}
+    stats["model_clients"] = model_client_registry.stats()
+    return stats
 
 # 运行模拟的后台任务
-async def run_simulation(scenario_id: str, scenario_text: str):
+async def run_simulation(simulation: Simulation):
     """
     运行模拟对话
     
+    SIMULATION_EXECUTOR=process 时对话在工作进程中运行，事件经管道发回后由本进程发布；
+    否则直接在当前事件循环中运行。
+    
     参数:
-        scenario_id: 场景ID
-        scenario_text: 场景文本
+        simulation: 由 SimulationManager 登记的模拟
     """
-    global active_simulation, simulation_task, message_history
+    emit = _simulation_emitter(simulation)
+    args = (simulation.id, simulation.scenario_id, simulation.scenario_text)
+    # 写入检查点，从检查点恢复时按原来的优先级和界面模式重新提交
+    options = {
+        **simulation.options,
+        "checkpoint_metadata": {"priority_class": simulation.priority_class, "headless": simulation.headless}
+    }
     
     try:
-        # 设置活动模拟
-        active_simulation = scenario_id
-        logger.info(f"开始模拟: {scenario_id}")
-        
-        # 发送模拟状态更新
-        await event_queue.put({
-            "event": "simulation_status",
-            "data": {"is_running": True}
-        })
-        
-        # 发送初始系统消息
-        await send_agent_message("System", f"开始模拟场景: {scenario_id}")
-        
-        # 创建各种代理
-        logger.info("创建智能体")
-        manager = create_manager_agent(name="Manager", display_name="经理")
-        senior_dev = create_developer_agent(
-            name="SeniorDev",
-            display_name="资深开发",
-            traits="经验丰富、效率高、技术精湛",
-            relationships={"经理": "受到赏识", "初级开发": "有些不耐烦"}
-        )
-        junior_dev = create_developer_agent(
-            name="JuniorDev",
-            display_name="初级开发",
-            traits="有创意但经验不足、工作效率低",
-            relationships={"经理": "感到压力", "资深开发": "有些敬畏"}
-        )
-        designer = create_designer_agent(
-            name="Designer",
-            display_name="设计师",
-            traits="创意丰富、注重细节、有时固执己见",
-            relationships={"经理": "关系中立", "资深开发": "配合良好", "初级开发": "友好"}
-        )
-        
-        # 手动发送一些初始消息，确保前端能够接收到
-        logger.info("发送初始消息")
-        await send_agent_message("Manager", "大家好，我们今天讨论一下这个新项目。")
-        await send_agent_message("SeniorDev", "好的，我已经看过需求文档了，这个项目需要在3个月内完成。")
-        await send_agent_message("JuniorDev", "我对这个项目很感兴趣，希望能学到新技术。")
-        await send_agent_message("Designer", "我已经准备了一些初步的设计方案，等会可以分享给大家。")
-        
-        # 创建消息处理函数
-        async def process_message(message):
-            """处理从AutoGen接收到的消息"""
-            try:
-                # 获取发送者信息
-                source = message.source
-                content = message.content
-                
-                if not content:
-                    logger.warning(f"收到空消息: {source}")
-                    return
-                
-                logger.info(f"处理消息: {source}: {content[:50]}...")
-                
-                # 获取显示名称
-                display_name = AGENT_DISPLAY_NAMES.get(source, source)
-                
-                # 构造消息对象
-                message_id = str(datetime.now().timestamp())
-                timestamp = datetime.now().isoformat()
-                
-                sse_message = {
-                    "id": message_id,
-                    "sender": source,
-                    "sender_display_name": display_name,
-                    "content": content,
-                    "timestamp": timestamp
-                }
-                
-                # 添加到消息历史
-                message_history.append(sse_message)
-                
-                # 发送到SSE事件队列
-                await event_queue.put({
-                    "event": "agent_message",
-                    "data": sse_message
-                })
-                logger.info(f"消息已发送: {message_id}")
-            except Exception as e:
-                logger.error(f"处理消息时出错: {e}")
-                # 尝试发送错误消息
-                await send_agent_message("System", f"处理消息时出错: {str(e)}")
-        
-        try:
-            # 创建智能体列表
-            agents = [manager, senior_dev, junior_dev, designer]
-            
-            # 创建群聊 - 使用 AutoGen 0.4 API
-            logger.info("创建群聊")
-            group_chat = RoundRobinGroupChat(participants=agents, max_turns=20)
-            
-            # 创建取消令牌
-            cancellation_token = CancellationToken()
-            
-            # 创建初始消息
-            initial_message = TextMessage(content=scenario_text, source="System")
-            
-            # 处理初始消息
-            await process_message(initial_message)
-            
-            # 启动群聊 - 使用 AutoGen 0.4 API 的流式接口
-            logger.info("启动群聊")
-            async for message in group_chat.run_stream(
-                task=[initial_message],
-                cancellation_token=cancellation_token
-            ):
-                # 处理每条消息
-                await process_message(message)
-                
-            logger.info("群聊正常结束")
-        except asyncio.CancelledError:
-            logger.warning("群聊被取消")
-            if 'cancellation_token' in locals():
-                cancellation_token.cancel()
-        except Exception as chat_error:
-            logger.error(f"群聊出错: {chat_error}")
-            # 发送错误消息
-            await send_agent_message("System", f"群聊过程中出错: {str(chat_error)}")
-            
-            # 备用方案：如果AutoGen对话失败，手动发送一些消息
-            logger.info("启动备用对话")
-            await send_agent_message("Manager", "看起来我们的系统遇到了一些技术问题。")
-            await send_agent_message("SeniorDev", "我们可以先讨论一下项目的基本需求。根据我的理解，我们需要开发一个多智能体交互系统。")
-            await send_agent_message("JuniorDev", "我对这个项目很感兴趣，特别是前端的实时通信部分。")
-            await send_agent_message("Designer", "我已经准备了一些UI设计草图，主要采用了简洁的界面风格。")
-            await send_agent_message("Manager", "很好，我们可以先从基础功能开始，然后逐步添加更复杂的特性。")
-            await send_agent_message("SeniorDev", "我建议我们使用React和FastAPI作为技术栈，这样可以快速开发出原型。")
-            await send_agent_message("Designer", "我会准备更详细的设计稿，包括颜色方案和组件库。")
-            await send_agent_message("JuniorDev", "我可以负责前端的基础组件开发，需要大约一周时间。")
-            await send_agent_message("Manager", "好的，那我们下周再开会讨论进展。")
-        
-        # 保存对话结果
-        try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"conversation_{timestamp}.json"
-            
-            # 确保目录存在
-            os.makedirs("conversations_log", exist_ok=True)
-            
-            # 保存消息历史
-            if message_history:
-                save_conversation(message_history, filename)
-                logger.info(f"对话已保存: {filename}")
-            else:
-                logger.warning("没有消息可保存")
-        except Exception as save_error:
-            logger.error(f"保存对话失败: {save_error}")
-        
-        # 发送结束消息
-        await send_agent_message("System", "对话已结束，感谢所有参与者的贡献。")
-        
-        logger.info("模拟结束")
-        
-        # 发送模拟状态更新
-        await event_queue.put({
-            "event": "simulation_status",
-            "data": {"is_running": False}
-        })
+        if simulation_process_pool is not None:
+            result = await simulation_process_pool.run(simulation.id, emit, args, options)
+        else:
+            result = await run_conversation(
+                *args,
+                emit=emit,
+                cancellation_token=simulation.cancellation_token,
+                **options
+            )
+        if result:
+            simulation.usage = result["usage"]
+            simulation.stop_reason = result.get("stop_reason")
+            if result["error"]:
+                # 群聊出错后运行器已发送备用对话，这里只记录失败原因
+                simulation.status = STATUS_FAILED
+                simulation.error = result["error"]
     except asyncio.CancelledError:
         logger.info("模拟被取消")
-        await send_agent_message("System", "模拟已被用户取消。")
+        await send_agent_message(simulation, "System", "模拟已被用户取消。")
+    except WorkerCrashedError as e:
+        logger.error(f"模拟 {simulation.id} 的工作进程崩溃: {e}")
+        simulation.status = STATUS_FAILED
+        simulation.error = str(e)
+        await send_agent_message(simulation, "System", f"模拟工作进程异常退出: {str(e)}")
+        emit("simulation_status", {"is_running": False}, True)
     except Exception as e:
         logger.error(f"模拟出错: {e}")
         error_traceback = traceback.format_exc()
         logger.error(error_traceback)
+        simulation.status = STATUS_FAILED
+        simulation.error = str(e)
         
         # 发送错误消息到前端
-        await send_agent_message("System", f"模拟运行出错: {str(e)}\n请检查后端日志获取详细信息。")
+        await send_agent_message(simulation, "System", f"模拟运行出错: {str(e)}\n请检查后端日志获取详细信息。")
     finally:
-        active_simulation = None
+        if simulation.status == STATUS_STOPPING:
+            # 被用户停止的模拟不再恢复；后端关闭导致的取消保留检查点
+            checkpoint_store.delete(simulation.id)
+        # 模拟结束后关闭频道，最后一个订阅者离开时释放其缓冲区
+        event_hub.close_channel(simulation.id)
         logger.info("模拟完全结束")
 
+def _simulation_emitter(simulation: Simulation):
+    """构造模拟的事件回调：agent_message 记入模拟的消息记录，其余事件发布到模拟的频道（无界面模拟除外）"""
+    def emit(event_type: str, data: Dict[str, Any], replay: bool = True) -> None:
+        if event_type == "agent_message":
+            simulation.messages.append(data)
+        if simulation.headless:
+            return
+        if replay:
+            event_hub.publish_event(simulation.id, event_type, data)
+        else:
+            event_hub.publish(simulation.id, EventFrame(event_type, data))
+    return emit
+
 # 启动应用
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=os.getenv("BACKEND_RELOAD", "true").lower() == "true") 
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+批量模拟
+按 场景 × 人设 × 采样温度 × 随机种子 的矩阵无界面地运行模拟，统计吞吐量、模型用量和失败数量
+
+命令行用法（在项目根目录执行）:
+    python -m conversations.batch --scenarios casual_chat,team_meeting --temperatures 0.3,0.7 --seeds 1,2
+    python -m conversations.batch --matrix matrix.json --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import itertools
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from autogen_core import CancellationToken
+
+from conversations.scenarios import SCENARIOS
+from conversations.runner import run_conversation, DEFAULT_PERSONAS, DEFAULT_TEMPERATURE, DEFAULT_SEED, TEAM_MODES
+from conversations.termination import resolve_termination
+from agents.context_policies import CONTEXT_POLICIES
+
+logger = logging.getLogger(__name__)
+
+# 同一批次同时运行的模拟数量
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# 单个批次允许的最大运行次数
+MAX_BATCH_RUNS = int(os.getenv("BATCH_MAX_RUNS", "1000"))
+
+# 批量对话记录的保存目录，每个批次一个子目录
+BATCH_LOG_DIR = os.path.join("conversations_log", "batches")
+
+# 单次运行的执行函数：接收运行描述，返回 run_conversation 的结果
+Execute = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class BatchRun:
+    """
+    一个批次的模拟矩阵
+
+    矩阵中的每个组合重复 repeats 次，最多 concurrency 个同时运行。
+    人设以 {名称: 覆盖项} 的形式给出，覆盖项的格式见 conversations.runner.create_agents。
+    """
+
+    def __init__(
+        self,
+        scenarios: List[str],
+        personas: Optional[Dict[str, Dict[str, Any]]] = None,
+        temperatures: Optional[List[float]] = None,
+        seeds: Optional[List[int]] = None,
+        repeats: int = 1,
+        concurrency: Optional[int] = None,
+        use_cache: bool = True,
+        context_policy: Optional[str] = None,
+        context_token_limit: Optional[int] = None,
+        team_mode: Optional[str] = None,
+        termination: Optional[Dict[str, Any]] = None,
+        batch_id: Optional[str] = None
+    ):
+        unknown = [scenario_id for scenario_id in scenarios if scenario_id not in SCENARIOS]
+        if not scenarios or unknown:
+            raise ValueError(f"未知的场景: {unknown}. 可用场景: {list(SCENARIOS)}")
+        if context_policy is not None and context_policy not in CONTEXT_POLICIES:
+            raise ValueError(f"未知的上下文策略: {context_policy}. 可用策略: {list(CONTEXT_POLICIES)}")
+        if team_mode is not None and team_mode not in TEAM_MODES:
+            raise ValueError(f"未知的群聊模式: {team_mode}. 可用模式: {list(TEAM_MODES)}")
+        resolve_termination(termination)
+        personas = personas or {"default": {}}
+        for overrides in personas.values():
+            unknown_agents = set(overrides) - set(DEFAULT_PERSONAS)
+            if unknown_agents:
+                raise ValueError(f"未知的智能体: {sorted(unknown_agents)}. 可用智能体: {list(DEFAULT_PERSONAS)}")
+
+        self.id = batch_id or datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6]
+        self.concurrency = max(concurrency or BATCH_CONCURRENCY, 1)
+        self.log_dir = os.path.join(BATCH_LOG_DIR, self.id)
+        self.personas = personas
+        self.use_cache = use_cache
+        self.context_policy = context_policy
+        self.context_token_limit = context_token_limit
+        self.team_mode = team_mode
+        self.termination = termination
+        self.status = "pending"
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        matrix = itertools.product(
+            scenarios,
+            personas,
+            temperatures or [DEFAULT_TEMPERATURE],
+            seeds or [DEFAULT_SEED],
+            range(max(repeats, 1))
+        )
+        self.runs: List[Dict[str, Any]] = [
+            {
+                "run_id": f"{self.id}-{index:04d}",
+                "scenario_id": scenario_id,
+                "persona": persona,
+                "temperature": temperature,
+                "seed": seed,
+                "repeat": repeat,
+                "status": "pending",
+                "duration": None,
+                "usage": None,
+                "agents": None,
+                "stop_reason": None,
+                "error": None
+            }
+            for index, (scenario_id, persona, temperature, seed, repeat) in enumerate(matrix)
+        ]
+        if len(self.runs) > MAX_BATCH_RUNS:
+            raise ValueError(f"批次包含 {len(self.runs)} 次运行，超过上限 {MAX_BATCH_RUNS}")
+
+    def run_options(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """返回传给 run_conversation 的额外参数"""
+        return {
+            "personas": self.personas[run["persona"]],
+            "temperature": run["temperature"],
+            "seed": run["seed"],
+            "use_cache": self.use_cache,
+            "context_policy": self.context_policy,
+            "context_token_limit": self.context_token_limit,
+            "team_mode": self.team_mode,
+            "termination": self.termination,
+            "log_dir": self.log_dir,
+            # 批量运行失败后整批重跑，不需要逐个恢复
+            "save_checkpoints": False
+        }
+
+    async def run(self, execute: Optional[Execute] = None) -> Dict[str, Any]:
+        """
+        运行整个批次
+
+        参数:
+            execute: 单次运行的执行函数，默认在当前事件循环中直接调用 run_conversation
+
+        返回:
+            dict: 批次报告，见 report
+        """
+        execute = execute or self._execute_inline
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.status = "running"
+        self.started_at = time.monotonic()
+        logger.info(f"批次 {self.id} 开始: {len(self.runs)} 次运行，并发 {self.concurrency}")
+
+        async def run_one(run: Dict[str, Any]) -> None:
+            async with semaphore:
+                run["status"] = "running"
+                started = time.monotonic()
+                try:
+                    result = await execute(run)
+                    run["usage"] = result["usage"]
+                    run["agents"] = result.get("turn_metrics")
+                    run["stop_reason"] = result.get("stop_reason")
+                    run["error"] = result["error"]
+                    run["status"] = "failed" if result["error"] else "completed"
+                except asyncio.CancelledError:
+                    run["status"] = "cancelled"
+                    raise
+                except Exception as e:
+                    logger.error(f"批次运行 {run['run_id']} 出错: {e}")
+                    run["error"] = str(e)
+                    run["status"] = "failed"
+                finally:
+                    run["duration"] = round(time.monotonic() - started, 2)
+                logger.info(f"批次运行 {run['run_id']} 结束: {run['status']}（{run['duration']} 秒）")
+
+        try:
+            await asyncio.gather(*(run_one(run) for run in self.runs))
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+            self.save_report()
+        return self.report()
+
+    async def _execute_inline(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """在当前事件循环中运行一次对话，不发布任何事件"""
+        return await run_conversation(
+            run["run_id"],
+            run["scenario_id"],
+            SCENARIOS[run["scenario_id"]],
+            emit=lambda event_type, data, replay=True: None,
+            cancellation_token=CancellationToken(),
+            **self.run_options(run)
+        )
+
+    def report(self, include_runs: bool = True) -> Dict[str, Any]:
+        """
+        生成批次报告
+
+        参数:
+            include_runs: 是否包含每次运行的明细
+
+        返回:
+            dict: 运行数量、吞吐量（次/分钟、token/秒）、模型用量、失败数量和按场景汇总的耗时与用量
+        """
+        counts = {status: 0 for status in ("pending", "running", "completed", "failed", "cancelled")}
+        for run in self.runs:
+            counts[run["status"]] += 1
+        prompt_tokens = sum(run["usage"]["prompt_tokens"] for run in self.runs if run["usage"])
+        completion_tokens = sum(run["usage"]["completion_tokens"] for run in self.runs if run["usage"])
+
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        finished = counts["completed"] + counts["failed"]
+
+        report = {
+            "batch_id": self.id,
+            "status": self.status,
+            "total_runs": len(self.runs),
+            **counts,
+            "concurrency": self.concurrency,
+            "elapsed_seconds": round(elapsed, 2) if elapsed is not None else None,
+            "runs_per_minute": round(finished / elapsed * 60, 2) if elapsed else None,
+            "tokens": {
+                "prompt": prompt_tokens,
+                "completion": completion_tokens,
+                "total": prompt_tokens + completion_tokens
+            },
+            "tokens_per_second": round((prompt_tokens + completion_tokens) / elapsed, 2) if elapsed else None,
+            "by_scenario": self._scenario_report(),
+            "by_stop_reason": self._stop_reason_report(),
+            "log_dir": self.log_dir
+        }
+        if include_runs:
+            report["runs"] = self.runs
+        return report
+
+    def _scenario_report(self) -> Dict[str, Dict[str, Any]]:
+        """按场景汇总已结束运行的耗时、令牌用量和模型延迟，用于容量规划和成本估算"""
+        scenarios: Dict[str, Dict[str, Any]] = {}
+        for run in self.runs:
+            if run["usage"] is None:
+                continue
+            scenario = scenarios.setdefault(run["scenario_id"], {
+                "runs": 0, "duration": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                "turns": 0, "model_latency": 0.0, "cached_turns": 0
+            })
+            scenario["runs"] += 1
+            scenario["duration"] += run["duration"] or 0.0
+            scenario["prompt_tokens"] += run["usage"]["prompt_tokens"]
+            scenario["completion_tokens"] += run["usage"]["completion_tokens"]
+            for agent in (run["agents"] or {}).values():
+                scenario["turns"] += agent["turns"]
+                scenario["model_latency"] += agent["latency"]
+                scenario["cached_turns"] += agent["cached_turns"]
+
+        for scenario in scenarios.values():
+            scenario["average_duration"] = round(scenario.pop("duration") / scenario["runs"], 2)
+            scenario["average_tokens"] = round((scenario["prompt_tokens"] + scenario["completion_tokens"]) / scenario["runs"])
+            latency = scenario.pop("model_latency")
+            scenario["average_turn_latency"] = round(latency / scenario["turns"], 3) if scenario["turns"] else None
+        return scenarios
+
+    def _stop_reason_report(self) -> Dict[str, int]:
+        """按结束原因统计已结束的运行数，用于判断预算和终止条件是否合适"""
+        counts: Dict[str, int] = {}
+        for run in self.runs:
+            if run["stop_reason"]:
+                kind = run["stop_reason"]["type"]
+                counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def save_report(self) -> str:
+        """把批次报告写入批次目录的 summary.json"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        output_file = os.path.join(self.log_dir, "summary.json")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        return output_file
+
+
+def _split(value: Optional[str], cast) -> Optional[list]:
+    return [cast(item.strip()) for item in value.split(",") if item.strip()] if value else None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="批量运行模拟矩阵（场景 × 人设 × 温度 × 种子）")
+    parser.add_argument("--matrix", help="JSON 格式的矩阵文件，字段同 POST /api/batches")
+    parser.add_argument("--scenarios", help="逗号分隔的场景ID")
+    parser.add_argument("--personas", help="JSON 文件，格式为 {人设名称: {智能体名称: 覆盖项}}")
+    parser.add_argument("--temperatures", help="逗号分隔的采样温度")
+    parser.add_argument("--seeds", help="逗号分隔的随机种子")
+    parser.add_argument("--repeats", type=int, help="每个组合的重复次数")
+    parser.add_argument("--concurrency", type=int, help=f"同时运行的模拟数量（默认 {BATCH_CONCURRENCY}）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用模型响应缓存")
+    parser.add_argument("--context-policy", choices=CONTEXT_POLICIES, help="智能体的上下文策略")
+    parser.add_argument("--context-token-limit", type=int, help="上下文的令牌预算")
+    parser.add_argument("--team-mode", choices=TEAM_MODES, help="群聊模式，默认 round_robin")
+    parser.add_argument("--termination", help='JSON 格式的终止条件，例如 \'{"deadline": 120, "token_budget": 20000}\'')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    matrix: Dict[str, Any] = {}
+    if args.matrix:
+        with open(args.matrix, 'r', encoding='utf-8') as f:
+            matrix = json.load(f)
+    if args.personas:
+        with open(args.personas, 'r', encoding='utf-8') as f:
+            matrix["personas"] = json.load(f)
+    matrix["scenarios"] = _split(args.scenarios, str) or matrix.get("scenarios") or list(SCENARIOS)
+    matrix["temperatures"] = _split(args.temperatures, float) or matrix.get("temperatures")
+    matrix["seeds"] = _split(args.seeds, int) or matrix.get("seeds")
+    matrix["repeats"] = args.repeats or matrix.get("repeats", 1)
+    matrix["concurrency"] = args.concurrency or matrix.get("concurrency")
+    if args.no_cache:
+        matrix["use_cache"] = False
+    if args.context_policy:
+        matrix["context_policy"] = args.context_policy
+    if args.context_token_limit:
+        matrix["context_token_limit"] = args.context_token_limit
+    if args.team_mode:
+        matrix["team_mode"] = args.team_mode
+
+    try:
+        if args.termination:
+            matrix["termination"] = json.loads(args.termination)
+        batch = BatchRun(**matrix)
+    except (TypeError, ValueError) as e:
+        print(f"矩阵无效: {e}")
+        return 2
+
+    report = asyncio.run(batch.run())
+    print(json.dumps(report | {"runs": len(report["runs"])}, ensure_ascii=False, indent=2))
+    print(f"报告已保存到: {os.path.join(batch.log_dir, 'summary.json')}")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
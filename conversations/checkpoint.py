@@ -0,0 +1,191 @@
+"""
+模拟检查点
+运行中定期把群聊和智能体的状态（AutoGen 的 save_state）连同消息记录写入检查点目录，
+后端重启、崩溃或部署后可以从最近的检查点恢复模拟，已经完成的发言不需要重新生成
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage
+from autogen_agentchat.teams import RoundRobinGroupChat
+
+logger = logging.getLogger(__name__)
+
+# 检查点目录，每个模拟一个 JSON 文件
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+
+# 每多少条智能体消息写一次检查点，0 表示不写（默认）；每次都会写入完整的消息记录，间隔过小会增加长时间模拟的开销
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "0"))
+
+# 后端启动时是否自动恢复检查点目录中的模拟
+CHECKPOINT_AUTO_RESUME = os.getenv("CHECKPOINT_AUTO_RESUME", "false").lower() == "true"
+
+# 检查点格式版本，格式不兼容时拒绝恢复
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointStore:
+    """按模拟ID读写检查点文件，写入时先写临时文件再替换，进程中途退出不会留下不完整的检查点"""
+
+    def __init__(self, directory: str = CHECKPOINT_DIR):
+        self.directory = directory
+        self.saved = 0
+        self.failed = 0
+
+    def _path(self, simulation_id: str) -> str:
+        return os.path.join(self.directory, f"{simulation_id}.json")
+
+    def save(self, checkpoint: Dict[str, Any]) -> None:
+        """写入检查点，失败时只记录日志，不影响模拟"""
+        path = self._path(checkpoint["simulation_id"])
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+            self.saved += 1
+        except (OSError, TypeError, ValueError) as e:
+            self.failed += 1
+            logger.warning(f"写入检查点失败: {path}: {e}")
+
+    async def save_async(self, checkpoint: Dict[str, Any]) -> None:
+        """在线程中写入检查点，序列化和写文件不阻塞事件循环；调用方不应再修改 checkpoint 中的数据"""
+        await asyncio.to_thread(self.save, checkpoint)
+
+    def load(self, simulation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取检查点
+
+        参数:
+            simulation_id: 模拟ID
+
+        返回:
+            dict: 检查点，不存在时返回 None
+
+        异常:
+            ValueError: 检查点损坏或版本不兼容
+        """
+        path = self._path(simulation_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"检查点已损坏: {path}: {e}")
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"检查点版本不兼容: {checkpoint.get('version')}，当前版本: {CHECKPOINT_VERSION}")
+        return checkpoint
+
+    def delete(self, simulation_id: str) -> None:
+        """删除检查点（模拟正常结束或被用户停止后不再需要恢复）"""
+        try:
+            os.remove(self._path(simulation_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除检查点失败: {simulation_id}: {e}")
+
+    def list(self) -> List[Dict[str, Any]]:
+        """列出可以恢复的检查点摘要，按保存时间降序"""
+        if not os.path.isdir(self.directory):
+            return []
+        checkpoints = []
+        for file in os.listdir(self.directory):
+            if not file.endswith(".json"):
+                continue
+            try:
+                checkpoint = self.load(file[:-len(".json")])
+            except ValueError as e:
+                logger.warning(str(e))
+                continue
+            if checkpoint is not None:
+                checkpoints.append({
+                    "simulation_id": checkpoint["simulation_id"],
+                    "scenario_id": checkpoint["scenario_id"],
+                    "team_mode": checkpoint["team_mode"],
+                    "priority_class": checkpoint.get("priority_class"),
+                    "headless": checkpoint.get("headless", False),
+                    "message_count": len(checkpoint["messages"]),
+                    "turns": checkpoint["turns"],
+                    "elapsed": checkpoint["elapsed"],
+                    "saved_at": checkpoint["saved_at"]
+                })
+        checkpoints.sort(key=lambda checkpoint: checkpoint["saved_at"], reverse=True)
+        return checkpoints
+
+
+# 进程内共享的检查点存储
+checkpoint_store = CheckpointStore()
+
+
+async def save_team_state(team: Any, participants: List[str]) -> Dict[str, Any]:
+    """
+    保存群聊状态
+
+    参数:
+        team: RoundRobinGroupChat 或 ParallelRoundGroupChat
+        participants: 参与者名称
+
+    返回:
+        dict: 群聊状态，可交给同类群聊的 load_state
+    """
+    state = dict(await team.save_state())
+    if isinstance(team, RoundRobinGroupChat):
+        # 检查点在群聊管理器计入本轮发言之前写入，恢复后应从下一轮开始计数
+        for name, agent_state in state["agent_states"].items():
+            if name not in participants and "current_turn" in agent_state:
+                agent_state["current_turn"] += 1
+    return state
+
+
+class CheckpointTrigger(TerminationCondition):
+    """
+    定期写检查点的钩子，本身从不结束模拟
+
+    群聊在选择下一位发言者之前检查终止条件，这时没有参与者在生成回复，保存的群聊状态是一致的；
+    如果在运行器收到消息时保存，下一位发言者可能已经开始生成，恢复后会被跳过。
+    """
+
+    def __init__(
+        self,
+        save: Callable[[Sequence[BaseChatMessage]], Awaitable[None]],
+        participants: List[str],
+        interval: int = CHECKPOINT_INTERVAL
+    ):
+        """
+        参数:
+            save: 写检查点的回调，接收本次检查的智能体消息（运行器可能还没有收到它们）
+            participants: 参与者名称，只统计它们的消息
+            interval: 每多少条智能体消息写一次
+        """
+        self.save = save
+        self.participants = participants
+        self.interval = max(interval, 1)
+        self.count = 0
+
+    @property
+    def terminated(self) -> bool:
+        return False
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        delta = [message for message in messages if isinstance(message, BaseChatMessage) and message.source in self.participants]
+        if not delta:
+            return None
+        previous = self.count
+        self.count += len(delta)
+        if self.count // self.interval > previous // self.interval:
+            try:
+                await self.save(delta)
+            except Exception as e:
+                logger.warning(f"写入检查点失败: {e}")
+        return None
+
+    async def reset(self) -> None:
+        pass
+
@@ -0,0 +1,184 @@
+"""
+重复与循环检测
+智能体轮流发言时容易陷入互相客套、重复彼此的循环，把剩余的发言数都耗在没有新内容的消息上。
+每条消息到达时用 NumPy 计算字符 shingle 的 MinHash 签名，与各智能体最近的消息比较估算 Jaccard 相似度，
+连续多条消息相似度超过阈值时先提示智能体换个方向（redirect），仍然重复则结束模拟（stop）
+"""
+import os
+import re
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage
+
+logger = logging.getLogger(__name__)
+
+# 检测到循环时的动作：off 不检测，stop 结束模拟，redirect 先提示智能体换个方向，提示次数用完后结束；
+# 默认关闭，与缓存、限流等可选功能一致，需要时通过环境变量或请求的 termination.loop_action 开启
+LOOP_ACTIONS = ("off", "stop", "redirect")
+LOOP_ACTION = os.getenv("LOOP_ACTION", "off")
+
+# 两条消息的估算相似度达到该值时视为重复
+LOOP_THRESHOLD = float(os.getenv("LOOP_THRESHOLD", "0.75"))
+
+# 连续多少条重复消息视为陷入循环
+LOOP_PATIENCE = int(os.getenv("LOOP_PATIENCE", "2"))
+
+# 每个智能体保留用于比较的最近消息数
+LOOP_HISTORY = int(os.getenv("LOOP_HISTORY", "3"))
+
+# redirect 模式下最多提示的次数
+LOOP_MAX_REDIRECTS = int(os.getenv("LOOP_MAX_REDIRECTS", "1"))
+
+# MinHash 的哈希函数个数和 shingle 的字符数；中文没有空格分词，按相邻两个字符切分
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 2
+
+REDIRECT_PROMPT = "（系统提示）最近几条发言内容高度重复。请不要再重复已经说过的话，推进讨论：提出新的问题、做出决定或总结分工。"
+
+# 梅森素数 2^31 - 1，所有中间结果都在 uint64 范围内
+_PRIME = np.uint64((1 << 31) - 1)
+_BASE = np.uint64(1_000_003)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class MinHasher:
+    """
+    计算文本的 MinHash 签名
+
+    两个签名相同位置的取值相等的比例是两段文本 shingle 集合 Jaccard 相似度的无偏估计。
+    """
+
+    def __init__(self, num_permutations: int = NUM_PERMUTATIONS, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.shingle_size = shingle_size
+        self._a = rng.integers(1, int(_PRIME), size=num_permutations, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), size=num_permutations, dtype=np.uint64)
+        self._powers = np.array([pow(int(_BASE), i, int(_PRIME)) for i in range(shingle_size)], dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """把文本切成字符 shingle 并哈希为 [0, 2^31-1) 的整数"""
+        codes = np.frombuffer(_WHITESPACE.sub("", text).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        if len(codes) < self.shingle_size:
+            codes = np.pad(codes, (0, self.shingle_size - len(codes)))
+        windows = np.lib.stride_tricks.sliding_window_view(codes, self.shingle_size)
+        return np.unique((windows * self._powers).sum(axis=1) % _PRIME)
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        计算签名
+
+        参数:
+            text: 消息内容
+
+        返回:
+            np.ndarray: 长度为 num_permutations 的 uint64 数组
+        """
+        shingles = self.shingles(text)
+        return ((self._a[:, None] * shingles[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+
+class LoopDetector:
+    """
+    增量检测重复消息
+
+    每个智能体保留最近 history 条消息的签名；新消息与所有智能体保留的签名一起比较，
+    因此既能发现智能体重复自己，也能发现互相附和。
+    """
+
+    def __init__(self, threshold: float = LOOP_THRESHOLD, history: int = LOOP_HISTORY, hasher: Optional[MinHasher] = None):
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+        self._signatures: Dict[str, Deque[np.ndarray]] = {}
+        self._history = history
+        # 连续重复的消息数
+        self.streak = 0
+        self.last_similarity = 0.0
+
+    def observe(self, source: str, text: str) -> float:
+        """
+        记录一条消息
+
+        参数:
+            source: 发送者
+            text: 消息内容
+
+        返回:
+            float: 与最近消息的最大估算相似度
+        """
+        signature = self.hasher.signature(text)
+        recent = [previous for signatures in self._signatures.values() for previous in signatures]
+        similarity = float((np.stack(recent) == signature).mean(axis=1).max()) if recent else 0.0
+        self._signatures.setdefault(source, deque(maxlen=self._history)).append(signature)
+        self.streak = self.streak + 1 if similarity >= self.threshold else 0
+        self.last_similarity = similarity
+        return similarity
+
+    def reset_streak(self) -> None:
+        self.streak = 0
+
+
+class LoopTermination(TerminationCondition):
+    """
+    陷入循环时提示或结束
+
+    群聊在选择下一位发言者之前检查终止条件，因此 redirect 的提示会出现在下一位发言者的上下文中。
+    """
+
+    def __init__(
+        self,
+        participants: List[str],
+        action: str = LOOP_ACTION,
+        threshold: float = LOOP_THRESHOLD,
+        patience: int = LOOP_PATIENCE,
+        max_redirects: int = LOOP_MAX_REDIRECTS,
+        redirect: Optional[Callable[[str], Awaitable[None]]] = None
+    ):
+        """
+        参数:
+            participants: 参与检测的智能体名称
+            action: stop 或 redirect
+            threshold: 相似度阈值
+            patience: 连续多少条重复消息视为循环
+            max_redirects: 最多提示的次数
+            redirect: 提示回调，接收提示文本，负责把提示加入智能体的上下文
+        """
+        self.participants = participants
+        self.action = action
+        self.threshold = threshold
+        self.patience = patience
+        self.max_redirects = max_redirects if action == "redirect" and redirect is not None else 0
+        self.redirect = redirect
+        self.detector = LoopDetector(threshold)
+        self.redirects = 0
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        for message in messages:
+            if not isinstance(message, BaseChatMessage) or message.source not in self.participants:
+                continue
+            similarity = self.detector.observe(message.source, message.to_text())
+            if self.detector.streak < self.patience:
+                continue
+            if self.redirects < self.max_redirects:
+                self.redirects += 1
+                self.detector.reset_streak()
+                logger.info(f"检测到重复发言（相似度 {similarity:.2f}），提示智能体换个方向")
+                await self.redirect(REDIRECT_PROMPT)
+                continue
+            self._terminated = True
+            return StopMessage(
+                content=f"连续 {self.detector.streak} 条消息与之前的发言高度重复（相似度 {similarity:.2f}）",
+                source="LoopTermination"
+            )
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
@@ -0,0 +1,210 @@
+"""
+并行轮次群聊
+每轮先由主持人（第一个参与者，通常是经理）发言，其余参与者基于同一份对话快照同时生成回复，
+一轮的耗时从 N 次模型往返缩短到大约 1 次；回复按参与者顺序发布，保证对话记录与执行快慢无关
+"""
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Mapping, Optional, Sequence, Union
+
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response, TaskResult, TerminationCondition
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, MessageFactory
+from autogen_core import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+
+class ParallelRoundGroupChat:
+    """
+    并行轮次群聊
+
+    与 RoundRobinGroupChat 的 run_stream 产出相同类型的项：先是任务消息，然后是智能体的事件
+    （流式分片实时转发，多个智能体的分片会交错出现）和完整消息，最后是 TaskResult。
+    max_turns 按智能体消息计数，最后一轮名额不足时只让排在前面的参与者回复。
+    终止条件按发布顺序逐条检查消息，满足后同一轮中排在后面的回复不再发布。
+    save_state/load_state 与 AutoGen 群聊的同名方法对应，用于检查点。
+    """
+
+    def __init__(
+        self,
+        participants: List[BaseChatAgent],
+        max_turns: int = 20,
+        termination_condition: Optional[TerminationCondition] = None
+    ):
+        """
+        参数:
+            participants: 参与者，第一个为主持人
+            max_turns: 最多的智能体消息数
+            termination_condition: 终止条件，与 RoundRobinGroupChat 的同名参数相同
+        """
+        if len(participants) < 2:
+            raise ValueError("并行轮次群聊至少需要两个参与者")
+        self.participants = participants
+        self.moderator = participants[0]
+        self.responders = participants[1:]
+        self.max_turns = max_turns
+        self.termination_condition = termination_condition
+        # 每个参与者尚未看到的消息，轮到它发言时一并交给它
+        self._pending: Dict[str, List[BaseChatMessage]] = {agent.name: [] for agent in participants}
+        # 本轮已生成、尚未按顺序发布的回复
+        self._unpublished: List[BaseChatMessage] = []
+        # 已发布的智能体消息数，和下一步由主持人（0）还是其余参与者（1）发言
+        self._turns = 0
+        self._phase = 0
+        self._stop_reason: Optional[str] = None
+
+    def _publish(self, message: BaseChatMessage) -> None:
+        """把消息加入除发送者以外所有参与者的待读列表"""
+        for name, pending in self._pending.items():
+            if name != message.source:
+                pending.append(message)
+
+    def _take(self, agent: BaseChatAgent) -> List[BaseChatMessage]:
+        messages = self._pending[agent.name]
+        self._pending[agent.name] = []
+        return messages
+
+    async def _respond(
+        self,
+        agent: BaseChatAgent,
+        messages: Sequence[BaseChatMessage],
+        events: "asyncio.Queue[BaseAgentEvent | BaseChatMessage]",
+        cancellation_token: CancellationToken
+    ) -> Optional[BaseChatMessage]:
+        """运行一个参与者，事件放入队列，返回它的回复"""
+        async for item in agent.on_messages_stream(messages, cancellation_token):
+            if isinstance(item, Response):
+                return item.chat_message
+            events.put_nowait(item)
+        return None
+
+    async def _run_round(
+        self,
+        agents: List[BaseChatAgent],
+        cancellation_token: CancellationToken
+    ) -> AsyncGenerator[BaseAgentEvent | BaseChatMessage, None]:
+        """
+        让一组参与者基于同一份快照同时回复
+
+        所有参与者的输入在启动任何一个之前取出，因此同一轮内谁也看不到别人的回复；
+        事件按到达顺序产出，全部完成后回复按参与者顺序放入待发布列表。
+        """
+        inputs = [self._take(agent) for agent in agents]
+        events: "asyncio.Queue[BaseAgentEvent | BaseChatMessage]" = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._respond(agent, messages, events, cancellation_token))
+            for agent, messages in zip(agents, inputs)
+        ]
+        finished = asyncio.gather(*tasks)
+        try:
+            while not finished.done():
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, finished}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            while not events.empty():
+                yield events.get_nowait()
+            replies = finished.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if not finished.done():
+                finished.cancel()
+
+        self._unpublished = [reply for reply in replies if reply is not None]
+
+    async def _publish_replies(self, transcript: List[BaseChatMessage]) -> AsyncGenerator[BaseChatMessage, None]:
+        """按顺序发布待发布的回复，每条都检查终止条件；满足后剩余的回复丢弃"""
+        while self._unpublished and self._stop_reason is None:
+            reply = self._unpublished.pop(0)
+            transcript.append(reply)
+            self._publish(reply)
+            self._turns += 1
+            if self.termination_condition is not None:
+                stop = await self.termination_condition([reply])
+                self._stop_reason = stop.content if stop is not None else None
+            yield reply
+        self._unpublished = []
+
+    async def run_stream(
+        self,
+        task: Optional[Sequence[BaseChatMessage]] = None,
+        cancellation_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[Union[BaseAgentEvent, BaseChatMessage, TaskResult], None]:
+        """
+        运行群聊
+
+        参数:
+            task: 任务消息，为空时从 load_state 恢复的位置继续
+            cancellation_token: 取消令牌
+
+        返回:
+            AsyncGenerator: 任务消息、智能体事件和消息，最后是 TaskResult
+        """
+        cancellation_token = cancellation_token or CancellationToken()
+        transcript: List[BaseChatMessage] = []
+        self._stop_reason = None
+        for message in task or []:
+            transcript.append(message)
+            self._publish(message)
+            yield message
+        if task and self.termination_condition is not None:
+            stop = await self.termination_condition(list(task))
+            self._stop_reason = stop.content if stop is not None else None
+
+        # 从检查点恢复时，先发布上次已经生成但尚未发布的回复
+        async for reply in self._publish_replies(transcript):
+            yield reply
+
+        while self._stop_reason is None and self._turns < self.max_turns:
+            remaining = self.max_turns - self._turns
+            # 主持人先发言，其余参与者在剩余名额内同时回复
+            agents = [self.moderator] if self._phase == 0 else self.responders[:remaining]
+            async for event in self._run_round(agents, cancellation_token):
+                yield event
+            self._phase = 1 - self._phase
+            async for reply in self._publish_replies(transcript):
+                yield reply
+            if self._phase == 0:
+                logger.info(f"并行轮次完成，共 {self._turns} 条消息")
+
+        stop_reason = self._stop_reason or f"Maximum number of turns {self.max_turns} reached."
+        # 与 AutoGen 的群聊一样，结束后重置计数和终止条件，再次运行时重新计数
+        self._turns = 0
+        self._phase = 0
+        if self.termination_condition is not None:
+            await self.termination_condition.reset()
+        yield TaskResult(messages=transcript, stop_reason=stop_reason)
+
+    async def save_state(self) -> Mapping[str, Any]:
+        """
+        保存群聊状态：各参与者的状态、尚未看到的消息、已生成但尚未发布的回复和发言计数
+
+        在终止条件中调用时所有参与者都没有在生成回复，保存的状态是一致的。
+        """
+        return {
+            "type": "ParallelRoundGroupChatState",
+            "agent_states": {agent.name: await agent.save_state() for agent in self.participants},
+            "pending": {name: [message.dump() for message in messages] for name, messages in self._pending.items()},
+            "unpublished": [message.dump() for message in self._unpublished],
+            "turns": self._turns,
+            "phase": self._phase
+        }
+
+    async def load_state(self, state: Mapping[str, Any]) -> None:
+        """加载 save_state 保存的状态"""
+        factory = MessageFactory()
+        for agent in self.participants:
+            if agent.name not in state["agent_states"]:
+                raise ValueError(f"保存的状态中没有参与者 {agent.name}")
+            await agent.load_state(state["agent_states"][agent.name])
+        self._pending = {
+            agent.name: [factory.create(message) for message in state["pending"].get(agent.name, [])]
+            for agent in self.participants
+        }
+        self._unpublished = [factory.create(message) for message in state["unpublished"]]
+        self._turns = state["turns"]
+        self._phase = state["phase"]
@@ -0,0 +1,495 @@
+"""
+模拟对话运行器
+创建智能体并运行群聊，所有输出通过 emit 回调发出，因此既可以在 API 进程内运行，也可以在工作进程中运行
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from autogen_agentchat.base import TaskResult, TerminationCondition
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_agentchat.messages import TextMessage, ModelClientStreamingChunkEvent
+from autogen_core import CancellationToken
+from autogen_core.models import UserMessage
+
+from agents.manager import create_manager_agent
+from agents.developer import create_developer_agent
+from agents.designer import create_designer_agent
+from agents.call_context import current_simulation
+from conversations.parallel_team import ParallelRoundGroupChat
+from conversations.termination import SimulationTermination, resolve_termination, remaining_termination, DEADLINE_GRACE
+from conversations.checkpoint import CheckpointTrigger, checkpoint_store, save_team_state, CHECKPOINT_INTERVAL, CHECKPOINT_VERSION
+from agents.turn_metrics import turn_metrics, summarize_turns
+from utils.logging_utils import save_conversation
+
+logger = logging.getLogger(__name__)
+
+# 事件回调：(事件类型, 事件数据, 是否进入回放缓冲区)
+Emit = Callable[[str, Dict[str, Any], bool], None]
+
+# 默认的智能体人设，键为智能体名称，值为对应工厂函数的参数
+DEFAULT_PERSONAS = {
+    "Manager": {
+        "factory": create_manager_agent,
+        "display_name": "经理"
+    },
+    "SeniorDev": {
+        "factory": create_developer_agent,
+        "display_name": "资深开发",
+        "traits": "经验丰富、效率高、技术精湛",
+        "relationships": {"经理": "受到赏识", "初级开发": "有些不耐烦"}
+    },
+    "JuniorDev": {
+        "factory": create_developer_agent,
+        "display_name": "初级开发",
+        "traits": "有创意但经验不足、工作效率低",
+        "relationships": {"经理": "感到压力", "资深开发": "有些敬畏"}
+    },
+    "Designer": {
+        "factory": create_designer_agent,
+        "display_name": "设计师",
+        "traits": "创意丰富、注重细节、有时固执己见",
+        "relationships": {"经理": "关系中立", "资深开发": "配合良好", "初级开发": "友好"}
+    }
+}
+
+# 人设覆盖中允许修改的工厂参数
+PERSONA_FIELDS = ("display_name", "traits", "relationships")
+
+# 默认采样参数
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_SEED = 42
+
+# 群聊模式：round_robin 依次发言，parallel 经理发言后其余参与者同时回复
+TEAM_MODES = ("round_robin", "parallel")
+# 默认依次发言；parallel 只在请求明确指定时使用
+DEFAULT_TEAM_MODE = "round_robin"
+
+# 结束原因的显示名称，见 conversations.termination.SimulationTermination.stop_reason
+STOP_REASON_LABELS = {
+    "max_turns": "达到最大发言数",
+    "deadline": "达到时间上限",
+    "token_budget": "达到令牌预算",
+    "cost_limit": "达到费用上限",
+    "keyword": "出现结束关键词",
+    "consensus": "团队达成一致",
+    "idle": "讨论没有新内容",
+    "loop": "对话陷入重复",
+    "cancelled": "模拟被取消",
+    "error": "群聊出错"
+}
+
+# 智能体显示名称映射
+AGENT_DISPLAY_NAMES = {
+    "Manager": "经理",
+    "SeniorDev": "资深开发",
+    "JuniorDev": "初级开发",
+    "Designer": "设计师",
+    "System": "系统"
+}
+
+
+def build_agent_message(
+    agent_name: str,
+    content: str,
+    message_id: Optional[str] = None,
+    metrics: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    构造推送给前端的智能体消息
+
+    参数:
+        agent_name: 智能体名称
+        content: 消息内容
+        message_id: 消息ID，默认使用当前时间戳
+        metrics: 本轮发言的耗时和用量统计，见 agents.turn_metrics
+
+    返回:
+        dict: agent_message 事件数据
+    """
+    message = {
+        "id": message_id or str(datetime.now().timestamp()),
+        "sender": agent_name,
+        "sender_display_name": AGENT_DISPLAY_NAMES.get(agent_name, agent_name),
+        "content": content,
+        "timestamp": datetime.now().isoformat()
+    }
+    if metrics is not None:
+        message["metrics"] = metrics
+    return message
+
+
+def create_agents(
+    personas: Optional[Dict[str, Dict[str, Any]]] = None,
+    temperature: float = DEFAULT_TEMPERATURE,
+    seed: int = DEFAULT_SEED,
+    use_cache: bool = True,
+    context_policy: Optional[str] = None,
+    context_token_limit: Optional[int] = None
+) -> list:
+    """
+    按默认人设和覆盖项创建参与群聊的智能体
+
+    参数:
+        personas: 人设覆盖，键为智能体名称，值可包含 display_name、traits、relationships
+        temperature: 采样温度
+        seed: 采样随机种子
+        use_cache: 是否使用模型响应缓存
+        context_policy: 上下文策略，见 agents.context_policies
+        context_token_limit: 上下文的令牌预算
+
+    返回:
+        list: 按发言顺序排列的智能体
+    """
+    personas = personas or {}
+    unknown = set(personas) - set(DEFAULT_PERSONAS)
+    if unknown:
+        raise ValueError(f"未知的智能体: {sorted(unknown)}. 可用智能体: {list(DEFAULT_PERSONAS)}")
+
+    agents = []
+    for name, defaults in DEFAULT_PERSONAS.items():
+        kwargs = {key: value for key, value in defaults.items() if key != "factory"}
+        kwargs.update({key: value for key, value in personas.get(name, {}).items() if key in PERSONA_FIELDS})
+        agents.append(defaults["factory"](
+            name=name,
+            temperature=temperature,
+            seed=seed,
+            use_cache=use_cache,
+            context_policy=context_policy,
+            context_token_limit=context_token_limit,
+            **kwargs
+        ))
+    return agents
+
+
+def create_team(
+    agents: list,
+    team_mode: str,
+    max_turns: int = 20,
+    termination_condition: Optional[TerminationCondition] = None
+):
+    """
+    按群聊模式创建群聊
+
+    参数:
+        agents: 按发言顺序排列的智能体，第一个为主持人
+        team_mode: 群聊模式，见 TEAM_MODES
+        max_turns: 最多的智能体消息数
+        termination_condition: 提前结束的终止条件
+
+    返回:
+        群聊，提供 run_stream(task, cancellation_token)
+    """
+    if team_mode == "round_robin":
+        return RoundRobinGroupChat(participants=agents, max_turns=max_turns, termination_condition=termination_condition)
+    if team_mode == "parallel":
+        return ParallelRoundGroupChat(participants=agents, max_turns=max_turns, termination_condition=termination_condition)
+    raise ValueError(f"未知的群聊模式: {team_mode}. 可用模式: {list(TEAM_MODES)}")
+
+
+async def run_conversation(
+    simulation_id: str,
+    scenario_id: str,
+    scenario_text: str,
+    emit: Emit,
+    cancellation_token: CancellationToken,
+    personas: Optional[Dict[str, Dict[str, Any]]] = None,
+    temperature: float = DEFAULT_TEMPERATURE,
+    seed: int = DEFAULT_SEED,
+    use_cache: bool = True,
+    context_policy: Optional[str] = None,
+    context_token_limit: Optional[int] = None,
+    team_mode: Optional[str] = None,
+    termination: Optional[Dict[str, Any]] = None,
+    log_dir: str = "conversations_log",
+    save_checkpoints: bool = True,
+    checkpoint: Optional[Dict[str, Any]] = None,
+    checkpoint_metadata: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    运行一次模拟对话
+
+    参数:
+        simulation_id: 模拟ID
+        scenario_id: 场景ID
+        scenario_text: 场景文本
+        emit: 事件回调，agent_message 等事件均通过它发出
+        cancellation_token: 取消令牌，停止模拟时取消进行中的模型请求
+        personas: 人设覆盖，见 create_agents
+        temperature: 采样温度
+        seed: 采样随机种子
+        use_cache: 是否使用模型响应缓存，为 False 时本次模拟的每条回复都请求模型
+        context_policy: 智能体的上下文策略，见 agents.context_policies
+        context_token_limit: 上下文的令牌预算
+        team_mode: 群聊模式，见 TEAM_MODES，为空时依次发言（round_robin）
+        termination: 终止条件，见 conversations.termination，未指定的项使用环境变量
+        log_dir: 对话记录的保存目录
+        save_checkpoints: 是否定期写检查点，见 conversations.checkpoint
+        checkpoint: 从该检查点恢复模拟，恢复时其余参数应与检查点中的 options 相同
+        checkpoint_metadata: 调用方需要在恢复时取回的信息（如排队优先级），原样写入检查点
+
+    返回:
+        dict: messages 为本次对话的消息记录，usage 为模型用量，error 为群聊出错时的错误信息，
+            turn_metrics 为按智能体汇总的每轮耗时和用量，stop_reason 为结束原因
+    """
+    messages: List[Dict[str, Any]] = list(checkpoint["messages"]) if checkpoint else []
+    usage = dict(checkpoint["usage"]) if checkpoint else {"prompt_tokens": 0, "completion_tokens": 0}
+    # 智能体在群聊中的发言数（含恢复前的部分），记入检查点
+    turns = checkpoint["turns"] if checkpoint else 0
+    error: Optional[str] = None
+    cancelled = False
+    stop_detail: Optional[str] = None
+
+    def send_agent_message(agent_name: str, content: str, stop_reason: Optional[Dict[str, Any]] = None) -> None:
+        """发送一条智能体消息并记入消息记录"""
+        sse_message = build_agent_message(agent_name, content)
+        if stop_reason is not None:
+            sse_message["stop_reason"] = stop_reason
+        messages.append(sse_message)
+        logger.info(f"发送消息: {agent_name} ({sse_message['sender_display_name']}): {content[:50]}...")
+        emit("agent_message", sse_message, True)
+
+    team_mode = team_mode or DEFAULT_TEAM_MODE
+    logger.info(f"开始模拟: {scenario_id} ({simulation_id})，群聊模式: {team_mode}")
+
+    # 标记本任务所属的模拟，限流器据此在模拟之间轮流分配配额
+    current_simulation.set(simulation_id)
+
+    # 发送模拟状态更新
+    emit("simulation_status", {"is_running": True}, True)
+
+    if checkpoint:
+        # 重新推送恢复前的消息，重新连接的前端和模拟的消息记录都能看到完整的对话
+        for message in messages:
+            emit("agent_message", message, True)
+        send_agent_message("System", f"从检查点恢复模拟，已完成 {turns} 条发言")
+    else:
+        # 发送初始系统消息
+        send_agent_message("System", f"开始模拟场景: {scenario_id}")
+
+    # 创建各种代理
+    logger.info("创建智能体")
+    agents = create_agents(personas, temperature, seed, use_cache, context_policy, context_token_limit)
+    async def redirect_agents(note: str) -> None:
+        """对话陷入重复时，把提示加入每个智能体的上下文并推送给前端"""
+        for agent in agents:
+            await agent.model_context.add_message(UserMessage(content=note, source="System"))
+        send_agent_message("System", note)
+
+    participant_names = [agent.name for agent in agents]
+    termination_config = resolve_termination(termination)
+    elapsed = 0.0
+    if checkpoint:
+        # 恢复时扣除已经用掉的时间和预算
+        elapsed = checkpoint["elapsed"]
+        termination_config = remaining_termination(termination_config, elapsed, usage)
+    simulation_termination = SimulationTermination(termination_config, participant_names, redirect_agents, elapsed)
+
+    # 群聊在下面创建，检查点钩子通过闭包取得
+    group_chat = None
+    checkpoint_options = {
+        "personas": personas,
+        "temperature": temperature,
+        "seed": seed,
+        "use_cache": use_cache,
+        "context_policy": context_policy,
+        "context_token_limit": context_token_limit,
+        "team_mode": team_mode,
+        "termination": termination,
+        "log_dir": log_dir
+    }
+
+    async def save_checkpoint(delta) -> None:
+        """写检查点；delta 中的消息运行器可能还没有收到，一并记入消息记录和用量"""
+        logged = {message["id"] for message in messages}
+        pending = [message for message in delta if isinstance(message, TextMessage) and message.id not in logged]
+        pending_usage = dict(usage)
+        for message in pending:
+            if message.models_usage is not None:
+                pending_usage["prompt_tokens"] += message.models_usage.prompt_tokens
+                pending_usage["completion_tokens"] += message.models_usage.completion_tokens
+        await checkpoint_store.save_async({
+            "version": CHECKPOINT_VERSION,
+            "simulation_id": simulation_id,
+            "scenario_id": scenario_id,
+            "scenario_text": scenario_text,
+            "team_mode": team_mode,
+            "options": checkpoint_options,
+            "messages": messages + [build_agent_message(message.source, message.content, message.id) for message in pending],
+            "usage": pending_usage,
+            "turns": turns + len(pending),
+            "elapsed": round(simulation_termination.elapsed(), 2),
+            "team_state": await save_team_state(group_chat, participant_names),
+            "saved_at": datetime.now().isoformat(),
+            **(checkpoint_metadata or {})
+        })
+
+    if save_checkpoints and CHECKPOINT_INTERVAL > 0:
+        simulation_termination.add("checkpoint", CheckpointTrigger(save_checkpoint, participant_names))
+
+    if not checkpoint:
+        # 手动发送一些初始消息，确保前端能够接收到
+        logger.info("发送初始消息")
+        send_agent_message("Manager", "大家好，我们今天讨论一下这个新项目。")
+        send_agent_message("SeniorDev", "好的，我已经看过需求文档了，这个项目需要在3个月内完成。")
+        send_agent_message("JuniorDev", "我对这个项目很感兴趣，希望能学到新技术。")
+        send_agent_message("Designer", "我已经准备了一些初步的设计方案，等会可以分享给大家。")
+
+    def process_message(message) -> None:
+        """处理从AutoGen接收到的消息"""
+        nonlocal turns
+        try:
+            # 获取发送者信息
+            source = message.source
+            content = message.content
+
+            if not content:
+                logger.warning(f"收到空消息: {source}")
+                return
+
+            logger.info(f"处理消息: {source}: {content[:50]}...")
+
+            # 累计模型用量
+            models_usage = getattr(message, "models_usage", None)
+            if models_usage is not None:
+                usage["prompt_tokens"] += models_usage.prompt_tokens
+                usage["completion_tokens"] += models_usage.completion_tokens
+
+            if source in participant_names:
+                turns += 1
+
+            # 沿用AutoGen消息ID，以便前端将流式分片合并到最终消息；附上本轮的耗时和用量统计
+            metrics = turn_metrics.pop(simulation_id, source)
+            sse_message = build_agent_message(source, content, getattr(message, "id", None), metrics)
+            messages.append(sse_message)
+            emit("agent_message", sse_message, True)
+            if metrics is not None:
+                logger.info(
+                    f"消息已发送: {sse_message['id']}，耗时 {metrics['latency']} 秒，"
+                    f"首字 {metrics['time_to_first_token']} 秒，令牌 {metrics['prompt_tokens']}+{metrics['completion_tokens']}"
+                )
+            else:
+                logger.info(f"消息已发送: {sse_message['id']}")
+        except Exception as e:
+            logger.error(f"处理消息时出错: {e}")
+            # 尝试发送错误消息
+            send_agent_message("System", f"处理消息时出错: {str(e)}")
+
+    def process_chunk(chunk: ModelClientStreamingChunkEvent) -> None:
+        """将模型输出的流式分片作为 agent_message_delta 事件转发，分片不进入回放缓冲区"""
+        emit("agent_message_delta", {
+            "id": chunk.full_message_id,
+            "sender": chunk.source,
+            "sender_display_name": AGENT_DISPLAY_NAMES.get(chunk.source, chunk.source),
+            "delta": chunk.content
+        }, False)
+
+    def on_deadline() -> None:
+        """超过时间上限和宽限时间后仍未结束时，取消进行中的模型请求"""
+        logger.warning(f"模拟超过时间上限 {termination_config['deadline']} 秒，取消进行中的发言")
+        simulation_termination.deadline_exceeded = True
+        cancellation_token.cancel()
+
+    deadline_timer = None
+    if termination_config["deadline"]:
+        deadline_timer = asyncio.get_running_loop().call_later(termination_config["deadline"] + DEADLINE_GRACE, on_deadline)
+
+    try:
+        # 创建群聊 - 使用 AutoGen 0.4 API
+        logger.info("创建群聊")
+        group_chat = create_team(agents, team_mode, simulation_termination.max_turns, simulation_termination.condition)
+
+        if checkpoint:
+            # 从检查点恢复群聊和各智能体的状态，从下一位发言者继续
+            await group_chat.load_state(checkpoint["team_state"])
+            initial_message = None
+            task = None
+        else:
+            # 创建初始消息
+            initial_message = TextMessage(content=scenario_text + simulation_termination.task_suffix(), source="System")
+
+            # 处理初始消息
+            process_message(initial_message)
+            task = [initial_message]
+
+        # 启动群聊 - 使用 AutoGen 0.4 API 的流式接口
+        logger.info("启动群聊")
+        async for message in group_chat.run_stream(
+            task=task,
+            cancellation_token=cancellation_token
+        ):
+            if isinstance(message, ModelClientStreamingChunkEvent):
+                # 模型输出的分片，立即转发以缩短首字延迟
+                process_chunk(message)
+            elif isinstance(message, TextMessage) and (initial_message is None or message.id != initial_message.id):
+                # 完整消息（初始消息已在上面处理过）
+                process_message(message)
+            elif isinstance(message, TaskResult):
+                stop_detail = message.stop_reason
+
+        logger.info(f"群聊正常结束: {stop_detail}")
+    except asyncio.CancelledError:
+        logger.warning("群聊被取消")
+        cancelled = True
+        cancellation_token.cancel()
+    except Exception as chat_error:
+        logger.error(f"群聊出错: {chat_error}")
+        error = str(chat_error)
+        # 发送错误消息
+        send_agent_message("System", f"群聊过程中出错: {str(chat_error)}")
+
+        # 备用方案：如果AutoGen对话失败，手动发送一些消息
+        logger.info("启动备用对话")
+        send_agent_message("Manager", "看起来我们的系统遇到了一些技术问题。")
+        send_agent_message("SeniorDev", "我们可以先讨论一下项目的基本需求。根据我的理解，我们需要开发一个多智能体交互系统。")
+        send_agent_message("JuniorDev", "我对这个项目很感兴趣，特别是前端的实时通信部分。")
+        send_agent_message("Designer", "我已经准备了一些UI设计草图，主要采用了简洁的界面风格。")
+        send_agent_message("Manager", "很好，我们可以先从基础功能开始，然后逐步添加更复杂的特性。")
+        send_agent_message("SeniorDev", "我建议我们使用React和FastAPI作为技术栈，这样可以快速开发出原型。")
+        send_agent_message("Designer", "我会准备更详细的设计稿，包括颜色方案和组件库。")
+        send_agent_message("JuniorDev", "我可以负责前端的基础组件开发，需要大约一周时间。")
+        send_agent_message("Manager", "好的，那我们下周再开会讨论进展。")
+    finally:
+        if deadline_timer is not None:
+            deadline_timer.cancel()
+
+    # 被取消时最后一轮可能没有对应的消息
+    turn_metrics.discard(simulation_id)
+
+    # 记录结束原因，随对话记录保存
+    stop_reason = simulation_termination.stop_reason(stop_detail, cancelled, error)
+    if stop_reason["type"] not in ("cancelled", "error"):
+        # 正常结束后不再需要恢复；被取消（可能是后端关闭）或出错时保留检查点
+        checkpoint_store.delete(simulation_id)
+    logger.info(f"结束原因: {stop_reason['type']}（{stop_reason['detail']}）")
+    send_agent_message("System", f"对话结束原因: {STOP_REASON_LABELS.get(stop_reason['type'], stop_reason['type'])}", stop_reason)
+
+    # 保存对话结果
+    try:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"conversation_{timestamp}_{simulation_id}.json"
+
+        # 保存消息历史
+        if messages:
+            save_conversation(messages, filename, log_dir)
+            logger.info(f"对话已保存: {filename}")
+        else:
+            logger.warning("没有消息可保存")
+    except Exception as save_error:
+        logger.error(f"保存对话失败: {save_error}")
+
+    # 发送结束消息
+    send_agent_message("System", "对话已结束，感谢所有参与者的贡献。")
+
+    logger.info("模拟结束")
+
+    # 发送模拟状态更新
+    emit("simulation_status", {"is_running": False, "stop_reason": stop_reason}, True)
+    return {
+        "messages": messages,
+        "usage": usage,
+        "error": error,
+        "turn_metrics": summarize_turns(messages),
+        "stop_reason": stop_reason
+    }
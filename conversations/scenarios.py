@@ -74,4 +74,4 @@ def list_scenarios():
     返回:
         list: 场景名称列表
     """
-    return list(SCENARIOS.keys()) 
\ No newline at end of file
+    return list(SCENARIOS.keys()) 
@@ -0,0 +1,354 @@
+"""
+模拟的终止条件
+除了最大消息数，还可以按时间、令牌用量、费用、关键词、共识标记和空转轮数提前结束模拟，
+任意一个条件满足即结束；请求参数覆盖环境变量中的默认值，共识标记和空转轮数等条件只在请求指定时启用
+
+配置项:
+    max_turns         最多的智能体消息数
+    deadline          模拟的最长秒数，到时让当前发言结束后停止，超过宽限时间仍未结束则直接取消
+    token_budget      模型令牌总数（提示 + 回复）上限
+    cost_limit        模型费用上限（美元），按 MODEL_PRICE_* 估算
+    stop_keywords     任意一条消息包含其中的关键词即结束
+    consensus_marker  每个参与者最近一条消息都包含该标记时结束，任务消息中会提示智能体在同意时附上标记
+    idle_turns        连续多少条空转消息（过短或与本人之前的发言重复）后结束
+    loop_action       陷入重复循环时的动作（off/stop/redirect），见 conversations.loop_detector
+    loop_threshold    判定重复的 MinHash 相似度阈值
+"""
+import os
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.conditions import TextMentionTermination, TokenUsageTermination
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage
+
+from conversations.loop_detector import LoopTermination, LOOP_ACTIONS, LOOP_ACTION, LOOP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+TERMINATION_FIELDS = (
+    "max_turns", "deadline", "token_budget", "cost_limit", "stop_keywords", "consensus_marker", "idle_turns",
+    "loop_action", "loop_threshold"
+)
+
+# 环境变量中的默认值，0 表示不启用
+DEFAULT_TERMINATION = {
+    "max_turns": int(os.getenv("TERMINATION_MAX_TURNS", "20")),
+    "deadline": float(os.getenv("TERMINATION_DEADLINE", "0")),
+    "token_budget": int(os.getenv("TERMINATION_TOKEN_BUDGET", "0")),
+    "cost_limit": float(os.getenv("TERMINATION_COST_LIMIT", "0")),
+    "idle_turns": int(os.getenv("TERMINATION_IDLE_TURNS", "0")),
+    "loop_action": LOOP_ACTION,
+    "loop_threshold": LOOP_THRESHOLD
+}
+
+# 到达时间上限后等待当前发言结束的秒数，超过后直接取消进行中的模型请求
+DEADLINE_GRACE = float(os.getenv("TERMINATION_DEADLINE_GRACE", "30"))
+
+# 每千个提示令牌和回复令牌的价格（美元），用于估算费用
+MODEL_PRICE_PROMPT = float(os.getenv("MODEL_PRICE_PROMPT_PER_1K", "0"))
+MODEL_PRICE_COMPLETION = float(os.getenv("MODEL_PRICE_COMPLETION_PER_1K", "0"))
+
+# 短于该字数的消息视为空转
+IDLE_MIN_CHARS = int(os.getenv("TERMINATION_IDLE_MIN_CHARS", "10"))
+
+CONSENSUS_PROMPT = "\n当你认为团队已经达成一致、讨论可以结束时，请在发言末尾附上「{marker}」。"
+
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    """按 MODEL_PRICE_* 估算模型费用（美元）"""
+    return (prompt_tokens * MODEL_PRICE_PROMPT + completion_tokens * MODEL_PRICE_COMPLETION) / 1000
+
+
+class DeadlineTermination(TerminationCondition):
+    """模拟开始后超过 deadline 秒时结束"""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        if time.monotonic() - self.started >= self.deadline:
+            self._terminated = True
+            return StopMessage(content=f"达到时间上限 {self.deadline} 秒", source="DeadlineTermination")
+        return None
+
+    async def reset(self) -> None:
+        self.started = time.monotonic()
+        self._terminated = False
+
+
+class CostTermination(TerminationCondition):
+    """模型费用达到上限时结束"""
+
+    def __init__(self, cost_limit: float):
+        self.cost_limit = cost_limit
+        self.cost = 0.0
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        for message in messages:
+            if message.models_usage is not None:
+                self.cost += estimate_cost(message.models_usage.prompt_tokens, message.models_usage.completion_tokens)
+        if self.cost >= self.cost_limit:
+            self._terminated = True
+            return StopMessage(content=f"模型费用 ${self.cost:.4f} 达到上限 ${self.cost_limit}", source="CostTermination")
+        return None
+
+    async def reset(self) -> None:
+        self.cost = 0.0
+        self._terminated = False
+
+
+class ConsensusTermination(TerminationCondition):
+    """每个参与者最近一条消息都包含共识标记时结束"""
+
+    def __init__(self, marker: str, participants: List[str]):
+        self.marker = marker
+        self.participants = participants
+        self._agreed: Dict[str, bool] = {}
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        for message in messages:
+            if isinstance(message, BaseChatMessage) and message.source in self.participants:
+                self._agreed[message.source] = self.marker in message.to_text()
+        if all(self._agreed.get(name) for name in self.participants):
+            self._terminated = True
+            return StopMessage(content=f"所有参与者都附上了共识标记「{self.marker}」", source="ConsensusTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._agreed = {}
+        self._terminated = False
+
+
+class IdleTermination(TerminationCondition):
+    """连续 idle_turns 条空转消息（过短或与本人之前的发言重复）后结束"""
+
+    def __init__(self, idle_turns: int, participants: List[str], min_chars: int = IDLE_MIN_CHARS):
+        self.idle_turns = idle_turns
+        self.participants = participants
+        self.min_chars = min_chars
+        self.streak = 0
+        self._seen: Dict[str, set] = {}
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    def is_idle(self, message: BaseChatMessage) -> bool:
+        text = message.to_text().strip()
+        seen = self._seen.setdefault(message.source, set())
+        idle = len(text) < self.min_chars or text in seen
+        seen.add(text)
+        return idle
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        for message in messages:
+            if not isinstance(message, BaseChatMessage) or message.source not in self.participants:
+                continue
+            self.streak = self.streak + 1 if self.is_idle(message) else 0
+        if self.streak >= self.idle_turns:
+            self._terminated = True
+            return StopMessage(content=f"连续 {self.streak} 条消息没有新内容", source="IdleTermination")
+        return None
+
+    async def reset(self) -> None:
+        self.streak = 0
+        self._seen = {}
+        self._terminated = False
+
+
+def remaining_termination(config: Dict[str, Any], elapsed: float, usage: Dict[str, int]) -> Dict[str, Any]:
+    """
+    从检查点恢复时，从时间上限、令牌预算和费用上限中扣除已经用掉的部分
+
+    参数:
+        config: resolve_termination 返回的配置
+        elapsed: 恢复前已经运行的秒数
+        usage: 恢复前的模型用量
+
+    返回:
+        dict: 扣除后的配置，已用完的预算保留一个极小值，恢复后的第一条消息即结束模拟
+    """
+    config = dict(config)
+    if config["deadline"]:
+        config["deadline"] = max(config["deadline"] - elapsed, 0.001)
+    if config["token_budget"]:
+        used = usage["prompt_tokens"] + usage["completion_tokens"]
+        config["token_budget"] = max(config["token_budget"] - used, 1)
+    if config["cost_limit"]:
+        spent = estimate_cost(usage["prompt_tokens"], usage["completion_tokens"])
+        config["cost_limit"] = max(config["cost_limit"] - spent, 1e-9)
+    return config
+
+
+class _RecordedTermination(TerminationCondition):
+    """记录被包装的条件是否触发过；群聊结束时会重置终止条件，因此不能事后读取 terminated"""
+
+    def __init__(self, kind: str, condition: TerminationCondition, fired: List[str]):
+        self.kind = kind
+        self.condition = condition
+        self.fired = fired
+
+    @property
+    def terminated(self) -> bool:
+        return self.condition.terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> Optional[StopMessage]:
+        stop = await self.condition(messages)
+        if stop is not None:
+            self.fired.append(self.kind)
+        return stop
+
+    async def reset(self) -> None:
+        await self.condition.reset()
+
+
+def resolve_termination(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    合并环境变量和请求参数中的终止条件
+
+    参数:
+        overrides: 请求指定的终止条件，值为 None 的项沿用默认值
+
+    返回:
+        dict: 终止条件配置
+
+    异常:
+        ValueError: 配置项未知或取值无效
+    """
+    config: Dict[str, Any] = dict(DEFAULT_TERMINATION)
+    overrides = overrides or {}
+    unknown = set(overrides) - set(TERMINATION_FIELDS)
+    if unknown:
+        raise ValueError(f"未知的终止条件: {sorted(unknown)}. 可用条件: {list(TERMINATION_FIELDS)}")
+    config.update({key: value for key, value in overrides.items() if value is not None})
+
+    if not config["max_turns"] or config["max_turns"] < 1:
+        raise ValueError("max_turns 必须大于 0")
+    for key in ("deadline", "token_budget", "cost_limit", "idle_turns"):
+        if config[key] < 0:
+            raise ValueError(f"{key} 不能为负数")
+    if config["loop_action"] not in LOOP_ACTIONS:
+        raise ValueError(f"未知的循环检测动作: {config['loop_action']}. 可用动作: {list(LOOP_ACTIONS)}")
+    if not 0 < config["loop_threshold"] <= 1:
+        raise ValueError("loop_threshold 必须在 (0, 1] 之间")
+    if isinstance(config.get("stop_keywords"), str):
+        config["stop_keywords"] = [config["stop_keywords"]]
+    if config["cost_limit"] and not (MODEL_PRICE_PROMPT or MODEL_PRICE_COMPLETION):
+        logger.warning("设置了费用上限，但没有配置 MODEL_PRICE_PROMPT_PER_1K/MODEL_PRICE_COMPLETION_PER_1K，费用始终为 0")
+    return config
+
+
+class SimulationTermination:
+    """
+    一次模拟的终止条件
+
+    把配置中启用的条件用 | 组合成 AutoGen 的终止条件交给群聊，结束后根据哪些条件已满足给出结束原因。
+    时间上限另由运行器在宽限时间后强制取消，因为群聊只在有新消息时检查终止条件。
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        participants: List[str],
+        redirect: Optional[Callable[[str], Awaitable[None]]] = None,
+        elapsed: float = 0.0
+    ):
+        """
+        参数:
+            config: resolve_termination 返回的配置
+            participants: 参与者名称，用于共识标记、空转和循环判断
+            redirect: 陷入循环时把提示加入智能体上下文的回调，为空时 redirect 动作等同于 stop
+            elapsed: 从检查点恢复时，恢复前已经运行的秒数
+        """
+        self.config = config
+        self.started = time.monotonic() - elapsed
+        self.deadline_exceeded = False
+        # (结束原因类型, 条件)；最大消息数由群聊的 max_turns 控制
+        self._conditions: List[tuple] = []
+        # 已触发的条件类型
+        self.fired: List[str] = []
+        if config["deadline"]:
+            self._conditions.append(("deadline", DeadlineTermination(config["deadline"])))
+        if config["token_budget"]:
+            self._conditions.append(("token_budget", TokenUsageTermination(max_total_token=config["token_budget"])))
+        if config["cost_limit"]:
+            self._conditions.append(("cost_limit", CostTermination(config["cost_limit"])))
+        for keyword in config.get("stop_keywords") or []:
+            self._conditions.append(("keyword", TextMentionTermination(keyword)))
+        if config.get("consensus_marker"):
+            self._conditions.append(("consensus", ConsensusTermination(config["consensus_marker"], participants)))
+        if config["idle_turns"]:
+            self._conditions.append(("idle", IdleTermination(config["idle_turns"], participants)))
+        if config["loop_action"] != "off":
+            loop = LoopTermination(participants, config["loop_action"], config["loop_threshold"], redirect=redirect)
+            self._conditions.append(("loop", loop))
+
+    @property
+    def max_turns(self) -> int:
+        return self.config["max_turns"]
+
+    def elapsed(self) -> float:
+        """模拟已经运行的秒数（含恢复前的部分）"""
+        return time.monotonic() - self.started
+
+    def add(self, kind: str, condition: TerminationCondition) -> None:
+        """追加一个条件，例如写检查点的钩子"""
+        self._conditions.append((kind, condition))
+
+    @property
+    def condition(self) -> Optional[TerminationCondition]:
+        """组合后的终止条件，没有启用任何条件时返回 None"""
+        combined = None
+        for kind, condition in self._conditions:
+            recorded = _RecordedTermination(kind, condition, self.fired)
+            combined = recorded if combined is None else combined | recorded
+        return combined
+
+    def task_suffix(self) -> str:
+        """需要智能体配合的条件（共识标记）附加到任务消息的提示"""
+        marker = self.config.get("consensus_marker")
+        return CONSENSUS_PROMPT.format(marker=marker) if marker else ""
+
+    def stop_reason(self, detail: Optional[str] = None, cancelled: bool = False, error: Optional[str] = None) -> Dict[str, Any]:
+        """
+        生成结束原因
+
+        参数:
+            detail: 群聊给出的结束说明（TaskResult.stop_reason），没有条件满足时即达到最大消息数
+            cancelled: 模拟是否被取消
+            error: 群聊出错时的错误信息
+
+        返回:
+            dict: type 为 max_turns/deadline/token_budget/cost_limit/keyword/consensus/idle/loop/cancelled/error，
+                detail 为说明，elapsed 为模拟耗时
+        """
+        if error is not None:
+            kind, detail = "error", error
+        elif self.deadline_exceeded:
+            kind, detail = "deadline", f"超过时间上限 {self.config['deadline']} 秒，已取消进行中的发言"
+        elif cancelled:
+            kind, detail = "cancelled", "模拟被取消"
+        elif self.fired:
+            kind = self.fired[0]
+        else:
+            kind = "max_turns"
+        return {"type": kind, "detail": detail, "elapsed": round(self.elapsed(), 2)}
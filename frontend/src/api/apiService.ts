@@ -17,24 +17,31 @@ export const apiService = {
     }
   },
   
-  // 启动模拟
-  startSimulation: async (scenarioId: string): Promise<{ success: boolean, message: string }> => {
+  // 启动模拟，返回的 simulation_id 用于订阅该模拟的事件流
+  startSimulation: async (scenarioId: string): Promise<{ success: boolean, message: string, simulation_id?: string | null }> => {
     try {
       console.log('API: 启动模拟', scenarioId)
-      const response = await axios.post(`${API_URL}/simulation/start`, { scenario_id: scenarioId })
+      const response = await axios.post(`${API_URL}/simulations`, { scenario_id: scenarioId })
       console.log('API: 启动模拟响应', response.data)
       return response.data
     } catch (error) {
+      // 场景不存在（404）、参数无效（400）或队列已满（429）时返回后端的说明
+      if (axios.isAxiosError(error) && error.response?.data?.detail) {
+        console.error('API: 启动模拟被拒绝:', error.response.data.detail)
+        return { success: false, message: String(error.response.data.detail) }
+      }
       console.error('API: 启动模拟失败:', error)
       throw error
     }
   },
   
   // 停止模拟
-  stopSimulation: async (): Promise<{ success: boolean, message: string }> => {
+  stopSimulation: async (simulationId?: string | null): Promise<{ success: boolean, message: string }> => {
     try {
-      console.log('API: 停止模拟')
-      const response = await axios.post(`${API_URL}/simulation/stop`)
+      console.log('API: 停止模拟', simulationId)
+      // 指定ID时只停止该模拟，否则由后端停止最近启动的模拟
+      const url = simulationId ? `${API_URL}/simulations/${simulationId}/stop` : `${API_URL}/simulation/stop`
+      const response = await axios.post(url)
       console.log('API: 停止模拟响应', response.data)
       return response.data
     } catch (error) {
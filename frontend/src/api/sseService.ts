@@ -3,23 +3,38 @@ import { useChatStore } from '../store/chatStore'
 export class SSEService {
   private reconnectAttempts = 0
   private eventSource: EventSource | null = null
+  // 订阅的模拟ID，为空时订阅所有模拟的事件（旧接口 /api/events）
+  private simulationId: string | null = null
+  // 最后收到的事件ID，手动重连时用于让后端补发错过的事件
+  private lastEventId: string | null = null
   
   // 检查连接状态
   isConnected(): boolean {
     return this.eventSource !== null && this.eventSource.readyState === EventSource.OPEN
   }
   
-  // 连接到SSE事件流
-  connect(): void {
+  // 连接到SSE事件流；传入模拟ID时改为订阅该模拟，未传入时沿用当前订阅
+  connect(simulationId?: string | null): void {
     if (this.eventSource) {
       this.disconnect()
     }
     
+    if (simulationId !== undefined && simulationId !== this.simulationId) {
+      this.simulationId = simulationId
+      // 从序号 0 之后开始补发，订阅之前该模拟已经发布的事件（如排队状态和开场消息）不会丢失
+      this.lastEventId = simulationId ? `${simulationId}-0` : null
+    }
+    
     console.log('正在连接SSE事件流...')
     try {
-      // 尝试连接到 /api/events 端点
+      // 指定模拟时只订阅该模拟的事件，否则连接到 /api/events 接收所有模拟的事件
       const baseUrl = window.location.protocol + '//' + window.location.host;
-      const url = baseUrl + '/api/events';
+      let url = this.simulationId
+        ? baseUrl + '/api/simulations/' + encodeURIComponent(this.simulationId) + '/events'
+        : baseUrl + '/api/events';
+      if (this.lastEventId) {
+        url += '?last_event_id=' + encodeURIComponent(this.lastEventId);
+      }
       console.log('SSE连接URL:', url);
       
       this.eventSource = new EventSource(url);
@@ -36,9 +51,15 @@ export class SSEService {
       // 处理智能体消息事件
       this.eventSource.addEventListener('agent_message', this.handleAgentMessage)
       
+      // 处理智能体消息的流式分片
+      this.eventSource.addEventListener('agent_message_delta', this.handleAgentMessageDelta)
+      
       // 处理模拟状态变更事件
       this.eventSource.addEventListener('simulation_status', this.handleSimulationStatus)
       
+      // 处理模拟排队状态事件
+      this.eventSource.addEventListener('queue_status', this.handleQueueStatus)
+      
       // 处理错误
       this.eventSource.onerror = (error) => {
         console.error('SSE连接错误:', error)
@@ -67,7 +88,9 @@ export class SSEService {
       console.log('正在断开SSE连接...')
       this.eventSource.removeEventListener('message', this.handleMessage)
       this.eventSource.removeEventListener('agent_message', this.handleAgentMessage)
+      this.eventSource.removeEventListener('agent_message_delta', this.handleAgentMessageDelta)
       this.eventSource.removeEventListener('simulation_status', this.handleSimulationStatus)
+      this.eventSource.removeEventListener('queue_status', this.handleQueueStatus)
       this.eventSource.close()
       this.eventSource = null
       console.log('SSE连接已关闭')
@@ -87,8 +110,8 @@ export class SSEService {
     
     console.log(`尝试第 ${this.reconnectAttempts} 次重新连接SSE，等待 ${backoffTime/1000} 秒...`)
     
-    // 如果重连次数超过3次，尝试备用端点
-    if (this.reconnectAttempts > 3) {
+    // 如果重连次数超过3次，尝试备用端点（备用端点不区分模拟，只用于全局订阅）
+    if (this.reconnectAttempts > 3 && !this.simulationId) {
       setTimeout(() => {
         console.log('多次重连失败，尝试备用端点')
         this.tryAlternativeEndpoint()
@@ -106,6 +129,13 @@ export class SSEService {
     this.reconnectAttempts = 0
   }
   
+  // 记录事件ID（浏览器自动重连时会自行携带 Last-Event-ID 请求头）
+  private rememberEventId(event: MessageEvent): void {
+    if (event.lastEventId) {
+      this.lastEventId = event.lastEventId
+    }
+  }
+  
   // 处理普通消息
   private handleMessage = (event: MessageEvent): void => {
     try {
@@ -124,6 +154,8 @@ export class SSEService {
       console.log('事件类型:', event.type)
       console.log('事件对象:', event)
       
+      this.rememberEventId(event)
+      
       // 检查数据是否为空
       if (!event.data) {
         console.error('收到空的智能体消息数据')
@@ -156,6 +188,13 @@ export class SSEService {
       console.log('当前消息列表长度:', currentMessages.length)
       console.log('当前消息列表:', currentMessages)
       
+      // 已通过流式分片显示的消息，用完整内容替换
+      const streamingMessage = currentMessages.find(m => m.id === message.id && m.isStreaming)
+      if (streamingMessage) {
+        useChatStore.getState().completeStreamingMessage(message.id, message.content)
+        return
+      }
+      
       // 检查是否已存在相同ID的消息
       if (message.id && currentMessages.some(m => m.id === message.id)) {
         console.log('消息已存在，跳过添加:', message.id)
@@ -188,10 +227,49 @@ export class SSEService {
     }
   }
   
+  // 处理智能体消息的流式分片
+  private handleAgentMessageDelta = (event: MessageEvent): void => {
+    try {
+      const chunk = JSON.parse(event.data)
+      if (!chunk.id || !chunk.sender || typeof chunk.delta !== 'string') {
+        console.error('流式分片格式不正确:', chunk)
+        return
+      }
+      
+      useChatStore.getState().appendMessageDelta({
+        id: chunk.id,
+        sender: chunk.sender,
+        senderDisplayName: chunk.sender_display_name || chunk.sender,
+        timestamp: new Date().toISOString()
+      }, chunk.delta)
+    } catch (error) {
+      console.error('处理流式分片失败:', error, '原始数据:', event.data)
+    }
+  }
+  
+  // 处理模拟排队状态事件：排队期间更新排队位置和预计等待时间，开始运行后清除
+  private handleQueueStatus = (event: MessageEvent): void => {
+    try {
+      this.rememberEventId(event)
+      const data = JSON.parse(event.data)
+      console.log('收到排队状态事件:', data)
+      const { setQueueStatus } = useChatStore.getState()
+      if (data.status !== 'queued') {
+        setQueueStatus(null)
+        return
+      }
+      
+      setQueueStatus({ position: data.position, etaSeconds: data.eta_seconds ?? null })
+    } catch (error) {
+      console.error('处理排队状态事件失败:', error, '原始数据:', event.data)
+    }
+  }
+  
   // 处理模拟状态变更
   private handleSimulationStatus = (event: MessageEvent): void => {
     try {
       console.log('收到模拟状态变更事件:', event.data)
+      this.rememberEventId(event)
       const data = JSON.parse(event.data)
       console.log('解析后的模拟状态:', data)
       
@@ -230,7 +308,9 @@ export class SSEService {
       
       this.eventSource.addEventListener('message', this.handleMessage)
       this.eventSource.addEventListener('agent_message', this.handleAgentMessage)
+      this.eventSource.addEventListener('agent_message_delta', this.handleAgentMessageDelta)
       this.eventSource.addEventListener('simulation_status', this.handleSimulationStatus)
+      this.eventSource.addEventListener('queue_status', this.handleQueueStatus)
       
       this.eventSource.onerror = (error) => {
         console.error('备用SSE连接错误:', error)
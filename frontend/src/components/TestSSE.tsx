@@ -10,7 +10,8 @@ const TestSSE = () => {
   // 连接SSE
   useEffect(() => {
     console.log('TestSSE: 组件挂载，连接SSE')
-    sseService.connect()
+    // 测试页订阅所有模拟的事件
+    sseService.connect(null)
     setConnected(true)
     
     return () => {
@@ -1,16 +1,24 @@
 import { useEffect, useRef, useState } from 'react'
 import { sseService } from '../api/sseService'
 
-export const useSSE = () => {
+// 订阅指定模拟的事件；simulationId 为 null 时不连接，未传入时沿用 sseService 当前的订阅
+export const useSSE = (simulationId?: string | null) => {
   const [connected, setConnected] = useState(false)
   const reconnectTimerRef = useRef<NodeJS.Timeout | null>(null)
   const connectionCheckIntervalRef = useRef<NodeJS.Timeout | null>(null)
   
   useEffect(() => {
-    console.log('useSSE hook: 组件挂载，准备连接SSE')
+    if (simulationId === null) {
+      // 尚未启动模拟，不订阅其他用户的模拟
+      sseService.disconnect()
+      setConnected(false)
+      return
+    }
+    
+    console.log('useSSE hook: 准备连接SSE', simulationId)
     
     // 连接SSE
-    sseService.connect()
+    sseService.connect(simulationId)
     
     // 检查连接状态
     const checkConnection = () => {
@@ -21,7 +29,7 @@ export const useSSE = () => {
       // 如果未连接，尝试重连
       if (!isConnected) {
         console.log('SSE未连接，尝试重连')
-        sseService.connect()
+        sseService.connect(simulationId)
       }
     }
     
@@ -45,11 +53,11 @@ export const useSSE = () => {
       sseService.disconnect()
       setConnected(false)
     }
-  }, [])
+  }, [simulationId])
   
   const connect = () => {
     console.log('useSSE hook: 手动连接SSE')
-    sseService.connect()
+    sseService.connect(simulationId)
     // 不要立即设置连接状态，等待实际连接成功
     setTimeout(() => {
       setConnected(sseService.isConnected())
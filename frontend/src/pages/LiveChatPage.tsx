@@ -13,11 +13,13 @@ import ConversationFlow from '../components/ConversationFlow'
 import MessageTimeline from '../components/MessageTimeline'
 
 const LiveChatPage = () => {
-  const { messages, selectedScenario, selectScenario, isSimulationRunning, setSimulationRunning, useStreamingEffect, setUseStreamingEffect } = useChatStore()
-  const { isConnected } = useSSE()
+  const { messages, selectedScenario, selectScenario, isSimulationRunning, setSimulationRunning, queueStatus, useStreamingEffect, setUseStreamingEffect } = useChatStore()
   const [isLoading, setIsLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
   const [activeTab, setActiveTab] = useState(0)
+  // 当前页面启动的模拟ID，只订阅该模拟的事件，停止时也只停止该模拟
+  const [simulationId, setSimulationId] = useState<string | null>(null)
+  const { isConnected } = useSSE(simulationId)
   
   // 加载场景列表
   useEffect(() => {
@@ -70,10 +72,11 @@ const LiveChatPage = () => {
       const response = await apiService.startSimulation(selectedScenario.id)
       
       if (response.success) {
-        console.log('模拟启动成功')
-        setSimulationRunning(true)
-        // 清空之前的消息
+        console.log('模拟启动成功', response.simulation_id)
+        // 先清空之前的消息，再订阅新模拟的事件流
         useChatStore.getState().clearMessages()
+        setSimulationId(response.simulation_id ?? null)
+        setSimulationRunning(true)
         
         // 添加调试代码：每秒检查一次消息状态
         const checkMessages = setInterval(() => {
@@ -107,7 +110,7 @@ const LiveChatPage = () => {
     
     try {
       console.log('停止模拟')
-      const response = await apiService.stopSimulation()
+      const response = await apiService.stopSimulation(simulationId)
       
       if (response.success) {
         console.log('模拟停止成功')
@@ -185,6 +188,13 @@ const LiveChatPage = () => {
                 </button>
               )}
               
+              {queueStatus && (
+                <div className="bg-yellow-50 border border-yellow-200 text-yellow-800 text-sm rounded-md px-3 py-2">
+                  模拟排队中，当前位置: 第 {queueStatus.position} 位
+                  {queueStatus.etaSeconds != null && `，预计等待约 ${Math.ceil(queueStatus.etaSeconds)} 秒`}
+                </div>
+              )}
+              
               <div className="flex items-center mt-2">
                 <div className={`w-3 h-3 rounded-full mr-2 ${isConnected ? 'bg-green-500' : 'bg-red-500'}`}></div>
                 <span className="text-sm text-secondary-600">
@@ -9,6 +9,13 @@ export interface Message {
   timestamp: string
   isTyping?: boolean
   isQueued?: boolean
+  isStreaming?: boolean
+}
+
+// 模拟的排队状态，开始运行后清空
+export interface QueueStatus {
+  position: number
+  etaSeconds: number | null
 }
 
 export interface Scenario {
@@ -22,14 +29,18 @@ interface ChatState {
   scenarios: Scenario[]
   selectedScenario: Scenario | null
   isSimulationRunning: boolean
+  queueStatus: QueueStatus | null
   useStreamingEffect: boolean
   typingMessageId: string | null
   messageQueue: string[]
   addMessage: (message: Message) => void
+  appendMessageDelta: (message: Omit<Message, 'content'>, delta: string) => void
+  completeStreamingMessage: (messageId: string, content: string) => void
   clearMessages: () => void
   setScenarios: (scenarios: Scenario[]) => void
   selectScenario: (scenario: Scenario | null) => void
   setSimulationRunning: (isRunning: boolean) => void
+  setQueueStatus: (queueStatus: QueueStatus | null) => void
   setUseStreamingEffect: (useEffect: boolean) => void
   setMessageTypingState: (messageId: string, isTyping: boolean) => void
   dequeueNextMessage: () => string | null
@@ -67,6 +78,7 @@ export const useChatStore = create<ChatState>((set, get) => ({
   ],
   selectedScenario: null,
   isSimulationRunning: false,
+  queueStatus: null,
   useStreamingEffect: true,
   typingMessageId: null,
   messageQueue: [],
@@ -118,10 +130,39 @@ export const useChatStore = create<ChatState>((set, get) => ({
     console.log('Store: 消息已添加，新长度:', get().messages.length)
   },
   
+  // 追加模型流式输出的分片，首个分片到达时创建消息
+  appendMessageDelta: (message, delta) => {
+    set((state) => {
+      const index = state.messages.findIndex(m => m.id === message.id)
+      if (index === -1) {
+        return {
+          messages: [...state.messages, { ...message, content: delta, isTyping: false, isStreaming: true }]
+        }
+      }
+      const updatedMessages = [...state.messages]
+      updatedMessages[index] = {
+        ...updatedMessages[index],
+        content: updatedMessages[index].content + delta
+      }
+      return { messages: updatedMessages }
+    })
+  },
+  
+  // 用最终的完整消息替换流式拼接的内容
+  completeStreamingMessage: (messageId, content) => {
+    console.log('Store: 流式消息完成', messageId)
+    set((state) => ({
+      messages: state.messages.map(m =>
+        m.id === messageId ? { ...m, content, isStreaming: false } : m
+      )
+    }))
+  },
+  
   clearMessages: () => {
     console.log('Store: 清空消息')
     set({ 
       messages: [],
+      queueStatus: null,
       typingMessageId: null,
       messageQueue: []
     })
@@ -139,7 +180,12 @@ export const useChatStore = create<ChatState>((set, get) => ({
   
   setSimulationRunning: (isRunning) => {
     console.log('Store: 设置模拟状态', isRunning)
-    set({ isSimulationRunning: isRunning })
+    set(isRunning ? { isSimulationRunning: isRunning } : { isSimulationRunning: isRunning, queueStatus: null })
+  },
+  
+  // 排队位置或预计等待时间变化时原地更新，不写入对话记录
+  setQueueStatus: (queueStatus) => {
+    set({ queueStatus })
   },
   
   setUseStreamingEffect: (useEffect) => {
@@ -0,0 +1,12 @@
+"""
+单元测试的公共设置
+test 目录下的 test_*.py 既有需要启动后端的联调脚本，也有不依赖服务的单元测试；
+把仓库根目录加入模块搜索路径，单元测试可以直接导入 utils、agents、conversations
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 需要先启动后端的联调脚本，直接用 python 运行，不参与 pytest 收集
+collect_ignore = ["test_backend.py", "test_frontend_backend.py", "test_sse.py"]
@@ -0,0 +1,111 @@
+"""批量模拟：矩阵展开、并发上限、失败统计和批次报告"""
+import asyncio
+import json
+import os
+
+import pytest
+
+from conversations import batch as batch_module
+from conversations.batch import BatchRun
+
+
+@pytest.fixture(autouse=True)
+def log_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_module, "BATCH_LOG_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _agents(turns: int, latency: float, cached_turns: int = 0) -> dict:
+    return {"Dev": {"turns": turns, "latency": latency, "cached_turns": cached_turns}}
+
+
+def test_matrix_expands_every_combination():
+    batch = BatchRun(
+        ["casual_chat", "team_meeting"],
+        personas={"default": {}, "strict": {"Manager": {"temperature": 0.2}}},
+        temperatures=[0.3, 0.7],
+        seeds=[1, 2],
+        repeats=2,
+        batch_id="b1"
+    )
+    assert len(batch.runs) == 2 * 2 * 2 * 2 * 2
+    assert batch.runs[0]["run_id"] == "b1-0000"
+    assert batch.runs[-1]["run_id"] == "b1-0031"
+    last = batch.runs[-1]
+    assert (last["scenario_id"], last["persona"], last["temperature"], last["seed"], last["repeat"]) == ("team_meeting", "strict", 0.7, 2, 1)
+    options = batch.run_options(last)
+    assert options["personas"] == {"Manager": {"temperature": 0.2}}
+    assert options["save_checkpoints"] is False
+    assert options["log_dir"] == batch.log_dir
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"scenarios": []},
+    {"scenarios": ["daily_standup"]},
+    {"scenarios": ["casual_chat"], "personas": {"p": {"Tester": {}}}},
+    {"scenarios": ["casual_chat"], "team_mode": "free_for_all"},
+    {"scenarios": ["casual_chat"], "termination": {"max_turns": 0}}
+])
+def test_invalid_matrix_is_rejected(kwargs):
+    with pytest.raises(ValueError):
+        BatchRun(**kwargs)
+
+
+def test_too_many_runs_is_rejected(monkeypatch):
+    monkeypatch.setattr(batch_module, "MAX_BATCH_RUNS", 3)
+    with pytest.raises(ValueError):
+        BatchRun(["casual_chat"], seeds=[1, 2, 3, 4])
+
+
+def test_run_respects_concurrency_and_reports_results(log_dir):
+    batch = BatchRun(["casual_chat", "team_meeting"], seeds=[1, 2], concurrency=2, batch_id="b1")
+    running = []
+    peak = []
+
+    async def execute(run):
+        running.append(run["run_id"])
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(run["run_id"])
+        if run["run_id"] == "b1-0003":
+            raise RuntimeError("模型服务不可用")
+        error = "上下文超长" if run["run_id"] == "b1-0002" else None
+        return {
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20},
+            "turn_metrics": _agents(4, 2.0, cached_turns=1),
+            "stop_reason": {"type": "max_turns" if run["seed"] == 1 else "token_budget"},
+            "error": error
+        }
+
+    report = asyncio.run(batch.run(execute))
+    assert max(peak) == 2
+    assert report["status"] == "completed"
+    assert (report["total_runs"], report["completed"], report["failed"], report["pending"]) == (4, 2, 2, 0)
+    assert batch.runs[3]["error"] == "模型服务不可用"
+    assert batch.runs[3]["usage"] is None
+    assert report["tokens"] == {"prompt": 300, "completion": 60, "total": 360}
+    assert report["runs_per_minute"] > 0 and report["tokens_per_second"] > 0
+
+    # 抛出异常的运行没有用量，不计入场景汇总和结束原因
+    assert report["by_scenario"]["casual_chat"]["runs"] == 2
+    team_meeting = report["by_scenario"]["team_meeting"]
+    assert team_meeting["runs"] == 1
+    assert team_meeting["average_tokens"] == 120
+    assert team_meeting["turns"] == 4
+    assert team_meeting["cached_turns"] == 1
+    assert team_meeting["average_turn_latency"] == 0.5
+    assert report["by_stop_reason"] == {"max_turns": 2, "token_budget": 1}
+
+    with open(os.path.join(log_dir, "b1", "summary.json"), encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["failed"] == 2
+    assert len(saved["runs"]) == 4
+
+
+def test_report_before_run():
+    report = BatchRun(["casual_chat"], batch_id="b1").report(include_runs=False)
+    assert report["pending"] == 1
+    assert report["elapsed_seconds"] is None
+    assert report["runs_per_minute"] is None
+    assert report["by_scenario"] == {}
+    assert "runs" not in report
@@ -0,0 +1,53 @@
+"""Unix 域套接字事件代理：跨进程转发事件，晚连上的 worker 和已释放的频道"""
+import asyncio
+
+from utils.broker import UnixSocketBroker
+from utils.event_hub import EventHub
+
+
+async def _until(condition, timeout: float = 2.0) -> None:
+    """等待远程消息到达"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "等待远程消息超时"
+        await asyncio.sleep(0.01)
+
+
+async def _start(path: str):
+    broker = UnixSocketBroker(path, reconnect_delay=0.01)
+    hub = EventHub(broker=broker)
+    await broker.start(hub)
+    return hub, broker
+
+
+def test_late_worker_receives_events_and_releases_channel_on_close(tmp_path):
+    async def scenario():
+        relay_hub, relay = await _start(str(tmp_path / "events.sock"))
+        await _until(lambda: relay.role == "relay")
+        relay_hub.open_channel("sim")
+        relay_hub.publish_event("sim", "agent_message", {"index": 1})
+
+        # 开启消息发出时还没有连上中继
+        peer_hub, peer = await _start(str(tmp_path / "events.sock"))
+        await _until(lambda: peer.role == "peer" and relay.stats()["peers"] == 1)
+        subscriber = peer_hub.subscribe()
+        relay_hub.publish_event("sim", "agent_message", {"index": 2})
+        await _until(lambda: len(subscriber.buffer) == 1)
+        assert subscriber.buffer[0].event_id == "sim-2"
+        assert peer_hub.is_open("sim")
+
+        relay_hub.close_channel("sim")
+        await _until(lambda: not peer_hub.has_channel("sim"))
+
+        # 频道释放后迟到的事件不会重新创建频道
+        frame = relay_hub.publish_event("sim", "agent_message", {"index": 3})
+        relay._send(b"E", b'{"event": "agent_message", "data": {}, "id": "sim-4", "simulation_id": "sim"}')
+        relay_hub.open_channel("other")
+        await _until(lambda: peer_hub.has_channel("other"))
+        await peer.stop()
+        await relay.stop()
+        return frame, peer_hub
+
+    frame, peer_hub = asyncio.run(scenario())
+    assert frame is None
+    assert not peer_hub.has_channel("sim")
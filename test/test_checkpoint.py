@@ -0,0 +1,162 @@
+"""模拟检查点：原子写入、损坏和版本检查、定期写入，以及从检查点恢复群聊后接着发言"""
+import asyncio
+import json
+import os
+import threading
+from typing import List, Sequence
+
+import pytest
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.conditions import MaxMessageTermination
+from autogen_agentchat.messages import BaseChatMessage, TextMessage
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_core import CancellationToken
+
+from conversations.checkpoint import CheckpointStore, CheckpointTrigger, save_team_state, CHECKPOINT_VERSION
+
+
+class EchoAgent(BaseChatAgent):
+    """每次发言回复一条带自己名字的消息"""
+
+    def __init__(self, name: str):
+        super().__init__(name, f"{name} 测试智能体")
+        self.turns = 0
+
+    @property
+    def produced_message_types(self):
+        return (TextMessage,)
+
+    async def on_messages(self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken) -> Response:
+        self.turns += 1
+        return Response(chat_message=TextMessage(content=f"{self.name} 第{self.turns}次发言", source=self.name))
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        self.turns = 0
+
+
+def _checkpoint(simulation_id: str, saved_at: str = "2026-01-01T00:00:00") -> dict:
+    return {
+        "version": CHECKPOINT_VERSION,
+        "simulation_id": simulation_id,
+        "scenario_id": "daily_standup",
+        "scenario_text": "每日站会",
+        "team_mode": "round_robin",
+        "options": {},
+        "messages": [{"id": "m1", "sender": "Manager", "content": "大家好"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0},
+        "turns": 1,
+        "elapsed": 1.5,
+        "team_state": {},
+        "saved_at": saved_at
+    }
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.save(_checkpoint("sim-1"))
+    assert store.load("sim-1") == _checkpoint("sim-1")
+    assert os.listdir(tmp_path) == ["sim-1.json"]
+    assert store.saved == 1
+
+
+def test_load_missing_returns_none(tmp_path):
+    assert CheckpointStore(str(tmp_path)).load("sim-1") is None
+
+
+def test_load_rejects_corrupt_and_incompatible_checkpoints(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    with pytest.raises(ValueError):
+        store.load("broken")
+    (tmp_path / "old.json").write_text(json.dumps({**_checkpoint("old"), "version": 0}), encoding="utf-8")
+    with pytest.raises(ValueError):
+        store.load("old")
+
+
+def test_failed_save_keeps_previous_checkpoint(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.save(_checkpoint("sim-1"))
+    store.save({**_checkpoint("sim-1"), "team_state": object()})
+    assert store.failed == 1
+    assert store.load("sim-1") == _checkpoint("sim-1")
+
+
+def test_list_sorts_by_saved_at_and_skips_broken(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.save(_checkpoint("older", "2026-01-01T00:00:00"))
+    store.save(_checkpoint("newer", "2026-01-02T00:00:00"))
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    summaries = store.list()
+    assert [summary["simulation_id"] for summary in summaries] == ["newer", "older"]
+    assert summaries[0]["message_count"] == 1
+
+    store.delete("newer")
+    store.delete("newer")
+    assert [summary["simulation_id"] for summary in store.list()] == ["older"]
+
+
+def test_save_async_writes_off_the_event_loop(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    threads = []
+    save = store.save
+    store.save = lambda checkpoint: (threads.append(threading.get_ident()), save(checkpoint))
+
+    asyncio.run(store.save_async(_checkpoint("sim-1")))
+    assert threads and threads[0] != threading.get_ident()
+    assert store.load("sim-1") is not None
+
+
+def test_trigger_saves_every_interval_participant_messages():
+    saved: List[List[str]] = []
+
+    async def save(delta):
+        saved.append([message.source for message in delta])
+
+    async def scenario():
+        trigger = CheckpointTrigger(save, ["A", "B"], interval=2)
+        for source in ("System", "A", "B", "A", "B", "A"):
+            assert await trigger([TextMessage(content="...", source=source)]) is None
+        return trigger
+
+    trigger = asyncio.run(scenario())
+    assert saved == [["B"], ["B"]]
+    assert not trigger.terminated
+
+
+def test_trigger_ignores_save_errors():
+    async def save(delta):
+        raise OSError("磁盘已满")
+
+    async def scenario():
+        return await CheckpointTrigger(save, ["A"])([TextMessage(content="...", source="A")])
+
+    assert asyncio.run(scenario()) is None
+
+
+def _team(names, termination=None, max_turns=None) -> RoundRobinGroupChat:
+    return RoundRobinGroupChat([EchoAgent(name) for name in names], termination_condition=termination, max_turns=max_turns)
+
+
+def test_resume_continues_with_next_speaker_and_turn_count():
+    """检查点在群聊计入本轮发言之前写入，恢复后从下一位发言者继续，已用的轮数不会重复计算"""
+    names = ["A", "B", "C"]
+    states = []
+
+    async def scenario():
+        team = None
+
+        async def save(delta):
+            states.append(await save_team_state(team, names))
+
+        team = _team(names, CheckpointTrigger(save, names) | MaxMessageTermination(3))
+        await team.run(task="开始")
+
+        # 从 B 发言后的检查点恢复：已经发言 2 轮，最多 4 轮时还剩 C 和 A
+        resumed = _team(names, max_turns=4)
+        await resumed.load_state(json.loads(json.dumps(states[-1])))
+        return await resumed.run()
+
+    result = asyncio.run(scenario())
+    assert len(states) == 2
+    assert [message.source for message in result.messages] == ["C", "A"]
@@ -0,0 +1,123 @@
+"""按令牌预算截取对话记录的上下文策略"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from autogen_core.model_context import UnboundedChatCompletionContext
+from autogen_core.models import UserMessage
+
+from agents import context_policies, model_clients
+from agents.context_policies import SummaryContext, TokenBudgetContext, create_model_context
+from agents.designer import create_designer_agent
+from agents.model_clients import ModelClientRegistry
+from agents.rate_limiter import RateLimiter
+from agents.turn_metrics import MetricsChatCompletionClient, turn_metrics
+
+
+@pytest.fixture(autouse=True)
+def char_estimate(monkeypatch):
+    """不加载 tiktoken 编码，按字符估算令牌数，结果不依赖网络和编码文件"""
+    async def load_encoding(model):
+        return None
+    monkeypatch.setattr(context_policies, "load_encoding", load_encoding)
+
+
+def _messages(count: int):
+    return [UserMessage(content=f"第{index}条消息，讨论项目进度。", source=f"agent{index}") for index in range(count)]
+
+
+def _trim(context: TokenBudgetContext, messages):
+    async def scenario():
+        for message in messages:
+            await context.add_message(message)
+        return await context.get_messages()
+    return asyncio.run(scenario())
+
+
+def _budget(context: TokenBudgetContext, messages) -> int:
+    return context.count(messages)
+
+
+def test_window_keeps_latest_messages_within_budget():
+    messages = _messages(10)
+    context = TokenBudgetContext("gpt-4o", 0)
+    context.token_limit = _budget(context, messages[-3:])
+    assert _trim(context, messages) == messages[-3:]
+
+
+def test_window_keeps_everything_under_budget():
+    messages = _messages(4)
+    context = TokenBudgetContext("gpt-4o", 100_000)
+    assert _trim(context, messages) == messages
+
+
+def test_window_always_keeps_latest_message_even_over_budget():
+    messages = _messages(3)
+    context = TokenBudgetContext("gpt-4o", 1)
+    assert _trim(context, messages) == messages[-1:]
+
+
+def test_head_tail_pins_head_and_fills_rest_with_latest():
+    messages = _messages(10)
+    context = TokenBudgetContext("gpt-4o", 0, head_messages=1)
+    context.token_limit = _budget(context, messages[:1] + messages[-2:])
+    assert _trim(context, messages) == messages[:1] + messages[-2:]
+
+
+def test_window_stops_at_first_message_that_does_not_fit():
+    """从最新往前取，遇到放不下的消息就停止，不跳过它去取更早的短消息"""
+    short, long = UserMessage(content="好", source="a"), UserMessage(content="很长的消息" * 20, source="b")
+    messages = [short, long, short, short]
+    context = TokenBudgetContext("gpt-4o", 0)
+    context.token_limit = _budget(context, [short, short, short])
+    assert _trim(context, messages) == [short, short]
+
+
+def test_create_model_context_by_policy():
+    assert isinstance(create_model_context("full", "gpt-4o", None), UnboundedChatCompletionContext)
+    assert create_model_context("window", "gpt-4o", None, 500).head_messages == 0
+    head_tail = create_model_context("head_tail", "gpt-4o", None, 500)
+    assert head_tail.head_messages == context_policies.CONTEXT_HEAD_MESSAGES
+    assert head_tail.token_limit == 500
+    with pytest.raises(ValueError):
+        create_model_context("sliding", "gpt-4o", None)
+
+
+def test_summary_uses_plain_non_streaming_client(monkeypatch):
+    """摘要请求不带 stream_options，也不计入智能体的发言统计"""
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "gpt-4o-mini-2024-07-18",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "大家讨论了项目进度。"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 50, "completion_tokens": 8, "total_tokens": 58}
+        })
+
+    monkeypatch.setenv("MODEL_NAME", "gpt-4o-mini")
+    monkeypatch.setenv("API_TOKEN", "sk-test")
+    monkeypatch.setattr(model_clients, "model_client_registry", ModelClientRegistry())
+    monkeypatch.setattr(model_clients, "rate_limiter", RateLimiter(rpm=0, tpm=0))
+    monkeypatch.setattr(model_clients, "active_cassette", None)
+    monkeypatch.setattr(
+        ModelClientRegistry, "_http_client",
+        lambda self, base_url: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+
+    agent = create_designer_agent(model_client_stream=True, use_cache=False, context_policy="summary")
+    context = agent._model_context
+    assert isinstance(context, SummaryContext)
+    assert not isinstance(context.model_client, MetricsChatCompletionClient)
+
+    messages = _messages(10)
+    context.token_limit = _budget(context, messages[:1] + messages[-2:])
+    _trim(context, messages)
+    assert context.summary == "大家讨论了项目进度。"
+    assert len(sent) == 1
+    assert not sent[0].get("stream") and "stream_options" not in sent[0]
+    assert turn_metrics.pop("default", agent.name) is None
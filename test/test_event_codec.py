@@ -0,0 +1,87 @@
+"""WebSocket 二进制批量帧的编解码，以及 SSE 批量帧的合并"""
+import asyncio
+import json
+
+from utils.event_codec import BATCH_EVENT, LENGTH_PREFIX, decode_batch, encode_batch, encode_sse_batch
+from utils.event_hub import EventFrame, Subscriber
+
+
+def _frames():
+    return [
+        EventFrame("agent_message", {"sender": "Dev", "content": "接口文档今天写完 ✓"}, "sim-1", "sim"),
+        EventFrame("simulation_status", {"is_running": False}, "sim-2", "sim"),
+        EventFrame("subscribed", {"simulation_id": None, "is_running": True})
+    ]
+
+
+def test_encode_then_decode_returns_envelopes_in_order():
+    assert decode_batch(encode_batch(_frames())) == [
+        {"event": "agent_message", "id": "sim-1", "simulation_id": "sim",
+         "data": {"sender": "Dev", "content": "接口文档今天写完 ✓"}},
+        {"event": "simulation_status", "id": "sim-2", "simulation_id": "sim", "data": {"is_running": False}},
+        {"event": "subscribed", "id": None, "simulation_id": None, "data": {"simulation_id": None, "is_running": True}}
+    ]
+
+
+def test_length_prefix_counts_utf8_bytes():
+    frame = _frames()[0]
+    data = encode_batch([frame])
+    (size,) = LENGTH_PREFIX.unpack_from(data, 0)
+    assert size == len(frame.envelope) == len(data) - LENGTH_PREFIX.size
+    assert json.loads(frame.envelope)["data"]["content"].endswith("✓")
+
+
+def test_empty_batch():
+    assert encode_batch([]) == b""
+    assert decode_batch(b"") == []
+
+
+def test_get_batch_takes_backlog_up_to_limit():
+    async def scenario():
+        subscriber = Subscriber(1, 8)
+        for frame in _frames():
+            subscriber.put(frame)
+        first = await subscriber.get_batch(2)
+        second = await subscriber.get_batch(2)
+        return subscriber, first, second
+
+    subscriber, first, second = asyncio.run(scenario())
+    assert [frame.event for frame in first] == ["agent_message", "simulation_status"]
+    assert [frame.event for frame in second] == ["subscribed"]
+    # 不带ID的应答不改变恢复位置
+    assert subscriber.last_event_id == "sim-2"
+
+
+def _parse_sse(payload: bytes) -> dict:
+    fields = {}
+    for line in payload.decode("utf-8").strip().split("\n"):
+        name, _, value = line.partition(": ")
+        fields[name] = value
+    return fields
+
+
+def test_sse_batch_merges_events_and_keeps_last_id():
+    heartbeat = EventFrame.comment("ping")
+    frames = _frames()
+    payload = encode_sse_batch([frames[0], heartbeat, frames[1], frames[2]])
+    fields = _parse_sse(payload)
+    # 最后一个事件没有ID，批量帧沿用批次中最后一个带ID的事件
+    assert fields["id"] == "sim-2"
+    assert fields["event"] == BATCH_EVENT
+    assert [envelope["event"] for envelope in json.loads(fields["data"])] == [
+        "agent_message", "simulation_status", "subscribed"
+    ]
+    assert payload.endswith(b"\n\n")
+
+
+def test_sse_batch_of_one_event_or_only_comments_is_unchanged():
+    frame = _frames()[0]
+    heartbeat = EventFrame.comment("ping")
+    assert encode_sse_batch([heartbeat, frame]) == frame.payload
+    assert encode_sse_batch([heartbeat]) == heartbeat.payload
+    assert encode_sse_batch([]) == b""
+
+
+def test_sse_batch_without_ids_has_no_id_line():
+    frames = [EventFrame("agent_message", {"index": index}) for index in range(2)]
+    assert "id" not in _parse_sse(encode_sse_batch(frames))
@@ -0,0 +1,144 @@
+"""事件频道的回放缓冲区和订阅者的溢出策略"""
+from utils.event_hub import Channel, EventFrame, EventHub, Subscriber
+
+
+def _channel(events: int, replay_size: int = 8) -> Channel:
+    channel = Channel("sim", replay_size)
+    for index in range(events):
+        channel.next_frame("agent_message", {"index": index})
+    return channel
+
+
+def _seqs(frames):
+    return [int(frame.event_id.rsplit("-", 1)[1]) for frame in frames]
+
+
+def test_replay_since_returns_only_missing_suffix():
+    channel = _channel(5)
+    assert _seqs(channel.replay_since(3)) == [4, 5]
+    assert channel.replay_since(5) == []
+
+
+def test_replay_since_none_returns_whole_buffer():
+    assert _seqs(_channel(3).replay_since(None)) == [1, 2, 3]
+
+
+def test_replay_since_evicted_seq_returns_what_is_left():
+    """缺失的事件已被挤出回放缓冲区时，补发仍在缓冲区中的全部事件"""
+    channel = _channel(12, replay_size=8)
+    assert _seqs(channel.replay_since(2)) == list(range(5, 13))
+    # 恰好是缓冲区最早事件的前一个时不算丢失
+    assert _seqs(channel.replay_since(4)) == list(range(5, 13))
+
+
+def test_hub_replay_for_channel_ignores_ids_from_other_channels():
+    hub = EventHub(replay_size=8)
+    for channel_id in ("a", "b"):
+        hub.open_channel(channel_id)
+        for index in range(3):
+            hub.publish_event(channel_id, "agent_message", {"index": index})
+    assert [frame.event_id for frame in hub.replay_since("b-1", "b")] == ["b-2", "b-3"]
+    assert [frame.event_id for frame in hub.replay_since("a-2", "b")] == ["b-1", "b-2", "b-3"]
+    assert hub.replay_since(None, "b") == []
+
+
+def test_replay_since_seq_newer_than_channel_replays_whole_buffer():
+    """进程重启后频道重新编号，客户端带来的旧序号比当前序号大"""
+    channel = _channel(3)
+    assert _seqs(channel.replay_since(57)) == [1, 2, 3]
+
+
+def test_subscriber_in_global_and_channel_receives_each_event_once():
+    hub = EventHub()
+    hub.open_channel("sim")
+    subscriber = hub.create_subscriber()
+    hub.join(subscriber, None)
+    hub.join(subscriber, "sim")
+    hub.publish_event("sim", "agent_message", {"content": "你好"})
+    assert [frame.event_id for frame in subscriber.buffer] == ["sim-1"]
+
+
+def _subscriber(policy: str, maxsize: int = 3) -> Subscriber:
+    return Subscriber(1, maxsize, policy)
+
+
+def _events(subscriber: Subscriber):
+    return [(frame.event, frame.data) for frame in subscriber.buffer]
+
+
+def test_drop_oldest_keeps_latest_events():
+    subscriber = _subscriber("drop_oldest")
+    for index in range(5):
+        subscriber.put(EventFrame("agent_message", index))
+    assert _events(subscriber) == [("agent_message", 2), ("agent_message", 3), ("agent_message", 4)]
+    assert subscriber.overflows == 2
+
+
+def test_coalesce_status_drops_stale_status_before_messages():
+    subscriber = _subscriber("coalesce_status")
+    subscriber.put(EventFrame("simulation_status", {"is_running": True}))
+    subscriber.put(EventFrame("agent_message", 1))
+    subscriber.put(EventFrame("simulation_status", {"is_running": False}))
+    subscriber.put(EventFrame("agent_message", 2))
+    assert _events(subscriber) == [
+        ("agent_message", 1),
+        ("simulation_status", {"is_running": False}),
+        ("agent_message", 2)
+    ]
+
+
+def test_coalesce_status_falls_back_to_drop_oldest():
+    subscriber = _subscriber("coalesce_status")
+    for index in range(4):
+        subscriber.put(EventFrame("agent_message", index))
+    assert _events(subscriber) == [("agent_message", 1), ("agent_message", 2), ("agent_message", 3)]
+
+
+def test_disconnect_clears_buffer_and_reports_resume_point():
+    subscriber = _subscriber("disconnect", maxsize=2)
+    subscriber.put(EventFrame("agent_message", 1, "sim-1"))
+    subscriber._pop()
+    subscriber.put(EventFrame("agent_message", 2, "sim-2"))
+    subscriber.put(EventFrame("agent_message", 3, "sim-3"))
+    subscriber.put(EventFrame("agent_message", 4, "sim-4"))
+    assert subscriber.closed
+    assert _events(subscriber) == [("overflow", {"reason": "slow_consumer", "last_event_id": "sim-1"})]
+    # 断开后不再接收新事件
+    subscriber.put(EventFrame("agent_message", 5, "sim-5"))
+    assert len(subscriber.buffer) == 1
+
+
+def test_publish_to_unknown_or_released_channel_is_dropped():
+    hub = EventHub()
+    assert hub.publish_event("sim", "agent_message", {}) is None
+    assert not hub.has_channel("sim")
+
+    hub.open_channel("sim")
+    hub.close_channel("sim")
+    assert hub.publish_event("sim", "agent_message", {}) is None
+    assert not hub.has_channel("sim")
+
+    # 从检查点恢复的模拟沿用原来的ID，重新开启后可以发布
+    hub.open_channel("sim")
+    assert hub.publish_event("sim", "agent_message", {}).event_id == "sim-1"
+
+
+def test_remote_frame_after_release_does_not_recreate_channel():
+    hub = EventHub()
+    subscriber = hub.subscribe()
+    hub.apply_remote_open("sim")
+    hub.apply_remote_close("sim")
+    assert hub.apply_remote_frame(EventFrame("agent_message", {}, "sim-3", "sim")) == 0
+    assert not hub.has_channel("sim")
+    assert len(subscriber.buffer) == 0
+
+
+def test_remote_frame_for_unseen_channel_opens_it_until_close():
+    """worker 在频道开启后才连上代理，错过了开启消息"""
+    hub = EventHub()
+    subscriber = hub.subscribe()
+    assert hub.apply_remote_frame(EventFrame("agent_message", {}, "sim-3", "sim")) == 1
+    assert hub.is_open("sim")
+    assert [frame.event_id for frame in hub.replay_since("sim-2", "sim")] == ["sim-3"]
+    hub.apply_remote_close("sim")
+    assert not hub.has_channel("sim")
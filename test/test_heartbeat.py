@@ -0,0 +1,120 @@
+"""共享心跳时间轮，以及SSE响应在客户端断开时立即停止写出"""
+import asyncio
+
+import pytest
+
+from utils import heartbeat as heartbeat_module
+from utils.event_hub import EventFrame, Subscriber
+from utils.heartbeat import HEARTBEAT_FRAME, HeartbeatWheel
+from utils.sse_response import EventSourceResponse
+
+real_sleep = asyncio.sleep
+
+
+class ManualTicks:
+    """替换时间轮的 asyncio.sleep，由测试逐格拨动指针"""
+
+    def __init__(self):
+        self.pending = None
+
+    async def sleep(self, delay: float) -> None:
+        self.pending = asyncio.get_running_loop().create_future()
+        await self.pending
+
+    async def advance(self, wheel: HeartbeatWheel, ticks: int = 1) -> None:
+        for _ in range(ticks):
+            tick = self.pending
+            tick.set_result(None)
+            # 等时间轮检查完这一格并重新进入等待（或因没有订阅者而退出）
+            while self.pending is tick and not wheel._task.done():
+                await real_sleep(0)
+
+
+@pytest.fixture
+def ticks(monkeypatch):
+    manual = ManualTicks()
+    monkeypatch.setattr(heartbeat_module.asyncio, "sleep", manual.sleep)
+    return manual
+
+
+def _pings(subscriber: Subscriber) -> int:
+    return sum(1 for frame in subscriber.buffer if frame is HEARTBEAT_FRAME)
+
+
+def test_idle_subscriber_gets_one_ping_per_revolution(ticks):
+    async def scenario():
+        wheel = HeartbeatWheel(interval=3, tick=1)
+        idle, busy = Subscriber(1, 8), Subscriber(2, 8)
+        wheel.add(idle)
+        wheel.add(busy)
+        await real_sleep(0)
+
+        busy.put(EventFrame("agent_message", {}, "sim-1"))
+        busy.buffer.popleft()
+        await ticks.advance(wheel, 2)
+        assert _pings(idle) == 0
+        await ticks.advance(wheel)
+        # 一整圈内有过写入的订阅者只清除活跃标记
+        assert (_pings(idle), _pings(busy)) == (1, 0)
+
+        # 缓冲区里还有未读的心跳时不再重复发送
+        await ticks.advance(wheel, 3)
+        assert (_pings(idle), _pings(busy)) == (1, 1)
+        return wheel
+
+    assert asyncio.run(scenario()).sent == 2
+
+
+def test_wheel_skips_closed_subscribers_and_stops_when_empty(ticks):
+    async def scenario():
+        wheel = HeartbeatWheel(interval=2, tick=1)
+        closed, removed = Subscriber(1, 8), Subscriber(2, 8)
+        closed.closed = True
+        wheel.add(closed)
+        wheel.add(removed)
+        await real_sleep(0)
+        wheel.remove(removed)
+        await ticks.advance(wheel, 2)
+        assert len(closed.buffer) == len(removed.buffer) == 0
+
+        wheel.remove(closed)
+        await ticks.advance(wheel)
+        return wheel
+
+    wheel = asyncio.run(scenario())
+    assert wheel._task.done()
+    assert len(wheel) == 0
+
+
+def test_event_source_response_stops_on_disconnect():
+    """事件生成器无限期等待下一个事件，客户端断开后响应仍立即结束并清理生成器"""
+    finished = []
+
+    async def events():
+        try:
+            yield b"data: 1\n\n"
+            await asyncio.Event().wait()
+        finally:
+            finished.append(True)
+
+    async def scenario():
+        sent = []
+        body_sent = asyncio.Event()
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body":
+                body_sent.set()
+
+        async def receive():
+            await body_sent.wait()
+            return {"type": "http.disconnect"}
+
+        response = EventSourceResponse(events())
+        await asyncio.wait_for(response({"type": "http"}, receive, send), timeout=2)
+        return sent
+
+    sent = asyncio.run(scenario())
+    assert sent[0]["type"] == "http.response.start"
+    assert [message["body"] for message in sent[1:]] == [b"data: 1\n\n"]
+    assert finished == [True]
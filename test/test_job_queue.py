@@ -0,0 +1,86 @@
+"""JobQueue 的优先级排序、槽位限制和准入控制"""
+import asyncio
+
+import pytest
+
+from utils.job_queue import JobQueue, QueueFullError
+
+
+def _job(started, release, job_id):
+    async def run():
+        started.append(job_id)
+        await release.wait()
+    return run
+
+
+def test_batch_jobs_wait_behind_interactive_jobs():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        started, release = [], asyncio.Event()
+        assert queue.submit("running", _job(started, release, "running"), "batch") == 0
+        assert queue.submit("batch-1", _job(started, release, "batch-1"), "batch") == 1
+        assert queue.submit("batch-2", _job(started, release, "batch-2"), "batch") == 2
+        # 交互式任务插到所有批量任务之前，同一优先级内先到先执行
+        assert queue.submit("interactive", _job(started, release, "interactive"), "interactive") == 1
+        assert [queue.position(job_id) for job_id in ("interactive", "batch-1", "batch-2")] == [1, 2, 3]
+        release.set()
+        while len(started) < 4:
+            await asyncio.sleep(0)
+        return started
+
+    assert asyncio.run(scenario()) == ["running", "interactive", "batch-1", "batch-2"]
+
+
+def test_cancelled_job_is_skipped_and_positions_shift():
+    async def scenario():
+        positions = {}
+        queue = JobQueue(workers=1, on_position=lambda job_id, position, eta: positions.__setitem__(job_id, position))
+        started, release = [], asyncio.Event()
+        for job_id in ("a", "b", "c"):
+            queue.submit(job_id, _job(started, release, job_id))
+        assert queue.cancel("b")
+        assert not queue.cancel("b")
+        assert positions["c"] == 1
+        release.set()
+        while len(started) < 2:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return started, queue
+
+    started, queue = asyncio.run(scenario())
+    assert started == ["a", "c"]
+    assert len(queue) == 0
+
+
+def test_full_queue_rejects_with_retry_after_from_average_duration():
+    async def scenario():
+        queue = JobQueue(workers=1, max_queued=1)
+        started, release = [], asyncio.Event()
+        queue.submit("a", _job(started, release, "a"))
+        queue.submit("b", _job(started, release, "b"))
+        # 还没有完成的任务时无法估算等待时间
+        with pytest.raises(QueueFullError) as error:
+            queue.submit("c", _job(started, release, "c"))
+        assert error.value.retry_after is None
+
+        queue.average_duration = 12.0
+        with pytest.raises(QueueFullError) as error:
+            queue.submit("d", _job(started, release, "d"))
+        release.set()
+        return queue, error.value
+
+    queue, error = asyncio.run(scenario())
+    assert error.retry_after == 12.0
+    assert queue.rejected == 2
+
+
+def test_eta_rounds_position_up_to_whole_batches_of_workers():
+    queue = JobQueue(workers=2)
+    queue.average_duration = 10.0
+    assert [queue.eta(position) for position in (1, 2, 3, 4, 5)] == [10.0, 10.0, 20.0, 20.0, 30.0]
+
+
+def test_unknown_priority_class_is_rejected():
+    queue = JobQueue(workers=1)
+    with pytest.raises(ValueError):
+        queue.submit("a", lambda: None, "urgent")
@@ -0,0 +1,76 @@
+"""MinHash 相似度估算和重复循环检测"""
+import asyncio
+
+import numpy as np
+from autogen_agentchat.messages import TextMessage
+
+from conversations.loop_detector import LoopDetector, LoopTermination, MinHasher
+
+MESSAGE = "好的，我们下周一之前完成登录模块的接口设计，周三开始联调，有问题随时在群里沟通。"
+PARAPHRASE = "好的，我们下周一之前完成登录模块的接口设计，周三开始联调，有问题随时沟通。"
+UNRELATED = "设计稿里的配色偏暗，建议主按钮换成品牌蓝，图标统一改成线性风格。"
+
+
+def _similarity(hasher: MinHasher, first: str, second: str) -> float:
+    return float((hasher.signature(first) == hasher.signature(second)).mean())
+
+
+def test_signature_is_deterministic_for_a_seed():
+    assert np.array_equal(MinHasher().signature(MESSAGE), MinHasher().signature(MESSAGE))
+
+
+def test_whitespace_does_not_change_signature():
+    hasher = MinHasher()
+    assert np.array_equal(hasher.signature(MESSAGE), hasher.signature(MESSAGE.replace("，", "， \n")))
+
+
+def test_paraphrase_crosses_default_threshold_and_unrelated_does_not():
+    hasher = MinHasher()
+    detector = LoopDetector()
+    assert _similarity(hasher, MESSAGE, PARAPHRASE) >= detector.threshold
+    assert _similarity(hasher, MESSAGE, UNRELATED) < 0.2
+
+
+def test_short_text_still_produces_a_signature():
+    assert MinHasher().signature("好").shape == (64,)
+
+
+def test_detector_streak_counts_consecutive_repeats_across_agents():
+    detector = LoopDetector(threshold=0.75)
+    assert detector.observe("Manager", MESSAGE) == 0.0
+    detector.observe("SeniorDev", PARAPHRASE)
+    assert detector.streak == 1
+    detector.observe("JuniorDev", MESSAGE)
+    assert detector.streak == 2
+    detector.observe("Designer", UNRELATED)
+    assert detector.streak == 0
+
+
+def test_redirect_once_then_stop():
+    notes = []
+
+    async def redirect(note: str) -> None:
+        notes.append(note)
+
+    async def scenario():
+        condition = LoopTermination(["Manager", "SeniorDev"], "redirect", 0.75, patience=2, max_redirects=1, redirect=redirect)
+        results = []
+        for index in range(6):
+            source = "Manager" if index % 2 == 0 else "SeniorDev"
+            results.append(await condition([TextMessage(content=MESSAGE, source=source)]))
+        return condition, results
+
+    condition, results = asyncio.run(scenario())
+    assert len(notes) == 1
+    # 第 3 条时连续 2 条重复，先提示；清零后再连续 2 条重复时结束
+    assert results[:4] == [None, None, None, None]
+    assert results[4] is not None
+    assert condition.terminated
+
+
+def test_messages_from_non_participants_are_ignored():
+    async def scenario():
+        condition = LoopTermination(["Manager"], "stop", 0.75, patience=1)
+        return [await condition([TextMessage(content=MESSAGE, source="System")]) for _ in range(3)]
+
+    assert asyncio.run(scenario()) == [None, None, None]
@@ -0,0 +1,153 @@
+"""模型响应缓存：LRU 淘汰、TTL 过期、磁盘层，以及缓存客户端的命中和不缓存被截断的回复"""
+import asyncio
+
+import pytest
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+
+from agents import model_cache as model_cache_module
+from agents.call_context import CallMetrics, current_call
+from agents.model_cache import CachedChatCompletionClient, ChatCompletionClientWrapper, ResponseCache, request_key
+
+PARAMS = {"model": "gpt-4o", "temperature": 0.7, "seed": 42}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(model_cache_module.time, "time", fake)
+    return fake
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2, directory="")
+    cache.set("a", {"v": 1})
+    cache.set("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.set("c", {"v": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"], stats["hits"], stats["misses"]) == (2, 1, 2, 1)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(ttl=60, directory="")
+    cache.set("a", {"v": 1})
+    clock.now += 59
+    assert cache.get("a") == {"v": 1}
+    clock.now += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["expired"] == 1
+
+
+def test_disk_tier_survives_restart_and_expires(tmp_path, clock):
+    ResponseCache(ttl=60, directory=str(tmp_path)).set("ab12", {"v": 1})
+    assert (tmp_path / "ab" / "ab12.json").exists()
+
+    restarted = ResponseCache(ttl=60, directory=str(tmp_path))
+    assert restarted.get("ab12") == {"v": 1}
+    assert restarted.disk_hits == 1
+    # 命中后放回内存层
+    assert restarted.get("ab12") == {"v": 1}
+    assert restarted.hits == 1
+
+    clock.now += 60
+    assert ResponseCache(ttl=60, directory=str(tmp_path)).get("ab12") is None
+    assert not (tmp_path / "ab" / "ab12.json").exists()
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path))
+    (tmp_path / "cd").mkdir()
+    (tmp_path / "cd" / "cd34.json").write_text("{", encoding="utf-8")
+    assert cache.get("cd34") is None
+    assert cache.misses == 1
+
+
+def _messages(text: str = "你好"):
+    return [UserMessage(content=text, source="user")]
+
+
+def test_request_key_covers_params_messages_and_options():
+    key = request_key(PARAMS, _messages(), [], None, {})
+    assert key == request_key(dict(reversed(PARAMS.items())), _messages(), [], None, {})
+    assert key != request_key({**PARAMS, "seed": 7}, _messages(), [], None, {})
+    assert key != request_key(PARAMS, _messages("再见"), [], None, {})
+    assert key != request_key(PARAMS, _messages(), [], True, {})
+    assert key != request_key(PARAMS, _messages(), [], None, {"max_tokens": 10})
+
+
+class ScriptedClient(ChatCompletionClientWrapper):
+    """按顺序返回预设回复的模型客户端，记录被调用的次数"""
+
+    def __init__(self, replies):
+        super().__init__(None)
+        self.replies = list(replies)
+        self.calls = 0
+
+    def _next(self) -> CreateResult:
+        self.calls += 1
+        content, finish_reason = self.replies.pop(0)
+        return CreateResult(finish_reason=finish_reason, content=content, usage=RequestUsage(prompt_tokens=10, completion_tokens=2), cached=False)
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        return self._next()
+
+    async def create_stream(self, messages, **kwargs):
+        result = self._next()
+        yield result.content
+        yield result
+
+
+def test_cached_client_hit_skips_model_and_reports_local_tokens():
+    client = CachedChatCompletionClient(ScriptedClient([("第一次", "stop")]), PARAMS, ResponseCache(directory=""))
+
+    async def scenario():
+        first = await client.create(_messages())
+        call = CallMetrics()
+        current_call.set(call)
+        second = await client.create(_messages())
+        return first, second, call
+
+    first, second, call = asyncio.run(scenario())
+    assert client.client.calls == 1
+    assert not first.cached and first.usage.prompt_tokens == 10
+    assert second.cached and second.content == "第一次"
+    assert (second.usage.prompt_tokens, second.usage.completion_tokens) == (0, 0)
+    assert call.cached and call.local_cache_tokens == 12
+
+
+def test_stream_hit_yields_whole_reply_as_one_chunk():
+    client = CachedChatCompletionClient(ScriptedClient([("好的", "stop")]), PARAMS, ResponseCache(directory=""))
+
+    async def scenario():
+        await client.create(_messages())
+        return [item async for item in client.create_stream(_messages())]
+
+    items = asyncio.run(scenario())
+    assert items[0] == "好的"
+    assert items[1].cached
+    assert client.client.calls == 1
+
+
+def test_truncated_reply_is_not_cached():
+    cache = ResponseCache(directory="")
+    client = CachedChatCompletionClient(ScriptedClient([("说到一半", "length"), ("完整回复", "stop")]), PARAMS, cache)
+
+    async def scenario():
+        return [item async for item in client.create_stream(_messages())][-1], await client.create(_messages())
+
+    truncated, complete = asyncio.run(scenario())
+    assert truncated.content == "说到一半"
+    assert complete.content == "完整回复" and not complete.cached
+    assert client.client.calls == 2
+    assert cache.get(request_key(PARAMS, _messages(), [], None, {}))["content"] == "完整回复"
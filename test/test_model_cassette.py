@@ -0,0 +1,126 @@
+"""模型请求磁带：录制、按顺序回放，以及录制时命中响应缓存的回复同样写入磁带"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+
+from agents import model_clients
+from agents.model_cache import ChatCompletionClientWrapper, ResponseCache
+from agents.model_cassette import Cassette, CassetteChatCompletionClient, CassetteMissError
+from agents.model_clients import ModelClientRegistry
+from agents.rate_limiter import RateLimiter
+
+PARAMS = {"model": "gpt-4o", "temperature": 0.7, "seed": 42}
+
+
+class ScriptedClient(ChatCompletionClientWrapper):
+    """按顺序返回预设回复的模型客户端，记录被调用的次数"""
+
+    def __init__(self, replies):
+        super().__init__(None)
+        self.replies = list(replies)
+        self.calls = 0
+
+    def _next(self) -> CreateResult:
+        self.calls += 1
+        content = self.replies.pop(0)
+        return CreateResult(finish_reason="stop", content=content, usage=RequestUsage(prompt_tokens=10, completion_tokens=2), cached=False)
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        return self._next()
+
+    async def create_stream(self, messages, **kwargs):
+        result = self._next()
+        for char in result.content:
+            yield char
+        yield result
+
+
+def _messages(text: str = "你好"):
+    return [UserMessage(content=text, source="user")]
+
+
+def _stream(client, messages):
+    async def scenario():
+        return [item async for item in client.create_stream(messages)]
+    return asyncio.run(scenario())
+
+
+def test_record_then_replay_returns_recorded_replies_in_order(tmp_path):
+    path = str(tmp_path / "demo.jsonl")
+    recorder = CassetteChatCompletionClient(ScriptedClient(["第一次", "第二次"]), PARAMS, Cassette(path, "record"))
+    assert asyncio.run(recorder.create(_messages())).content == "第一次"
+    assert _stream(recorder, _messages())[-1].content == "第二次"
+    assert recorder.cassette.recorded == 2
+    assert len(open(path, encoding="utf-8").read().splitlines()) == 2
+
+    # 回放不调用被包装的客户端；同一请求按录制顺序回放，用完后重复最后一条
+    replay = CassetteChatCompletionClient(ScriptedClient([]), PARAMS, Cassette(path, "replay"))
+    assert asyncio.run(replay.create(_messages())).content == "第一次"
+    items = _stream(replay, _messages())
+    assert items[:-1] == list("第二次")
+    assert items[-1].content == "第二次"
+    assert asyncio.run(replay.create(_messages())).content == "第二次"
+    assert replay.client.calls == 0
+    assert replay.cassette.replayed == 3
+
+
+def test_replay_miss_raises_and_is_counted(tmp_path):
+    path = tmp_path / "empty.jsonl"
+    path.write_text("", encoding="utf-8")
+    cassette = Cassette(str(path), "replay")
+    client = CassetteChatCompletionClient(ScriptedClient([]), PARAMS, cassette)
+    with pytest.raises(CassetteMissError):
+        asyncio.run(client.create(_messages("没有录制过")))
+    assert cassette.misses == 1
+
+
+def test_request_key_depends_on_params(tmp_path):
+    path = str(tmp_path / "demo.jsonl")
+    recorder = CassetteChatCompletionClient(ScriptedClient(["回复"]), PARAMS, Cassette(path, "record"))
+    asyncio.run(recorder.create(_messages()))
+    other = CassetteChatCompletionClient(ScriptedClient([]), {**PARAMS, "seed": 7}, Cassette(path, "replay"))
+    with pytest.raises(CassetteMissError):
+        asyncio.run(other.create(_messages()))
+
+
+def test_invalid_mode_and_latency_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "demo.jsonl"), "rewind")
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "demo.jsonl"), "record", "slow")
+
+
+def test_recording_includes_cache_hits(tmp_path, monkeypatch):
+    """磁带包在响应缓存外层：第二次相同请求命中缓存不访问网络，但仍写入磁带"""
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, json={
+            "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o-2024-08-06",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "好的"}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+        })
+
+    cassette = Cassette(str(tmp_path / "demo.jsonl"), "record")
+    monkeypatch.setattr(model_clients, "rate_limiter", RateLimiter(rpm=0, tpm=0))
+    monkeypatch.setattr(model_clients, "CACHE_ENABLED", True)
+    monkeypatch.setattr(model_clients, "response_cache", ResponseCache(directory=""))
+    monkeypatch.setattr(model_clients, "active_cassette", cassette)
+    monkeypatch.setattr(
+        ModelClientRegistry, "_http_client",
+        lambda self, base_url: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+
+    async def scenario():
+        client = ModelClientRegistry().get("gpt-4o", "http://model.test/v1", "sk-test", 0.7, 42, False)
+        assert isinstance(client, CassetteChatCompletionClient)
+        return [await client.create(_messages()) for _ in range(2)]
+
+    first, second = asyncio.run(scenario())
+    assert len(sent) == 1
+    assert second.cached and second.content == first.content
+    assert cassette.recorded == 2
@@ -0,0 +1,115 @@
+"""共享模型客户端：stream_options 只附加在流式请求上，事件循环变化后关闭旧连接池"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from autogen_core.models import UserMessage
+
+from agents import model_clients
+from agents.model_clients import ModelClientRegistry
+from agents.rate_limiter import RateLimiter
+
+BASE_URL = "http://model.test/v1"
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o-2024-08-06",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "好的"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+}
+
+
+def _chunk(delta, finish_reason=None, usage=None):
+    return {
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "gpt-4o-2024-08-06",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+        "usage": usage
+    }
+
+
+STREAM = [
+    _chunk({"role": "assistant", "content": "好"}),
+    _chunk({"content": "的"}, finish_reason="stop"),
+    _chunk(None, usage={"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12})
+]
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    """用 MockTransport 代替网络，记录发出的请求体"""
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        sent.append(body)
+        if body.get("stream"):
+            content = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in STREAM) + "data: [DONE]\n\n"
+            return httpx.Response(200, content=content.encode("utf-8"), headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json=COMPLETION)
+
+    monkeypatch.setattr(model_clients, "rate_limiter", RateLimiter(rpm=0, tpm=0))
+    monkeypatch.setattr(model_clients, "active_cassette", None)
+    monkeypatch.setattr(
+        ModelClientRegistry, "_http_client",
+        lambda self, base_url: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    return sent
+
+
+def _client(registry: ModelClientRegistry, stream: bool):
+    return registry.get("gpt-4o", BASE_URL, "sk-test", 0.7, 42, stream, use_cache=False)
+
+
+def test_streaming_client_create_has_no_stream_options(requests):
+    async def scenario():
+        client = _client(ModelClientRegistry(), stream=True)
+        return await client.create([UserMessage(content="你好", source="user")])
+
+    result = asyncio.run(scenario())
+    assert result.content == "好的"
+    assert "stream_options" not in requests[0]
+
+
+def test_streaming_client_create_stream_requests_usage(requests):
+    async def scenario():
+        client = _client(ModelClientRegistry(), stream=True)
+        return [item async for item in client.create_stream([UserMessage(content="你好", source="user")])]
+
+    items = asyncio.run(scenario())
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    assert items[-1].usage.prompt_tokens == 10
+
+
+def test_non_streaming_client_never_sends_stream_options(requests):
+    async def scenario():
+        client = _client(ModelClientRegistry(), stream=False)
+        await client.create([UserMessage(content="你好", source="user")])
+        return [item async for item in client.create_stream([UserMessage(content="你好", source="user")])]
+
+    asyncio.run(scenario())
+    assert all("stream_options" not in body for body in requests)
+
+
+def test_loop_change_closes_stale_http_pools():
+    registry = ModelClientRegistry()
+
+    async def first():
+        registry.get("gpt-4o", BASE_URL, "sk-test", 0.7, 42, True, use_cache=False)
+        return registry._http_clients[BASE_URL]
+
+    async def second():
+        registry.get("gpt-4o", BASE_URL, "sk-test", 0.7, 42, True, use_cache=False)
+        await asyncio.gather(*registry._closing)
+        return registry._http_clients[BASE_URL]
+
+    stale = asyncio.run(first())
+    fresh = asyncio.run(second())
+    assert stale.is_closed
+    assert fresh is not stale and not fresh.is_closed
+    asyncio.run(fresh.aclose())
@@ -0,0 +1,136 @@
+"""并行轮次群聊：主持人先发言，其余参与者基于同一快照同时回复，回复按参与者顺序发布"""
+import asyncio
+import json
+from typing import AsyncGenerator, Dict, List, Sequence
+
+import pytest
+from autogen_agentchat.agents import BaseChatAgent
+from autogen_agentchat.base import Response, TaskResult
+from autogen_agentchat.conditions import SourceMatchTermination
+from autogen_agentchat.messages import BaseChatMessage, ModelClientStreamingChunkEvent, TextMessage
+from autogen_core import CancellationToken
+
+from conversations.checkpoint import CheckpointTrigger, save_team_state
+from conversations.parallel_team import ParallelRoundGroupChat
+
+
+class SlowAgent(BaseChatAgent):
+    """等待 delay 秒后先发出一个流式分片再回复，记录每次收到的消息"""
+
+    def __init__(self, name: str, delay: float = 0.0):
+        super().__init__(name, f"{name} 测试智能体")
+        self.delay = delay
+        self.received: List[List[str]] = []
+
+    @property
+    def produced_message_types(self):
+        return (TextMessage,)
+
+    async def on_messages(self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken) -> Response:
+        async for item in self.on_messages_stream(messages, cancellation_token):
+            if isinstance(item, Response):
+                return item
+        raise AssertionError("没有回复")
+
+    async def on_messages_stream(self, messages, cancellation_token) -> AsyncGenerator:
+        self.received.append([message.source for message in messages])
+        await asyncio.sleep(self.delay)
+        content = f"{self.name} 第{len(self.received)}次发言"
+        yield ModelClientStreamingChunkEvent(content=content, source=self.name)
+        yield Response(chat_message=TextMessage(content=content, source=self.name))
+
+    async def on_reset(self, cancellation_token: CancellationToken) -> None:
+        self.received = []
+
+
+def _agents(delays: Dict[str, float]) -> List[SlowAgent]:
+    return [SlowAgent(name, delay) for name, delay in delays.items()]
+
+
+def _run(team: ParallelRoundGroupChat, task=None) -> list:
+    async def scenario():
+        return [item async for item in team.run_stream(task=task)]
+    return asyncio.run(scenario())
+
+
+def _task() -> List[TextMessage]:
+    return [TextMessage(content="开始讨论", source="System")]
+
+
+def test_moderator_speaks_first_then_others_share_a_snapshot():
+    agents = _agents({"Manager": 0, "Dev": 0, "Designer": 0})
+    items = _run(ParallelRoundGroupChat(agents, max_turns=5), _task())
+
+    messages = [item.source for item in items if isinstance(item, TextMessage)]
+    assert messages == ["System", "Manager", "Dev", "Designer", "Manager", "Dev"]
+    manager, dev, designer = agents
+    # 同一轮的参与者看不到彼此的回复，下一轮一并收到
+    assert dev.received[0] == ["System", "Manager"]
+    assert designer.received[0] == ["System", "Manager"]
+    assert manager.received[1] == ["Dev", "Designer"]
+    assert dev.received[1] == ["Designer", "Manager"]
+    assert isinstance(items[-1], TaskResult)
+    assert items[-1].stop_reason == "Maximum number of turns 5 reached."
+
+
+def test_replies_are_published_in_participant_order():
+    """分片按到达顺序转发，完整回复仍按参与者顺序发布"""
+    agents = _agents({"Manager": 0, "Slow": 0.05, "Fast": 0})
+    items = _run(ParallelRoundGroupChat(agents, max_turns=3), _task())
+
+    chunks = [item.source for item in items if isinstance(item, ModelClientStreamingChunkEvent)]
+    messages = [item.source for item in items if isinstance(item, TextMessage)]
+    assert chunks == ["Manager", "Fast", "Slow"]
+    assert messages == ["System", "Manager", "Slow", "Fast"]
+
+
+def test_termination_drops_later_replies_of_the_round():
+    agents = _agents({"Manager": 0, "Dev": 0, "Designer": 0})
+    team = ParallelRoundGroupChat(agents, max_turns=10, termination_condition=SourceMatchTermination(["Dev"]))
+    items = _run(team, _task())
+
+    assert [item.source for item in items if isinstance(item, TextMessage)] == ["System", "Manager", "Dev"]
+    assert "Dev" in items[-1].stop_reason
+
+
+def test_requires_at_least_two_participants():
+    with pytest.raises(ValueError):
+        ParallelRoundGroupChat(_agents({"Manager": 0}))
+
+
+def test_save_and_load_state_resumes_unpublished_replies():
+    """在 Dev 的回复发布后保存：Designer 的回复已生成但未发布，恢复后先发布它"""
+    names = ["Manager", "Dev", "Designer"]
+    states = []
+
+    async def first_run():
+        team = None
+
+        async def save(delta):
+            states.append(await save_team_state(team, names))
+
+        termination = CheckpointTrigger(save, names) | SourceMatchTermination(["Dev"])
+        team = ParallelRoundGroupChat(_agents(dict.fromkeys(names, 0)), max_turns=10, termination_condition=termination)
+        return [item async for item in team.run_stream(task=_task())]
+
+    asyncio.run(first_run())
+    state = json.loads(json.dumps(states[-1]))
+    assert state["turns"] == 2
+    assert [message["source"] for message in state["unpublished"]] == ["Designer"]
+
+    agents = _agents(dict.fromkeys(names, 0))
+    resumed = ParallelRoundGroupChat(agents, max_turns=4)
+    asyncio.run(resumed.load_state(state))
+    items = _run(resumed)
+
+    assert [item.source for item in items if isinstance(item, TextMessage)] == ["Designer", "Manager"]
+    # 经理收到恢复前已发布的 Dev 回复和恢复后发布的 Designer 回复
+    assert agents[0].received == [["Dev", "Designer"]]
+
+
+def test_load_state_rejects_unknown_participants():
+    team = ParallelRoundGroupChat(_agents({"Manager": 0, "Dev": 0}))
+    state = asyncio.run(team.save_state())
+    other = ParallelRoundGroupChat(_agents({"Manager": 0, "Designer": 0}))
+    with pytest.raises(ValueError):
+        asyncio.run(other.load_state(state))
@@ -0,0 +1,96 @@
+"""模拟工作进程池：事件转发、进程复用、任务出错、取消，以及进程异常退出只影响当前任务"""
+import asyncio
+import os
+
+import pytest
+
+from utils.process_pool import SimulationProcessPool, WorkerCrashedError
+
+
+async def target(mode: str, emit, cancellation_token, **kwargs):
+    """在工作进程中执行，按 mode 模拟不同的任务结局"""
+    emit("agent_message", {"pid": os.getpid(), "mode": mode}, True)
+    if mode == "crash":
+        os._exit(3)
+    if mode == "error":
+        raise ValueError("场景不存在")
+    if mode == "wait":
+        try:
+            await asyncio.Event().wait()
+        finally:
+            emit("simulation_status", {"is_running": False, "cancelled": cancellation_token.is_cancelled()}, False)
+    return {"mode": mode, **kwargs}
+
+
+def _run(scenario):
+    async def main():
+        pool = SimulationProcessPool(1, target)
+        try:
+            return await scenario(pool)
+        finally:
+            await pool.shutdown()
+    return asyncio.run(main())
+
+
+def test_events_are_forwarded_and_worker_is_reused():
+    events = []
+
+    async def scenario(pool):
+        results = []
+        for job in ("sim-1", "sim-2"):
+            emit = lambda event_type, data, replay: events.append((event_type, data, replay))
+            results.append(await pool.run(job, emit, ("ok",), {"turns": 3}))
+        return results, pool.stats()
+
+    results, stats = _run(scenario)
+    assert results == [{"mode": "ok", "turns": 3}] * 2
+    assert [event[0] for event in events] == ["agent_message", "agent_message"]
+    assert events[0][1]["pid"] == events[1][1]["pid"] != os.getpid()
+    assert (stats["workers"], stats["busy"], stats["completed"]) == (1, 0, 2)
+
+
+def test_error_in_job_keeps_the_worker():
+    async def scenario(pool):
+        with pytest.raises(RuntimeError, match="场景不存在"):
+            await pool.run("sim-1", lambda *event: None, ("error",))
+        return await pool.run("sim-2", lambda *event: None, ("ok",)), pool.stats()
+
+    result, stats = _run(scenario)
+    assert result == {"mode": "ok"}
+    assert (stats["workers"], stats["completed"], stats["crashed"]) == (1, 1, 0)
+
+
+def test_crashed_worker_fails_only_its_job_and_is_replaced():
+    pids = []
+
+    async def scenario(pool):
+        emit = lambda event_type, data, replay: pids.append(data["pid"])
+        with pytest.raises(WorkerCrashedError, match="退出码: 3"):
+            await pool.run("sim-1", emit, ("crash",))
+        return await pool.run("sim-2", emit, ("ok",)), pool.stats()
+
+    result, stats = _run(scenario)
+    assert result == {"mode": "ok"}
+    assert pids[0] != pids[1]
+    assert (stats["workers"], stats["completed"], stats["crashed"]) == (1, 1, 1)
+
+
+def test_cancel_stops_the_job_and_keeps_the_worker():
+    events = []
+
+    async def scenario(pool):
+        emit = lambda event_type, data, replay: events.append((event_type, data))
+        job = asyncio.create_task(pool.run("sim-1", emit, ("wait",)))
+        while not events:
+            await asyncio.sleep(0.01)
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        return await pool.run("sim-2", emit, ("ok",)), pool.stats()
+
+    result, stats = _run(scenario)
+    assert result == {"mode": "ok"}
+    # 工作进程收到取消后仍发出了收尾事件
+    assert events[1] == ("simulation_status", {"is_running": False, "cancelled": True})
+    assert events[0][1]["pid"] == events[2][1]["pid"]
+    assert stats["workers"] == 1
@@ -0,0 +1,112 @@
+"""令牌桶补充和限流器在模拟之间的轮转公平性"""
+import asyncio
+
+import pytest
+
+from agents import rate_limiter as rate_limiter_module
+from agents.rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_refills_at_per_minute_rate_up_to_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(60)
+    assert bucket.delay(30) == pytest.approx(30.0)
+    clock.now += 10
+    assert bucket.delay(30) == pytest.approx(20.0)
+    clock.now += 600
+    bucket.refill()
+    assert bucket.tokens == 60
+
+
+def test_bucket_allows_debt_after_underestimate(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(90)
+    assert bucket.tokens == -30
+    # 欠账要先补平，再攒够本次需要的令牌
+    assert bucket.delay(10) == pytest.approx(40.0)
+
+
+def test_request_larger_than_capacity_waits_for_full_bucket_only(clock):
+    bucket = TokenBucket(60)
+    bucket.consume(30)
+    assert bucket.delay(1000) == pytest.approx(30.0)
+
+
+def test_quota_is_split_across_processes():
+    limiter = RateLimiter(rpm=120, tpm=60000, processes=4)
+    stats = limiter.stats()
+    assert stats["available_requests"] == 30
+    assert stats["available_tokens"] == 15000
+
+
+def test_disabled_limiter_never_waits():
+    async def scenario():
+        return await RateLimiter(rpm=0, tpm=0).acquire(10_000, "sim")
+
+    assert asyncio.run(scenario()) == (0.0, 0)
+
+
+def test_settle_corrects_against_tokens_actually_consumed(clock):
+    """预估超过桶容量时只扣除一桶，修正时按实际扣除的数量计算，不会多退"""
+    async def scenario():
+        limiter = RateLimiter(rpm=0, tpm=600, processes=1)
+        waited, consumed = await limiter.acquire(1000, "sim")
+        limiter.settle(consumed, 900)
+        return limiter, waited, consumed
+
+    limiter, waited, consumed = asyncio.run(scenario())
+    assert (waited, consumed) == (0.0, 600)
+    assert limiter._tokens.tokens == -300
+
+
+def test_simulations_take_turns_when_throttled():
+    async def scenario():
+        limiter = RateLimiter(rpm=60, tpm=0, processes=1)
+        limiter._requests.tokens = 0
+        granted = []
+
+        async def request(owner: str, index: int) -> None:
+            await limiter.acquire(1, owner)
+            granted.append(f"{owner}{index}")
+
+        tasks = [asyncio.create_task(request("a", index)) for index in range(3)]
+        tasks += [asyncio.create_task(request("b", 0)), asyncio.create_task(request("c", 0))]
+        await asyncio.sleep(0)
+        assert limiter.waiting == 5
+        # 一次补足全部配额：a 先到但不能连续拿走，各模拟轮流放行
+        limiter._requests.tokens = 5
+        limiter._schedule()
+        await asyncio.gather(*tasks)
+        return granted
+
+    assert asyncio.run(scenario()) == ["a0", "b0", "c0", "a1", "a2"]
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        limiter = RateLimiter(rpm=60, tpm=0, processes=1)
+        limiter._requests.tokens = 0
+        task = asyncio.create_task(limiter.acquire(1, "a"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.waiting == 0
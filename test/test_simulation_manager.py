@@ -0,0 +1,53 @@
+"""SimulationManager 的排队、停止和状态流转"""
+import asyncio
+
+from utils.simulation_manager import SimulationManager, STATUS_CANCELLED, STATUS_COMPLETED, STATUS_QUEUED
+
+
+def test_stop_after_dispatch_before_run_skips_runner():
+    """任务已出队、尚未开始执行时停止，runner 不应再运行"""
+    async def scenario():
+        manager = SimulationManager(max_concurrent=1)
+        calls = []
+
+        async def runner(simulation):
+            calls.append(simulation.id)
+
+        simulation = manager.create("team_meeting", "场景")
+        assert manager.submit(simulation, runner) == 0
+        # submit 返回时任务已创建但尚未执行
+        assert simulation.status == STATUS_QUEUED and simulation.task is None
+        assert manager.stop(simulation.id)
+        await asyncio.wait_for(simulation.finished.wait(), 1)
+        return simulation, calls
+
+    simulation, calls = asyncio.run(scenario())
+    assert calls == []
+    assert simulation.status == STATUS_CANCELLED
+    assert simulation.started_at is None
+
+
+def test_stop_queued_simulation_removes_it_from_queue():
+    async def scenario():
+        manager = SimulationManager(max_concurrent=1)
+        release = asyncio.Event()
+        calls = []
+
+        async def runner(simulation):
+            calls.append(simulation.id)
+            await release.wait()
+
+        first = manager.create("team_meeting", "场景")
+        second = manager.create("team_meeting", "场景")
+        manager.submit(first, runner)
+        assert manager.submit(second, runner) == 1
+        assert manager.stop(second.id)
+        assert second.status == STATUS_CANCELLED
+        release.set()
+        await asyncio.wait_for(first.finished.wait(), 1)
+        await asyncio.sleep(0)
+        return first, calls
+
+    first, calls = asyncio.run(scenario())
+    assert first.status == STATUS_COMPLETED
+    assert calls == [first.id]
@@ -0,0 +1,72 @@
+"""SSE 流式压缩：按 Accept-Encoding 协商编码，每个事件写出后即可被客户端完整解压"""
+import asyncio
+import zlib
+
+import pytest
+
+from utils import sse_response
+from utils.sse_response import EventSourceResponse, StreamCompressor, negotiate_encoding
+
+
+@pytest.fixture(autouse=True)
+def gzip_and_deflate_only(monkeypatch):
+    """不依赖 brotli 是否安装"""
+    monkeypatch.setattr(sse_response, "SSE_COMPRESSION", "auto")
+    monkeypatch.setattr(sse_response, "SUPPORTED_ENCODINGS", ("gzip", "deflate"))
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("identity", None),
+    ("gzip, deflate", "gzip"),
+    ("deflate, gzip", "gzip"),
+    ("GZIP;q=0.5, deflate", "deflate"),
+    ("gzip;q=0, deflate;q=0.1", "deflate"),
+    ("gzip;q=abc", None),
+    ("br", None)
+])
+def test_negotiate_encoding(header, expected):
+    assert negotiate_encoding(header) == expected
+
+
+def test_negotiation_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(sse_response, "SSE_COMPRESSION", "off")
+    assert negotiate_encoding("gzip") is None
+
+
+@pytest.mark.parametrize("encoding, wbits", [("gzip", 31), ("deflate", 15)])
+def test_each_event_is_decodable_as_soon_as_it_is_written(encoding, wbits):
+    compressor = StreamCompressor(encoding)
+    decompressor = zlib.decompressobj(wbits)
+    events = [f"id: sim-{index}\nevent: agent_message\ndata: {{\"content\": \"第{index}条\"}}\n\n".encode("utf-8") for index in range(3)]
+    for event in events:
+        # 同步刷新后，到目前为止写出的字节足以还原这个事件
+        assert decompressor.decompress(compressor.compress(event)) == event
+    decompressor.decompress(compressor.finish())
+    assert decompressor.eof
+
+
+def test_response_sets_headers_and_compresses_the_stream():
+    async def events():
+        yield "data: 1\n\n"
+        yield b"data: 2\n\n"
+
+    async def scenario():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            await asyncio.Event().wait()
+
+        await EventSourceResponse(events(), encoding="gzip")({"type": "http"}, receive, send)
+        return sent
+
+    sent = asyncio.run(scenario())
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"vary"] == b"Accept-Encoding"
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    assert zlib.decompress(body, 31) == b"data: 1\n\ndata: 2\n\n"
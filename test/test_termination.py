@@ -0,0 +1,163 @@
+"""模拟的终止条件：时间、费用、共识标记、空转，以及恢复时扣除已用预算"""
+import asyncio
+
+import pytest
+from autogen_agentchat.messages import TextMessage
+from autogen_core.models import RequestUsage
+
+from conversations import termination as termination_module
+from conversations.termination import (
+    ConsensusTermination,
+    CostTermination,
+    DeadlineTermination,
+    IdleTermination,
+    SimulationTermination,
+    remaining_termination,
+    resolve_termination
+)
+
+PARTICIPANTS = ["Manager", "Dev"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(termination_module.time, "monotonic", fake)
+    return fake
+
+
+def _message(source: str, content: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> TextMessage:
+    usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens) if prompt_tokens or completion_tokens else None
+    return TextMessage(content=content, source=source, models_usage=usage)
+
+
+def _feed(condition, messages):
+    """逐条交给终止条件，返回每次检查的结果"""
+    async def scenario():
+        return [await condition([message]) for message in messages]
+    return asyncio.run(scenario())
+
+
+def test_deadline_stops_after_deadline_and_restarts_on_reset(clock):
+    condition = DeadlineTermination(60)
+    clock.now += 59
+    assert _feed(condition, [_message("Dev", "进度正常")]) == [None]
+    clock.now += 1
+    assert _feed(condition, [_message("Dev", "进度正常")])[0] is not None
+    assert condition.terminated
+
+    asyncio.run(condition.reset())
+    assert not condition.terminated
+    assert _feed(condition, [_message("Dev", "进度正常")]) == [None]
+
+
+def test_cost_accumulates_usage_until_limit(monkeypatch):
+    monkeypatch.setattr(termination_module, "MODEL_PRICE_PROMPT", 1.0)
+    monkeypatch.setattr(termination_module, "MODEL_PRICE_COMPLETION", 2.0)
+    condition = CostTermination(10.0)
+    results = _feed(condition, [
+        _message("Dev", "第一轮", prompt_tokens=4000, completion_tokens=0),
+        _message("Dev", "第二轮", prompt_tokens=0, completion_tokens=2000),
+        _message("Dev", "第三轮", prompt_tokens=1000, completion_tokens=500)
+    ])
+    assert results[0] is None and results[1] is None
+    assert results[2] is not None
+    assert condition.cost == pytest.approx(10.0)
+
+
+def test_consensus_needs_every_participants_latest_message():
+    condition = ConsensusTermination("【同意】", PARTICIPANTS)
+    results = _feed(condition, [
+        _message("Manager", "方案可以【同意】"),
+        _message("System", "【同意】"),
+        _message("Dev", "我还有疑问"),
+        _message("Dev", "问题解决了【同意】")
+    ])
+    assert results[:3] == [None, None, None]
+    assert results[3] is not None
+
+
+def test_consensus_is_withdrawn_by_a_later_message_without_marker():
+    condition = ConsensusTermination("【同意】", PARTICIPANTS)
+    results = _feed(condition, [
+        _message("Manager", "方案可以【同意】"),
+        _message("Manager", "等等，预算还要再看"),
+        _message("Dev", "没问题【同意】")
+    ])
+    assert results == [None, None, None]
+
+
+def test_idle_counts_short_and_repeated_messages_in_a_row():
+    condition = IdleTermination(3, PARTICIPANTS, min_chars=5)
+    results = _feed(condition, [
+        _message("Manager", "我们来讨论一下排期"),
+        _message("Dev", "好的"),
+        _message("Manager", "我们来讨论一下排期"),
+        _message("Dev", "接口文档今天写完"),
+        _message("Manager", "嗯"),
+        _message("Dev", "嗯嗯"),
+        _message("System", "提醒"),
+        _message("Manager", "收到")
+    ])
+    # 有新内容的消息清零计数，非参与者的消息不计入
+    assert results[:7] == [None] * 7
+    assert results[7] is not None
+    assert condition.streak == 3
+
+
+def test_remaining_termination_deducts_used_budget(monkeypatch):
+    monkeypatch.setattr(termination_module, "MODEL_PRICE_PROMPT", 1.0)
+    monkeypatch.setattr(termination_module, "MODEL_PRICE_COMPLETION", 0.0)
+    config = {"max_turns": 20, "deadline": 100.0, "token_budget": 5000, "cost_limit": 1.0}
+    usage = {"prompt_tokens": 300, "completion_tokens": 200}
+
+    remaining = remaining_termination(config, 40.0, usage)
+    assert remaining["deadline"] == 60.0
+    assert remaining["token_budget"] == 4500
+    assert remaining["cost_limit"] == pytest.approx(0.7)
+    assert remaining["max_turns"] == 20
+    assert config["deadline"] == 100.0
+
+
+def test_remaining_termination_keeps_exhausted_budgets_enabled():
+    config = {"max_turns": 20, "deadline": 10.0, "token_budget": 100, "cost_limit": 0}
+    remaining = remaining_termination(config, 30.0, {"prompt_tokens": 500, "completion_tokens": 0})
+    # 已用完的预算保留极小值，恢复后第一条消息即结束；未启用的条件仍为 0
+    assert 0 < remaining["deadline"] < 0.01
+    assert remaining["token_budget"] == 1
+    assert remaining["cost_limit"] == 0
+
+
+def test_resolve_termination_enables_consensus_and_idle_only_on_request():
+    config = resolve_termination()
+    assert not config.get("consensus_marker")
+    assert config["idle_turns"] == termination_module.DEFAULT_TERMINATION["idle_turns"]
+    assert SimulationTermination(config, PARTICIPANTS).task_suffix() == ""
+
+    config = resolve_termination({"consensus_marker": "【评审通过】", "idle_turns": 3, "deadline": None})
+    assert config["idle_turns"] == 3
+    assert config["deadline"] == termination_module.DEFAULT_TERMINATION["deadline"]
+    assert "【评审通过】" in SimulationTermination(config, PARTICIPANTS).task_suffix()
+
+
+@pytest.mark.parametrize("overrides", [{"unknown": 1}, {"max_turns": 0}, {"deadline": -1}, {"loop_threshold": 2}])
+def test_resolve_termination_rejects_invalid_config(overrides):
+    with pytest.raises(ValueError):
+        resolve_termination(overrides)
+
+
+def test_stop_reason_reports_first_fired_condition():
+    config = resolve_termination({"stop_keywords": "散会", "loop_action": "off"})
+    simulation = SimulationTermination(config, PARTICIPANTS)
+    results = _feed(simulation.condition, [_message("Manager", "今天就到这里，散会")])
+    assert results[0] is not None
+    assert simulation.stop_reason(results[0].content)["type"] == "keyword"
+    assert SimulationTermination(config, PARTICIPANTS).stop_reason()["type"] == "max_turns"
@@ -0,0 +1,159 @@
+"""每轮发言的统计：合并一轮中的多次调用、按智能体汇总，以及从原始响应中取得服务商提示缓存"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from autogen_core.models import UserMessage
+
+from agents import model_clients
+from agents.call_context import CallMetrics, current_simulation
+from agents.model_clients import ModelClientRegistry
+from agents.rate_limiter import RateLimiter
+from agents.turn_metrics import (
+    MetricsChatCompletionClient,
+    TurnMetricsRecorder,
+    capture_provider_usage,
+    count_http_request,
+    summarize_turns
+)
+
+
+def _call(**fields) -> CallMetrics:
+    call = CallMetrics()
+    for name, value in fields.items():
+        setattr(call, name, value)
+    return call
+
+
+def test_pop_merges_calls_of_one_turn():
+    recorder = TurnMetricsRecorder()
+    recorder.record("sim-1", "Dev", _call(queue_wait=0.5, time_to_first_token=0.8, latency=2.0, prompt_tokens=100,
+                                          completion_tokens=20, requests=1, provider_cached_tokens=64))
+    recorder.record("sim-1", "Dev", _call(queue_wait=0.25, time_to_first_token=0.3, latency=1.0, prompt_tokens=150,
+                                          completion_tokens=30, requests=3, cached=True, local_cache_tokens=10))
+    recorder.record("sim-1", "Designer", _call(latency=9.0))
+
+    metrics = recorder.pop("sim-1", "Dev")
+    assert metrics == {
+        "model_calls": 2,
+        "queue_wait": 0.75,
+        "time_to_first_token": 0.3,
+        "latency": 3.0,
+        "prompt_tokens": 250,
+        "completion_tokens": 50,
+        "cached": False,
+        "local_cache_tokens": 10,
+        "provider_cached_tokens": 64,
+        "retries": 2
+    }
+    assert recorder.pop("sim-1", "Dev") is None
+    assert recorder.pop("sim-1", "Designer")["latency"] == 9.0
+
+
+def test_discard_drops_only_that_simulation():
+    recorder = TurnMetricsRecorder()
+    recorder.record("sim-1", "Dev", _call())
+    recorder.record("sim-2", "Dev", _call())
+    recorder.discard("sim-1")
+    assert recorder.pop("sim-1", "Dev") is None
+    assert recorder.pop("sim-2", "Dev") is not None
+
+
+def _metrics(latency: float, first_token, cached: bool = False, provider_cached_tokens: int = 0) -> dict:
+    return {
+        "model_calls": 1, "queue_wait": 0.1, "time_to_first_token": first_token, "latency": latency,
+        "prompt_tokens": 100, "completion_tokens": 10, "cached": cached, "local_cache_tokens": 110 if cached else 0,
+        "provider_cached_tokens": provider_cached_tokens, "retries": 0
+    }
+
+
+def test_summarize_turns_by_agent():
+    messages = [
+        {"sender": "System", "content": "开始"},
+        {"sender": "Dev", "metrics": _metrics(2.0, 0.5, provider_cached_tokens=64)},
+        {"sender": "Designer", "metrics": _metrics(1.0, None, cached=True)},
+        {"sender": "Dev", "metrics": _metrics(4.0, 1.5)}
+    ]
+    summary = summarize_turns(messages)
+    assert set(summary) == {"Dev", "Designer"}
+    dev = summary["Dev"]
+    assert dev["turns"] == 2
+    assert dev["latency"] == 6.0
+    assert dev["average_latency"] == 3.0
+    assert dev["average_time_to_first_token"] == 1.0
+    assert dev["prompt_tokens"] == 200
+    assert dev["provider_cached_tokens"] == 64
+    designer = summary["Designer"]
+    assert designer["cached_turns"] == 1
+    assert designer["local_cache_tokens"] == 110
+    assert designer["average_time_to_first_token"] is None
+
+
+USAGE = {"prompt_tokens": 1200, "completion_tokens": 2, "total_tokens": 1202, "prompt_tokens_details": {"cached_tokens": 1024}}
+
+
+def _stream_body() -> bytes:
+    chunks = [
+        {"choices": [{"index": 0, "delta": {"role": "assistant", "content": "好的"}, "finish_reason": "stop"}], "usage": None},
+        {"choices": [], "usage": USAGE}
+    ]
+    events = [{"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o-2024-08-06", **chunk} for chunk in chunks]
+    return ("".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n").encode("utf-8")
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    if json.loads(request.content).get("stream"):
+        # 分成小块发送，usage 所在的行跨越多个块
+        body = _stream_body()
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=_Chunked(body, 17))
+    return httpx.Response(200, json={
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o-2024-08-06",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "好的"}, "finish_reason": "stop"}],
+        "usage": USAGE
+    })
+
+
+class _Chunked(httpx.AsyncByteStream):
+    def __init__(self, body: bytes, size: int):
+        self.body = body
+        self.size = size
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), self.size):
+            yield self.body[start:start + self.size]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(model_clients, "rate_limiter", RateLimiter(rpm=0, tpm=0))
+    monkeypatch.setattr(model_clients, "active_cassette", None)
+    # 使用注册表配置的事件钩子，只把网络替换成 MockTransport
+    monkeypatch.setattr(
+        ModelClientRegistry, "_http_client",
+        lambda self, base_url: httpx.AsyncClient(
+            transport=httpx.MockTransport(_handler),
+            event_hooks={"request": [count_http_request], "response": [capture_provider_usage]}
+        )
+    )
+    recorder = TurnMetricsRecorder()
+    shared = ModelClientRegistry().get("gpt-4o", "http://model.test/v1", "sk-test", 0.7, 42, True, use_cache=False)
+    return MetricsChatCompletionClient(shared, "Dev", recorder), recorder
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_provider_cached_tokens_are_captured_from_raw_usage(client, streaming):
+    metrics_client, recorder = client
+
+    async def scenario():
+        current_simulation.set("sim-1")
+        messages = [UserMessage(content="你好", source="user")]
+        if streaming:
+            return [item async for item in metrics_client.create_stream(messages)][-1]
+        return await metrics_client.create(messages)
+
+    result = asyncio.run(scenario())
+    assert result.usage.prompt_tokens == 1200
+    metrics = recorder.pop("sim-1", "Dev")
+    assert metrics["provider_cached_tokens"] == 1024
+    assert metrics["retries"] == 0
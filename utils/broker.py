@@ -0,0 +1,269 @@
+"""
+事件代理
+在多个 worker 进程之间转发事件，使任意 worker 都能为任意模拟的订阅者提供事件流。
+- local: 进程内代理，事件只在本进程内广播（默认，单 worker 部署）
+- unix: 基于 Unix 域套接字的中继，同一台机器上的所有 worker 共享事件，不依赖外部服务
+"""
+import os
+import json
+import fcntl
+import asyncio
+import logging
+import tempfile
+from typing import Any, Dict, Optional, Set
+
+from utils.event_hub import EventFrame
+from utils.event_codec import LENGTH_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 代理类型
+BROKER_TYPES = ("local", "unix")
+DEFAULT_BROKER_TYPE = os.getenv("EVENT_BROKER", "local")
+
+# Unix 域套接字路径，选举中继所用的锁文件为同名的 .lock 文件
+DEFAULT_BROKER_PATH = os.getenv("EVENT_BROKER_PATH", os.path.join(tempfile.gettempdir(), "maai-events.sock"))
+
+# 与中继断开后重新连接（或接替中继）的间隔（秒）
+BROKER_RECONNECT_DELAY = 1.0
+
+# 单个连接允许积压的最大写缓冲（字节），超过后断开该连接，由其重连后按 Last-Event-ID 补发
+MAX_PEER_BACKLOG = int(os.getenv("EVENT_BROKER_MAX_BACKLOG", str(8 * 1024 * 1024)))
+
+# 消息类型：可回放事件、不可回放事件、频道开启、频道关闭
+OP_EVENT = b"E"
+OP_FRAME = b"F"
+OP_OPEN = b"O"
+OP_CLOSE = b"C"
+
+
+class InProcessBroker:
+    """
+    进程内代理
+
+    事件中心已在本进程内完成广播，因此所有转发操作均为空操作。
+    其他代理实现相同的接口，事件中心无需关心事件是否需要跨进程传递。
+    """
+
+    kind = "local"
+
+    async def start(self, hub) -> None:
+        """启动代理，收到的远程事件投递给 hub"""
+
+    async def stop(self) -> None:
+        """停止代理"""
+
+    def publish_event(self, frame: EventFrame) -> None:
+        """转发一个可回放的事件帧"""
+
+    def publish_frame(self, frame: EventFrame) -> None:
+        """转发一个不参与回放的事件帧"""
+
+    def open_channel(self, channel_id: str) -> None:
+        """通知其他进程频道已开启"""
+
+    def close_channel(self, channel_id: str) -> None:
+        """通知其他进程频道已关闭"""
+
+    def stats(self) -> Dict[str, Any]:
+        """返回代理状态"""
+        return {"type": self.kind}
+
+
+class UnixSocketBroker(InProcessBroker):
+    """
+    Unix 域套接字代理
+
+    所有 worker 通过锁文件选举出一个中继：持有锁的 worker 监听套接字，其余 worker 连接到它。
+    每条消息为 4 字节大端长度前缀 + 1 字节消息类型 + 消息体，事件消息体直接使用事件帧已缓存的信封，
+    不需要重新编码。中继把收到的消息投递给本进程的事件中心，并转发给除来源以外的所有连接。
+    中继所在进程退出后锁被释放，其他 worker 会在重连时接替中继。
+    """
+
+    kind = "unix"
+
+    def __init__(self, path: str = DEFAULT_BROKER_PATH, reconnect_delay: float = BROKER_RECONNECT_DELAY):
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        # relay: 本进程是中继；peer: 已连接到中继；None: 尚未连接
+        self.role: Optional[str] = None
+        self._hub = None
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # 中继上为所有已连接的 worker，普通 worker 上为到中继的连接
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    async def start(self, hub) -> None:
+        self._hub = hub
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        for writer in list(self._peers):
+            writer.close()
+        self._peers.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.role = None
+
+    def publish_event(self, frame: EventFrame) -> None:
+        self._send(OP_EVENT, frame.envelope)
+
+    def publish_frame(self, frame: EventFrame) -> None:
+        self._send(OP_FRAME, frame.envelope)
+
+    def open_channel(self, channel_id: str) -> None:
+        self._send(OP_OPEN, channel_id.encode("utf-8"))
+
+    def close_channel(self, channel_id: str) -> None:
+        self._send(OP_CLOSE, channel_id.encode("utf-8"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "type": self.kind,
+            "path": self.path,
+            "role": self.role,
+            "peers": len(self._peers),
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped
+        }
+
+    def _send(self, op: bytes, body: bytes, exclude: Optional[asyncio.StreamWriter] = None) -> None:
+        """把消息写入所有连接（不等待写出），没有可用连接时计入丢弃"""
+        if not self._peers:
+            if self.role != "relay":
+                self.dropped += 1
+            return
+        message = LENGTH_PREFIX.pack(len(body) + 1) + op + body
+        for writer in list(self._peers):
+            if writer is exclude:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_PEER_BACKLOG:
+                logger.warning("事件代理连接积压过多，已断开")
+                self._peers.discard(writer)
+                writer.close()
+                continue
+            writer.write(message)
+            self.sent += 1
+
+    async def _run(self) -> None:
+        """选举中继或连接到中继，连接断开后重试"""
+        while True:
+            if self._try_lock():
+                await self._serve()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # 中继尚未就绪或已退出，稍后重试（届时可能由本进程接替）
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self.role = "peer"
+            self._peers.add(writer)
+            logger.info(f"已连接到事件中继: {self.path}")
+            try:
+                await self._read_loop(reader, writer)
+            finally:
+                self._peers.discard(writer)
+                writer.close()
+                self.role = None
+            logger.warning("与事件中继的连接已断开，准备重连")
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _try_lock(self) -> bool:
+        """尝试获取中继锁，进程退出时锁自动释放"""
+        fd = os.open(f"{self.path}.lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _serve(self) -> None:
+        """作为中继监听套接字"""
+        # 持有锁说明旧中继已退出，遗留的套接字文件可以安全删除
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+        self.role = "relay"
+        logger.info(f"事件中继已启动: {self.path}")
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """中继上处理一个 worker 的连接"""
+        self._peers.add(writer)
+        logger.info(f"worker 已连接到事件中继，当前连接数: {len(self._peers)}")
+        try:
+            await self._read_loop(reader, writer)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+            logger.info(f"worker 已断开事件中继，当前连接数: {len(self._peers)}")
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """读取消息，投递给本进程的事件中心；中继上同时转发给其他连接"""
+        while True:
+            try:
+                header = await reader.readexactly(LENGTH_PREFIX.size)
+                (size,) = LENGTH_PREFIX.unpack(header)
+                message = await reader.readexactly(size)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+
+            self.received += 1
+            op, body = message[:1], message[1:]
+            if self.role == "relay":
+                self._send(op, body, exclude=writer)
+            try:
+                self._deliver(op, body)
+            except Exception as e:
+                logger.error(f"处理远程事件时出错: {e}")
+
+    def _deliver(self, op: bytes, body: bytes) -> None:
+        """把远程消息应用到本进程的事件中心"""
+        if op == OP_OPEN:
+            self._hub.apply_remote_open(body.decode("utf-8"))
+        elif op == OP_CLOSE:
+            self._hub.apply_remote_close(body.decode("utf-8"))
+        elif op in (OP_EVENT, OP_FRAME):
+            envelope = json.loads(body)
+            frame = EventFrame(envelope["event"], envelope["data"], envelope["id"], envelope["simulation_id"])
+            self._hub.apply_remote_frame(frame, replayable=op == OP_EVENT)
+        else:
+            logger.warning(f"未知的代理消息类型: {op!r}")
+
+
+def create_broker(kind: Optional[str] = None) -> InProcessBroker:
+    """
+    按配置创建事件代理
+
+    参数:
+        kind: 代理类型 (local / unix)，默认读取 EVENT_BROKER 环境变量
+
+    返回:
+        InProcessBroker: 事件代理
+    """
+    kind = kind or DEFAULT_BROKER_TYPE
+    if kind == "local":
+        return InProcessBroker()
+    if kind == "unix":
+        return UnixSocketBroker()
+    raise ValueError(f"未知的事件代理类型: {kind}. 可用类型: {list(BROKER_TYPES)}")
@@ -0,0 +1,87 @@
+"""
+事件批量编解码
+WebSocket 二进制帧的格式为若干条记录首尾相接，每条记录为 4 字节大端长度前缀 + 事件信封的 UTF-8 JSON；
+SSE 批量帧为一个 batch 事件，data 是事件信封组成的 JSON 数组
+"""
+import os
+import json
+import struct
+from typing import Any, Dict, Iterable, List, Sequence
+
+from utils.event_hub import EventFrame
+
+# 长度前缀格式：4 字节无符号大端整数
+LENGTH_PREFIX = struct.Struct(">I")
+
+# 单个批量帧最多合并的事件数量
+MAX_BATCH_EVENTS = int(os.getenv("EVENT_MAX_BATCH", "64"))
+
+# SSE 批量帧的事件类型
+BATCH_EVENT = "batch"
+
+
+def encode_batch(frames: Iterable[EventFrame]) -> bytes:
+    """
+    将多个事件帧编码为一个二进制批量帧
+
+    参数:
+        frames: 事件帧，使用各自已缓存的信封字节
+
+    返回:
+        bytes: 长度前缀编码的批量帧
+    """
+    parts = []
+    for frame in frames:
+        envelope = frame.envelope
+        parts.append(LENGTH_PREFIX.pack(len(envelope)))
+        parts.append(envelope)
+    return b"".join(parts)
+
+
+def decode_batch(data: bytes) -> List[Dict[str, Any]]:
+    """
+    解码二进制批量帧
+
+    参数:
+        data: 长度前缀编码的批量帧
+
+    返回:
+        list: 事件信封字典列表
+    """
+    envelopes = []
+    offset = 0
+    while offset < len(data):
+        (size,) = LENGTH_PREFIX.unpack_from(data, offset)
+        offset += LENGTH_PREFIX.size
+        envelopes.append(json.loads(data[offset:offset + size]))
+        offset += size
+    return envelopes
+
+
+def encode_sse_batch(frames: Sequence[EventFrame]) -> bytes:
+    """
+    将多个事件帧合并为一个SSE批量帧
+
+    批量帧的 id 取批次中最后一个带ID的事件，断线重连时仍可按 Last-Event-ID 恢复；
+    心跳等注释帧不会进入批次。只有一个事件时直接返回该事件原有的编码。
+
+    参数:
+        frames: 事件帧
+
+    返回:
+        bytes: SSE 帧的 UTF-8 字节
+    """
+    events = [frame for frame in frames if frame.event is not None]
+    if not events:
+        return frames[-1].payload if frames else b""
+    if len(events) == 1:
+        return events[0].payload
+
+    last_id = next((frame.event_id for frame in reversed(events) if frame.event_id is not None), None)
+    id_line = f"id: {last_id}\n".encode("utf-8") if last_id is not None else b""
+    return (
+        id_line
+        + f"event: {BATCH_EVENT}\ndata: [".encode("utf-8")
+        + b",".join(frame.envelope for frame in events)
+        + b"]\n\n"
+    )
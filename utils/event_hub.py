@@ -0,0 +1,582 @@
+"""
+SSE事件广播中心
+每个订阅者持有独立的有界缓冲区，事件按模拟划分频道，发布一次即投递给该频道的所有订阅者
+"""
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者缓冲区的默认容量
+DEFAULT_SUBSCRIBER_BUFFER = int(os.getenv("SSE_SUBSCRIBER_BUFFER", "256"))
+
+# 单个订阅者可申请的最大缓冲区容量
+MAX_SUBSCRIBER_BUFFER = int(os.getenv("SSE_MAX_SUBSCRIBER_BUFFER", "4096"))
+
+# 订阅者缓冲区写满时的处理策略
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce_status", "disconnect")
+DEFAULT_OVERFLOW_POLICY = os.getenv("SSE_OVERFLOW_POLICY", "drop_oldest")
+
+# 可被合并的状态事件，以及因积压被断开时发送的事件类型
+STATUS_EVENT = "simulation_status"
+OVERFLOW_EVENT = "overflow"
+
+# 断线重连回放缓冲区的默认容量
+DEFAULT_REPLAY_BUFFER = int(os.getenv("SSE_REPLAY_BUFFER", "1024"))
+
+# 记住最近释放的频道数，释放后才到达的远程事件据此丢弃
+RELEASED_CHANNEL_MEMORY = 1024
+
+
+class EventFrame:
+    """
+    预编码的SSE事件帧
+
+    事件数据在构造时只序列化一次，所有订阅者共享同一份 UTF-8 字节。
+    带有 event_id 的帧会输出 SSE 的 id 字段，浏览器重连时据此发送 Last-Event-ID。
+    WebSocket 等其他传输使用同一事件的 JSON 信封（envelope），同样只编码一次。
+    """
+
+    __slots__ = ("event", "data", "event_id", "channel_id", "payload", "_data_json", "_envelope")
+
+    def __init__(
+        self,
+        event: str,
+        data: Any,
+        event_id: Optional[str] = None,
+        channel_id: Optional[str] = None
+    ):
+        self.event = event
+        self.data = data
+        self.event_id = event_id
+        self.channel_id = channel_id
+        self._data_json = json.dumps(data, ensure_ascii=False)
+        self._envelope: Optional[bytes] = None
+        id_line = f"id: {event_id}\n" if event_id is not None else ""
+        self.payload = f"{id_line}event: {event}\ndata: {self._data_json}\n\n".encode("utf-8")
+
+    @property
+    def envelope(self) -> bytes:
+        """事件信封 {"event", "id", "simulation_id", "data"} 的 UTF-8 JSON，首次访问时编码并缓存"""
+        if self._envelope is None:
+            self._envelope = (
+                f'{{"event":{json.dumps(self.event)},"id":{json.dumps(self.event_id)},'
+                f'"simulation_id":{json.dumps(self.channel_id)},"data":{self._data_json}}}'
+            ).encode("utf-8")
+        return self._envelope
+
+    @classmethod
+    def comment(cls, text: str = "") -> "EventFrame":
+        """构造一个SSE注释帧（客户端会忽略，常用作心跳）"""
+        frame = cls.__new__(cls)
+        frame.event = None
+        frame.data = None
+        frame.event_id = None
+        frame.channel_id = None
+        frame._data_json = "null"
+        frame._envelope = None
+        frame.payload = f": {text}\n\n".encode("utf-8")
+        return frame
+
+
+class Subscriber:
+    """
+    单个SSE订阅者
+
+    缓冲区为有界双端队列，写满后按溢出策略处理：
+    - drop_oldest: 丢弃最旧的事件
+    - coalesce_status: 合并缓冲区中的 simulation_status 事件，只保留最新一条，
+      仍然不够时退化为丢弃最旧事件
+    - disconnect: 清空缓冲区并断开连接，附带可用于恢复的最后事件ID
+    消费者通过一个一次性的 Future 等待新事件，发布方无需加锁。
+    """
+
+    __slots__ = (
+        "id", "channel_ids", "buffer", "maxsize", "policy", "closed", "active",
+        "last_event_id", "overflows", "_stats", "_waiter"
+    )
+
+    def __init__(
+        self,
+        subscriber_id: int,
+        maxsize: int,
+        policy: str = DEFAULT_OVERFLOW_POLICY,
+        stats: Optional[Dict[str, int]] = None
+    ):
+        self.id = subscriber_id
+        # 已加入的频道，None 表示全局订阅
+        self.channel_ids: Set[Optional[str]] = set()
+        self.buffer = deque()
+        self.maxsize = maxsize
+        self.policy = policy
+        self.closed = False
+        # 最近是否有写入，由心跳调度器读取并清除
+        self.active = False
+        self.last_event_id: Optional[str] = None
+        self.overflows = 0
+        self._stats = stats if stats is not None else {}
+        self._waiter: Optional[asyncio.Future] = None
+
+    def put(self, frame: EventFrame) -> None:
+        """写入一个事件帧并唤醒等待中的消费者（O(1)，仅在溢出时做额外处理）"""
+        if self.closed:
+            return
+
+        if len(self.buffer) >= self.maxsize:
+            self._overflow(frame)
+        if not self.closed:
+            self.buffer.append(frame)
+        self.active = True
+
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def wait(self) -> None:
+        """挂起直到缓冲区中有事件"""
+        while not self.buffer:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+    async def get(self) -> EventFrame:
+        """取出下一个事件帧，缓冲区为空时挂起等待"""
+        await self.wait()
+        return self._pop()
+
+    async def get_batch(self, limit: int) -> List[EventFrame]:
+        """取出至少一个、至多 limit 个已积压的事件帧"""
+        frames = [await self.get()]
+        while self.buffer and len(frames) < limit:
+            frames.append(self._pop())
+        return frames
+
+    def _pop(self) -> EventFrame:
+        frame = self.buffer.popleft()
+        if frame.event_id is not None:
+            self.last_event_id = frame.event_id
+        return frame
+
+    def _overflow(self, frame: EventFrame) -> None:
+        """缓冲区已满时按策略腾出空间"""
+        self.overflows += 1
+
+        if self.policy == "disconnect":
+            self._record("disconnect")
+            self.closed = True
+            self.buffer.clear()
+            self.buffer.append(EventFrame(OVERFLOW_EVENT, {
+                "reason": "slow_consumer",
+                "last_event_id": self.last_event_id
+            }))
+            return
+
+        if self.policy == "coalesce_status" and self._coalesce_status(frame):
+            self._record("coalesce_status")
+            return
+
+        self.buffer.popleft()
+        self._record("drop_oldest")
+
+    def _coalesce_status(self, frame: EventFrame) -> bool:
+        """移除已被更新状态取代的 simulation_status 事件，返回是否腾出了空间"""
+        # 新事件本身是状态事件时，缓冲区中的所有状态事件都已过时
+        keep_latest = frame.event != STATUS_EVENT
+        retained = deque()
+        for buffered in reversed(self.buffer):
+            if buffered.event == STATUS_EVENT:
+                if keep_latest:
+                    keep_latest = False
+                    retained.appendleft(buffered)
+                continue
+            retained.appendleft(buffered)
+
+        if len(retained) == len(self.buffer):
+            return False
+        self.buffer = retained
+        return len(self.buffer) < self.maxsize
+
+    def _record(self, policy: str) -> None:
+        self._stats[policy] = self._stats.get(policy, 0) + 1
+
+
+class Channel:
+    """
+    单个模拟的事件频道
+
+    频道内事件ID形如 "<频道ID>-<序号>"，序号单调递增；
+    最近的事件保存在有界回放缓冲区中，供断线重连时补发。
+    """
+
+    __slots__ = ("id", "subscribers", "open", "_seq", "_replay")
+
+    def __init__(self, channel_id: str, replay_size: int):
+        self.id = channel_id
+        self.subscribers: Dict[int, Subscriber] = {}
+        # 频道对应的模拟是否仍在运行
+        self.open = False
+        self._seq = 0
+        self._replay = deque(maxlen=replay_size)
+
+    def next_frame(self, event_type: str, data: Any) -> EventFrame:
+        """分配下一个事件ID并编码事件帧，同时记入回放缓冲区"""
+        self._seq += 1
+        frame = EventFrame(event_type, data, f"{self.id}-{self._seq}", self.id)
+        self._replay.append((self._seq, frame))
+        return frame
+
+    def record(self, seq: int, frame: EventFrame) -> None:
+        """记入其他进程发布的事件，沿用其原有序号"""
+        self._seq = max(self._seq, seq)
+        self._replay.append((seq, frame))
+
+    def replay_since(self, seq: Optional[int]) -> List[EventFrame]:
+        """返回序号 seq 之后的事件，seq 为空时返回全部缓冲事件"""
+        if not self._replay:
+            return []
+        if seq is None:
+            return [frame for _, frame in self._replay]
+
+        if seq > self._seq:
+            # 序号比频道已发布的还大：频道在进程重启后（例如从检查点恢复的模拟）重新从 1 编号，
+            # 客户端持有的是上一个进程的事件ID，补发全部缓冲事件
+            logger.warning(f"事件 {self.id}-{seq} 不属于当前频道的编号（最新序号 {self._seq}），补发全部缓冲事件")
+            return [frame for _, frame in self._replay]
+
+        first_seq = self._replay[0][0]
+        if seq < first_seq - 1:
+            logger.warning(f"事件 {self.id}-{seq} 已超出回放缓冲区，部分事件无法补发")
+            return [frame for _, frame in self._replay]
+
+        # 从尾部取出缺失的后缀，代价只与缺失的事件数量相关
+        size = len(self._replay)
+        missing = max(min(self._seq - seq, size), 0)
+        return [self._replay[i][1] for i in range(size - missing, size)]
+
+
+class EventHub:
+    """
+    事件广播中心
+
+    发布操作遍历订阅者并逐个写入其缓冲区，每个订阅者的开销为 O(1)。
+    所有操作都在事件循环线程内同步完成，因此不需要任何锁。
+
+    每个模拟对应一个频道，发布只触及该频道的订阅者；
+    未指定频道的订阅者（全局订阅）会收到所有频道的事件。
+    频道只由 open_channel（或远程的频道开启消息）创建，在模拟结束且最后一个订阅者离开后释放；
+    发布到不存在或已释放频道的事件被丢弃，不会重新创建频道。
+
+    配置了事件代理（见 utils/broker.py）时，本进程发布的事件和频道变化会同时转发给其他 worker，
+    其他 worker 发布的事件通过 apply_remote_* 投递给本进程的订阅者并记入回放缓冲区。
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = DEFAULT_SUBSCRIBER_BUFFER,
+        replay_size: int = DEFAULT_REPLAY_BUFFER,
+        overflow_policy: str = DEFAULT_OVERFLOW_POLICY,
+        broker=None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {overflow_policy}. 可用策略: {list(OVERFLOW_POLICIES)}")
+        self.buffer_size = buffer_size
+        self.replay_size = replay_size
+        self.overflow_policy = overflow_policy
+        # 跨进程事件代理，为空时只在本进程内广播
+        self.broker = broker
+        self._channels: Dict[str, Channel] = {}
+        # 所有已注册的订阅者
+        self._subscribers: Dict[int, Subscriber] = {}
+        # 全局订阅者，接收所有频道的事件
+        self._global_subscribers: Dict[int, Subscriber] = {}
+        # 最近开启的频道，全局订阅者重连时据此补发
+        self._latest_channel: Optional[str] = None
+        # 最近释放的频道
+        self._released: Deque[str] = deque(maxlen=RELEASED_CHANNEL_MEMORY)
+        self._next_id = 0
+        # 各溢出策略的触发次数
+        self.overflow_stats: Dict[str, int] = {policy: 0 for policy in OVERFLOW_POLICIES}
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def has_channel(self, channel_id: str) -> bool:
+        """频道是否存在（模拟仍在运行或仍有订阅者）"""
+        return channel_id in self._channels
+
+    def is_open(self, channel_id: Optional[str] = None) -> bool:
+        """指定频道（为空时表示任意频道）对应的模拟是否仍在运行，包括其他 worker 上的模拟"""
+        if channel_id is None:
+            return any(channel.open for channel in self._channels.values())
+        channel = self._channels.get(channel_id)
+        return channel is not None and channel.open
+
+    def open_channel(self, channel_id: str) -> None:
+        """为新启动的模拟开启频道"""
+        self.apply_remote_open(channel_id)
+        if self.broker is not None:
+            self.broker.open_channel(channel_id)
+
+    def close_channel(self, channel_id: str) -> None:
+        """模拟结束时关闭频道，没有订阅者时立即释放"""
+        self.apply_remote_close(channel_id)
+        if self.broker is not None:
+            self.broker.close_channel(channel_id)
+
+    def apply_remote_open(self, channel_id: str) -> None:
+        """在本进程开启频道（不转发给代理）"""
+        if channel_id in self._released:
+            # 从检查点恢复的模拟沿用原来的模拟ID
+            self._released.remove(channel_id)
+        channel = self._get_or_create_channel(channel_id)
+        channel.open = True
+        self._latest_channel = channel_id
+        logger.info(f"事件频道已开启: {channel_id}")
+
+    def apply_remote_close(self, channel_id: str) -> None:
+        """在本进程关闭频道（不转发给代理）"""
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return
+        channel.open = False
+        self._release_if_idle(channel)
+
+    def apply_remote_frame(self, frame: EventFrame, replayable: bool = True) -> int:
+        """
+        投递其他进程发布的事件帧（不转发给代理）
+
+        本进程在频道开启之后才连上代理时收不到开启消息，收到这样的频道的事件时视为频道已开启，
+        之后的关闭消息会释放它；频道已释放后才到达的事件直接丢弃。
+
+        参数:
+            frame: 事件帧，channel_id 和 event_id 沿用发布方的值
+            replayable: 是否记入回放缓冲区
+
+        返回:
+            int: 接收到事件的订阅者数量
+        """
+        channel = self._channels.get(frame.channel_id)
+        if channel is None:
+            if frame.channel_id is None or frame.channel_id in self._released:
+                logger.debug(f"丢弃已释放频道的远程事件: {frame.channel_id} {frame.event}")
+                return 0
+            self.apply_remote_open(frame.channel_id)
+            channel = self._channels[frame.channel_id]
+        if replayable and frame.event_id is not None:
+            _, seq = self._parse_event_id(frame.event_id)
+            if seq is not None:
+                channel.record(seq, frame)
+        return self._fan_out(channel, frame)
+
+    def subscribe(
+        self,
+        channel_id: Optional[str] = None,
+        buffer_size: Optional[int] = None,
+        overflow_policy: Optional[str] = None
+    ) -> Subscriber:
+        """
+        注册一个新的订阅者并加入指定频道
+
+        参数:
+            channel_id: 订阅的频道，为空时订阅所有频道
+            buffer_size: 缓冲区容量，默认使用中心的配置，上限为 MAX_SUBSCRIBER_BUFFER
+            overflow_policy: 溢出策略，默认使用中心的配置
+
+        返回:
+            Subscriber: 新的订阅者
+        """
+        if channel_id is not None and channel_id not in self._channels:
+            raise KeyError(f"未找到事件频道: {channel_id}")
+        subscriber = self.create_subscriber(buffer_size, overflow_policy)
+        self.join(subscriber, channel_id)
+        return subscriber
+
+    def create_subscriber(
+        self,
+        buffer_size: Optional[int] = None,
+        overflow_policy: Optional[str] = None
+    ) -> Subscriber:
+        """注册一个尚未加入任何频道的订阅者，之后可通过 join 加入多个频道"""
+        policy = overflow_policy or self.overflow_policy
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}. 可用策略: {list(OVERFLOW_POLICIES)}")
+        maxsize = min(max(buffer_size or self.buffer_size, 1), MAX_SUBSCRIBER_BUFFER)
+
+        self._next_id += 1
+        subscriber = Subscriber(self._next_id, maxsize, policy, self.overflow_stats)
+        self._subscribers[subscriber.id] = subscriber
+        logger.info(f"订阅者加入: {subscriber.id}，当前订阅者数量: {len(self._subscribers)}")
+        return subscriber
+
+    def join(self, subscriber: Subscriber, channel_id: Optional[str] = None) -> None:
+        """
+        让订阅者加入一个频道
+
+        参数:
+            subscriber: 订阅者
+            channel_id: 频道ID，为空时加入全局订阅
+        """
+        if channel_id is None:
+            self._global_subscribers[subscriber.id] = subscriber
+        else:
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                raise KeyError(f"未找到事件频道: {channel_id}")
+            channel.subscribers[subscriber.id] = subscriber
+        subscriber.channel_ids.add(channel_id)
+        logger.info(f"订阅者 {subscriber.id} 加入频道: {channel_id or '全部'}")
+
+    def leave(self, subscriber: Subscriber, channel_id: Optional[str] = None) -> None:
+        """让订阅者离开一个频道，频道已关闭且没有其他订阅者时释放频道"""
+        subscriber.channel_ids.discard(channel_id)
+        if channel_id is None:
+            self._global_subscribers.pop(subscriber.id, None)
+            return
+        channel = self._channels.get(channel_id)
+        if channel is not None:
+            channel.subscribers.pop(subscriber.id, None)
+            self._release_if_idle(channel)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """移除订阅者并离开其加入的所有频道"""
+        for channel_id in list(subscriber.channel_ids):
+            self.leave(subscriber, channel_id)
+
+        if self._subscribers.pop(subscriber.id, None) is not None:
+            if subscriber.overflows:
+                logger.warning(
+                    f"订阅者 {subscriber.id} 缓冲区溢出 {subscriber.overflows} 次（策略: {subscriber.policy}）"
+                )
+            logger.info(f"订阅者离开: {subscriber.id}，当前订阅者数量: {len(self._subscribers)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回订阅者数量、缓冲区积压和各溢出策略的触发次数"""
+        subscribers = list(self._subscribers.values())
+        return {
+            "subscribers": len(subscribers),
+            "channels": {
+                channel.id: {"open": channel.open, "subscribers": len(channel.subscribers)}
+                for channel in self._channels.values()
+            },
+            "global_subscribers": len(self._global_subscribers),
+            "buffer_size": self.buffer_size,
+            "overflow_policy": self.overflow_policy,
+            "max_backlog": max((len(subscriber.buffer) for subscriber in subscribers), default=0),
+            "lagging_subscribers": sum(1 for subscriber in subscribers if subscriber.overflows),
+            "overflows": dict(self.overflow_stats)
+        }
+
+    def publish_event(self, channel_id: str, event_type: str, data: Any) -> Optional[EventFrame]:
+        """
+        在指定频道分配事件ID、编码并发布一个可回放的事件
+
+        参数:
+            channel_id: 频道ID（模拟ID）
+            event_type: 事件类型
+            data: 事件数据
+
+        返回:
+            EventFrame: 已发布的事件帧，频道不存在或已释放时返回 None
+        """
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            logger.warning(f"事件频道不存在或已释放，丢弃事件: {channel_id} {event_type}")
+            return None
+        frame = channel.next_frame(event_type, data)
+        self._fan_out(channel, frame)
+        if self.broker is not None:
+            self.broker.publish_event(frame)
+        return frame
+
+    def publish(self, channel_id: str, frame: EventFrame) -> int:
+        """
+        向指定频道发布一个不参与回放的事件帧
+
+        参数:
+            channel_id: 频道ID（模拟ID）
+            frame: 已编码的事件帧
+
+        返回:
+            int: 接收到事件的订阅者数量
+        """
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return 0
+        if frame.channel_id is None:
+            frame.channel_id = channel_id
+        if self.broker is not None:
+            self.broker.publish_frame(frame)
+        return self._fan_out(channel, frame)
+
+    def replay_since(self, last_event_id: Optional[str], channel_id: Optional[str] = None) -> List[EventFrame]:
+        """
+        返回 last_event_id 之后错过的事件
+
+        参数:
+            last_event_id: 客户端最后收到的事件ID
+            channel_id: 订阅的频道，为空表示全局订阅
+
+        返回:
+            list: 需要补发的事件帧，按发布顺序排列
+        """
+        if not last_event_id:
+            return []
+
+        event_channel_id, seq = self._parse_event_id(last_event_id)
+        if channel_id is not None:
+            channel = self._channels.get(channel_id)
+            if channel is None:
+                return []
+            # 事件ID不属于该频道时，补发频道的全部缓冲事件
+            return channel.replay_since(seq if event_channel_id == channel_id else None)
+
+        # 全局订阅：补发断线前所在频道的后缀；若期间开始了新的模拟，再补发新频道的全部事件
+        frames: List[EventFrame] = []
+        channel = self._channels.get(event_channel_id)
+        if channel is not None:
+            frames.extend(channel.replay_since(seq))
+        latest = self._channels.get(self._latest_channel) if self._latest_channel else None
+        if latest is not None and latest is not channel:
+            frames.extend(latest.replay_since(None))
+        return frames
+
+    @staticmethod
+    def _parse_event_id(event_id: str) -> Tuple[str, Optional[int]]:
+        """解析 "<频道ID>-<序号>" 格式的事件ID"""
+        channel_id, _, seq = event_id.strip().rpartition("-")
+        try:
+            return channel_id, int(seq)
+        except ValueError:
+            return channel_id, None
+
+    def _get_or_create_channel(self, channel_id: str) -> Channel:
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = Channel(channel_id, self.replay_size)
+        return channel
+
+    def _fan_out(self, channel: Channel, frame: EventFrame) -> int:
+        """将事件帧写入频道订阅者和全局订阅者的缓冲区，同时加入两者的订阅者只写入一次"""
+        for subscriber in channel.subscribers.values():
+            subscriber.put(frame)
+        delivered = len(channel.subscribers)
+        for subscriber_id, subscriber in self._global_subscribers.items():
+            if subscriber_id not in channel.subscribers:
+                subscriber.put(frame)
+                delivered += 1
+        return delivered
+
+    def _release_if_idle(self, channel: Channel) -> None:
+        """模拟已结束且没有订阅者时释放频道及其回放缓冲区"""
+        if not channel.open and not channel.subscribers:
+            self._channels.pop(channel.id, None)
+            self._released.append(channel.id)
+            if self._latest_channel == channel.id:
+                self._latest_channel = None
+            logger.info(f"事件频道已释放: {channel.id}")
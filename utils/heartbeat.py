@@ -0,0 +1,79 @@
+"""
+共享心跳调度器
+所有SSE连接共用一个时间轮定时任务发送保活注释，而不是每个连接各自计时
+"""
+import os
+import math
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from utils.event_hub import EventFrame, Subscriber
+
+logger = logging.getLogger(__name__)
+
+# 连接空闲多久后发送一次心跳（秒）
+DEFAULT_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# 时间轮每一格的时长（秒）
+DEFAULT_HEARTBEAT_TICK = 1.0
+
+# 所有连接共享的心跳帧
+HEARTBEAT_FRAME = EventFrame.comment("ping")
+
+
+class HeartbeatWheel:
+    """
+    心跳时间轮
+
+    订阅者按加入时间被放入时间轮的某一格，指针每转过一格只检查该格中的订阅者：
+    一整圈内有过写入的订阅者只清除活跃标记，空闲的订阅者才会收到心跳帧。
+    写入路径上只需设置一个标记，不需要读取时钟或重置定时器。
+    没有订阅者时定时任务自动退出，不产生任何唤醒。
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        tick: float = DEFAULT_HEARTBEAT_TICK
+    ):
+        self.tick = min(tick, interval)
+        self.slots = max(math.ceil(interval / self.tick), 1)
+        self._wheel: List[Dict[int, Subscriber]] = [{} for _ in range(self.slots)]
+        self._slot_of: Dict[int, int] = {}
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def add(self, subscriber: Subscriber) -> None:
+        """将订阅者放入时间轮，一整圈后首次检查"""
+        slot = self._cursor
+        self._wheel[slot][subscriber.id] = subscriber
+        self._slot_of[subscriber.id] = slot
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def remove(self, subscriber: Subscriber) -> None:
+        """将订阅者移出时间轮"""
+        slot = self._slot_of.pop(subscriber.id, None)
+        if slot is not None:
+            self._wheel[slot].pop(subscriber.id, None)
+
+    async def _run(self) -> None:
+        """时间轮主循环"""
+        logger.info(f"心跳调度器启动: 每格 {self.tick} 秒，共 {self.slots} 格")
+        while self._slot_of:
+            await asyncio.sleep(self.tick)
+            self._cursor = (self._cursor + 1) % self.slots
+            for subscriber in list(self._wheel[self._cursor].values()):
+                if subscriber.closed:
+                    continue
+                if not subscriber.active and not subscriber.buffer:
+                    subscriber.put(HEARTBEAT_FRAME)
+                    self.sent += 1
+                subscriber.active = False
+        logger.info("心跳调度器空闲，已停止")
@@ -0,0 +1,203 @@
+"""
+模拟任务队列
+按优先级排队等待执行的任务，同时运行的任务数量不超过工作槽位数，队列写满时拒绝新任务
+"""
+import os
+import math
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别，数值越小越先执行：界面上发起的交互式模拟排在批量任务之前
+PRIORITY_CLASSES = {
+    "interactive": 0,
+    "batch": 10
+}
+DEFAULT_PRIORITY_CLASS = "interactive"
+
+# 排队中的任务数量上限
+MAX_QUEUED_JOBS = int(os.getenv("SIMULATION_QUEUE_SIZE", "16"))
+
+# 平滑任务平均耗时的系数，用于估算排队等待时间
+DURATION_SMOOTHING = 0.3
+
+# 位置变化回调：(任务ID, 排队位置, 预计等待秒数)，位置为 0 表示任务已开始执行
+PositionCallback = Callable[[str, int, Optional[float]], None]
+
+
+class QueueFullError(Exception):
+    """排队中的任务数量已达上限"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    """排队中的单个任务"""
+
+    __slots__ = ("id", "priority_class", "run", "enqueued_at", "started_at", "cancelled")
+
+    def __init__(self, job_id: str, priority_class: str, run: Callable[[], Awaitable[Any]]):
+        self.id = job_id
+        self.priority_class = priority_class
+        self.run = run
+        self.enqueued_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.cancelled = False
+
+
+class JobQueue:
+    """
+    优先级任务队列
+
+    任务保存在按 (优先级, 提交序号) 排序的堆中，同一优先级内先到先执行。
+    每当有槽位空出时立即从堆顶取出下一个任务运行，不需要常驻的工作协程；
+    取消的任务只做标记，出堆时跳过。
+    队列变化后通过 on_position 回调通知每个排队任务的新位置和预计等待时间。
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queued: int = MAX_QUEUED_JOBS,
+        on_position: Optional[PositionCallback] = None
+    ):
+        self.workers = max(workers, 1)
+        self.max_queued = max(max_queued, 0)
+        self.on_position = on_position
+        self._heap: List[Tuple[int, int, Job]] = []
+        self._jobs: Dict[str, Job] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._counter = itertools.count()
+        # 任务平均耗时（秒），尚无完成的任务时为空
+        self.average_duration: Optional[float] = None
+        self.completed = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def submit(self, job_id: str, run: Callable[[], Awaitable[Any]], priority_class: str = DEFAULT_PRIORITY_CLASS) -> int:
+        """
+        提交一个任务
+
+        参数:
+            job_id: 任务ID
+            run: 返回协程的函数，任务开始执行时调用
+            priority_class: 优先级类别，见 PRIORITY_CLASSES
+
+        返回:
+            int: 排队位置，0 表示已立即开始执行
+
+        异常:
+            QueueFullError: 没有空闲槽位且排队任务数量已达上限
+        """
+        if priority_class not in PRIORITY_CLASSES:
+            raise ValueError(f"未知的优先级类别: {priority_class}. 可用类别: {list(PRIORITY_CLASSES)}")
+        if len(self._running) >= self.workers and len(self._jobs) >= self.max_queued:
+            self.rejected += 1
+            raise QueueFullError(f"模拟队列已满 ({self.max_queued})", retry_after=self.eta(1))
+
+        job = Job(job_id, priority_class, run)
+        self._jobs[job_id] = job
+        heapq.heappush(self._heap, (PRIORITY_CLASSES[priority_class], next(self._counter), job))
+        logger.info(f"任务已加入队列: {job_id}（{priority_class}），排队中: {len(self._jobs)}")
+        self._dispatch()
+        return self.position(job_id) or 0
+
+    def cancel(self, job_id: str) -> bool:
+        """取消一个仍在排队的任务，返回是否取消成功"""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        logger.info(f"排队中的任务已取消: {job_id}")
+        self._notify_positions()
+        return True
+
+    def position(self, job_id: str) -> Optional[int]:
+        """返回任务的排队位置（从 1 开始），任务不在队列中时返回 None"""
+        for position, job in enumerate(self._ordered_jobs(), start=1):
+            if job.id == job_id:
+                return position
+        return None
+
+    def eta(self, position: int) -> Optional[float]:
+        """
+        估算排在 position 位的任务还需等待多久开始执行
+
+        参数:
+            position: 排队位置（从 1 开始）
+
+        返回:
+            float: 预计等待秒数，尚无耗时数据时返回 None
+        """
+        if self.average_duration is None:
+            return None
+        return round(math.ceil(position / self.workers) * self.average_duration, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回槽位、排队数量和各优先级的排队任务数"""
+        by_class = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        for job in self._jobs.values():
+            by_class[job.priority_class] += 1
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued": len(self._jobs),
+            "max_queued": self.max_queued,
+            "queued_by_class": by_class,
+            "average_duration": round(self.average_duration, 2) if self.average_duration is not None else None,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+    def _ordered_jobs(self) -> List[Job]:
+        return [job for _, _, job in sorted(self._heap) if not job.cancelled]
+
+    def _dispatch(self) -> None:
+        """槽位空闲时从堆顶取出任务执行"""
+        started = False
+        while self._heap and len(self._running) < self.workers:
+            _, _, job = heapq.heappop(self._heap)
+            if job.cancelled:
+                continue
+            self._jobs.pop(job.id, None)
+            job.started_at = datetime.now()
+            task = asyncio.get_running_loop().create_task(job.run())
+            self._running[job.id] = task
+            task.add_done_callback(lambda _, job=job: self._on_done(job))
+            waited = (job.started_at - job.enqueued_at).total_seconds()
+            logger.info(f"任务开始执行: {job.id}，排队 {waited:.1f} 秒")
+            if self.on_position is not None:
+                self.on_position(job.id, 0, 0.0)
+            started = True
+        if started or self._jobs:
+            self._notify_positions()
+
+    def _on_done(self, job: Job) -> None:
+        """任务结束后更新平均耗时并调度下一个任务"""
+        self._running.pop(job.id, None)
+        self.completed += 1
+        duration = (datetime.now() - job.started_at).total_seconds()
+        if self.average_duration is None:
+            self.average_duration = duration
+        else:
+            self.average_duration += DURATION_SMOOTHING * (duration - self.average_duration)
+        self._dispatch()
+
+    def _notify_positions(self) -> None:
+        if self.on_position is None:
+            return
+        for position, job in enumerate(self._ordered_jobs(), start=1):
+            self.on_position(job.id, position, self.eta(position))
@@ -8,32 +8,47 @@ import time
 import sys
 import random
 
-def save_conversation(messages, filename):
+def save_conversation(messages, filename, directory="conversations_log"):
     """
     保存对话到JSON文件
     
     参数:
         messages (list): 消息列表
         filename (str): 输出文件名
+        directory (str): 输出目录
+    
+    返回:
+        str: 输出文件路径
     """
     # 确保输出目录存在
-    os.makedirs("conversations_log", exist_ok=True)
+    os.makedirs(directory, exist_ok=True)
     
-    # 格式化消息以便于阅读
+    # 格式化消息以便于阅读，保留消息原有的ID、发送者和时间戳
     formatted_messages = []
     for msg in messages:
-        formatted_messages.append({
-            "sender": msg.get("name", "Unknown"),
+        sender = msg.get("sender", msg.get("name", "Unknown"))
+        formatted = {
+            "id": msg.get("id"),
+            "sender": sender,
+            "sender_display_name": msg.get("sender_display_name", sender),
             "content": msg.get("content", ""),
-            "timestamp": datetime.now().isoformat()
-        })
+            "timestamp": msg.get("timestamp", datetime.now().isoformat())
+        }
+        # 模型生成的消息附带本轮的耗时和用量统计
+        if msg.get("metrics"):
+            formatted["metrics"] = msg["metrics"]
+        # 系统的结束消息附带结束原因
+        if msg.get("stop_reason"):
+            formatted["stop_reason"] = msg["stop_reason"]
+        formatted_messages.append(formatted)
     
     # 保存到文件
-    output_file = os.path.join("conversations_log", filename)
+    output_file = os.path.join(directory, filename)
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(formatted_messages, f, ensure_ascii=False, indent=2)
     
     print(f"对话已保存到: {output_file}")
+    return output_file
 
 def load_conversation(filename):
     """
@@ -0,0 +1,266 @@
+"""
+模拟工作进程池
+在独立的工作进程中运行模拟，API 进程的事件循环只负责转发事件，不受模拟中的同步或 CPU 密集操作影响
+"""
+import os
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from autogen_core import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# 模拟执行方式：inline 在 API 进程内运行，process 在工作进程池中运行
+EXECUTOR_TYPES = ("inline", "process")
+DEFAULT_EXECUTOR = os.getenv("SIMULATION_EXECUTOR", "inline")
+
+# 停止模拟后等待工作进程收尾的时间（秒），超时后强制结束进程
+WORKER_CANCEL_GRACE = float(os.getenv("SIMULATION_WORKER_CANCEL_GRACE", "10"))
+
+# 工作进程执行的目标：async def target(*args, emit, cancellation_token, **kwargs)，返回值需可被 pickle
+Target = Callable[..., Any]
+
+# 事件回调：(事件类型, 事件数据, 是否进入回放缓冲区)
+Emit = Callable[[str, Dict[str, Any], bool], None]
+
+
+class WorkerCrashedError(Exception):
+    """工作进程在任务完成前异常退出"""
+
+
+def _worker_main(conn: Connection, target: Target) -> None:
+    """工作进程入口：依次执行 API 进程发来的任务"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - worker[{os.getpid()}] - %(name)s - %(levelname)s - %(message)s'
+    )
+    # 同一工作进程的任务共用一个事件循环，任务之间可以复用模型连接池
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            # API 进程已关闭管道
+            loop.close()
+            return
+        if message[0] == "run":
+            loop.run_until_complete(_run_job(conn, target, *message[1:]))
+
+
+async def _run_job(
+    conn: Connection,
+    target: Target,
+    job_id: str,
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any]
+) -> None:
+    """在工作进程中执行一个任务，事件和结束标记通过管道发回 API 进程"""
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    cancellation_token = CancellationToken()
+
+    def emit(event_type: str, data: Dict[str, Any], replay: bool = True) -> None:
+        conn.send(("event", event_type, data, replay))
+
+    def on_control() -> None:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            message = ("cancel",)
+        if message[0] == "cancel":
+            logger.info(f"收到取消请求: {job_id}")
+            loop.remove_reader(conn.fileno())
+            cancellation_token.cancel()
+            task.cancel()
+
+    loop.add_reader(conn.fileno(), on_control)
+    error = None
+    result = None
+    try:
+        result = await target(*args, emit=emit, cancellation_token=cancellation_token, **kwargs)
+    except asyncio.CancelledError:
+        logger.info(f"任务已取消: {job_id}")
+    except Exception as e:
+        logger.exception(f"任务执行出错: {job_id}")
+        error = str(e)
+    finally:
+        loop.remove_reader(conn.fileno())
+    conn.send(("done", error, result))
+
+
+class _Worker:
+    """一个工作进程及其双向管道"""
+
+    def __init__(self, context, target: Target):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, target), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job_id: Optional[str] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive() and not self.conn.closed
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class SimulationProcessPool:
+    """
+    工作进程池
+
+    工作进程按需启动并常驻复用，每个进程同一时间只执行一个任务，避免重复导入 AutoGen 等依赖。
+    任务事件通过 multiprocessing 管道发回，API 进程用 add_reader 监听管道，不占用线程；
+    工作进程异常退出只影响它正在执行的任务，该任务以 WorkerCrashedError 结束，进程池会在下次需要时补充新进程。
+    """
+
+    def __init__(self, size: int, target: Target):
+        self.size = max(size, 1)
+        self.target = target
+        # spawn 方式启动的子进程不会继承 API 进程的事件循环和套接字
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[_Worker] = []
+        self._idle: List[_Worker] = []
+        self._waiters: List[asyncio.Future] = []
+        self.completed = 0
+        self.crashed = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回进程数量、忙碌进程数和异常退出次数"""
+        return {
+            "type": "process",
+            "size": self.size,
+            "workers": len(self._workers),
+            "busy": len(self._workers) - len(self._idle),
+            "completed": self.completed,
+            "crashed": self.crashed
+        }
+
+    async def run(
+        self,
+        job_id: str,
+        emit: Emit,
+        args: Tuple[Any, ...] = (),
+        kwargs: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """
+        在工作进程中执行一个任务，直到任务结束
+
+        参数:
+            job_id: 任务ID（模拟ID）
+            emit: 事件回调，工作进程发出的事件在 API 进程的事件循环中依次调用
+            args: 传给目标函数的位置参数，需可被 pickle
+            kwargs: 传给目标函数的关键字参数，需可被 pickle
+
+        返回:
+            目标函数的返回值，任务被取消时为空
+
+        异常:
+            WorkerCrashedError: 工作进程在任务完成前退出
+            RuntimeError: 任务在工作进程中抛出异常
+        """
+        worker = await self._acquire()
+        worker.job_id = job_id
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        fd = worker.conn.fileno()
+
+        def on_readable() -> None:
+            try:
+                while worker.conn.poll():
+                    message = worker.conn.recv()
+                    if message[0] == "event":
+                        emit(message[1], message[2], message[3])
+                    elif message[0] == "done" and not done.done():
+                        done.set_result((message[1], message[2]))
+            except (EOFError, OSError):
+                loop.remove_reader(fd)
+                if not done.done():
+                    worker.process.join(timeout=1)
+                    done.set_exception(WorkerCrashedError(
+                        f"工作进程 {worker.process.pid} 异常退出（退出码: {worker.process.exitcode}）"
+                    ))
+            except Exception as e:
+                logger.error(f"处理工作进程事件时出错: {e}")
+
+        loop.add_reader(fd, on_readable)
+        try:
+            worker.conn.send(("run", job_id, args, kwargs or {}))
+            try:
+                error, result = await asyncio.shield(done)
+            except asyncio.CancelledError:
+                # 通知工作进程取消任务，等待它发出收尾事件；超时则强制结束进程
+                logger.info(f"通知工作进程取消任务: {job_id}")
+                worker.conn.send(("cancel",))
+                try:
+                    await asyncio.wait_for(asyncio.shield(done), WORKER_CANCEL_GRACE)
+                except (asyncio.TimeoutError, WorkerCrashedError):
+                    logger.warning(f"工作进程未能及时结束任务，强制结束: {worker.process.pid}")
+                    worker.kill()
+                raise
+            if error is not None:
+                raise RuntimeError(error)
+            self.completed += 1
+            return result
+        except WorkerCrashedError:
+            self.crashed += 1
+            raise
+        finally:
+            if not worker.conn.closed:
+                loop.remove_reader(fd)
+            worker.job_id = None
+            self._release(worker)
+
+    async def shutdown(self) -> None:
+        """关闭所有工作进程"""
+        for worker in self._workers:
+            worker.kill()
+        self._workers.clear()
+        self._idle.clear()
+
+    async def _acquire(self) -> _Worker:
+        """取得一个空闲的工作进程，必要时启动新进程或等待"""
+        while True:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive:
+                    return worker
+                self._discard(worker)
+            if len(self._workers) < self.size:
+                worker = _Worker(self._context, self.target)
+                self._workers.append(worker)
+                logger.info(f"启动模拟工作进程: {worker.process.pid}（{len(self._workers)}/{self.size}）")
+                return worker
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _release(self, worker: _Worker) -> None:
+        """归还工作进程，已退出的进程从池中移除"""
+        if worker.alive:
+            self._idle.append(worker)
+        else:
+            self._discard(worker)
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _discard(self, worker: _Worker) -> None:
+        if worker in self._workers:
+            self._workers.remove(worker)
+        worker.kill()
+        logger.warning(f"模拟工作进程已移除: {worker.process.pid}")
@@ -0,0 +1,272 @@
+"""
+模拟注册表
+为每个模拟分配ID，并记录其运行任务、消息记录和取消令牌，同一进程可以同时运行多个模拟；
+新模拟先进入优先级队列，由有限的执行槽位依次运行
+"""
+import os
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from autogen_core import CancellationToken
+
+from utils.job_queue import JobQueue, PositionCallback, DEFAULT_PRIORITY_CLASS, MAX_QUEUED_JOBS
+
+logger = logging.getLogger(__name__)
+
+# 同时运行的模拟数量上限（执行槽位数）
+MAX_CONCURRENT_SIMULATIONS = int(os.getenv("MAX_CONCURRENT_SIMULATIONS", "4"))
+
+# 保留的已结束模拟数量，超出后最早结束的模拟被移出注册表
+MAX_FINISHED_SIMULATIONS = int(os.getenv("MAX_FINISHED_SIMULATIONS", "100"))
+
+# 模拟状态
+STATUS_PENDING = "pending"
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_STOPPING = "stopping"
+STATUS_COMPLETED = "completed"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_CANCELLED, STATUS_FAILED)
+
+
+class Simulation:
+    """
+    单个模拟的运行状态
+
+    messages 是该模拟自己的消息记录，替代原先所有模拟共用的全局消息历史。
+    """
+
+    def __init__(
+        self,
+        simulation_id: str,
+        scenario_id: str,
+        scenario_text: str,
+        priority_class: str = DEFAULT_PRIORITY_CLASS,
+        options: Optional[Dict[str, Any]] = None,
+        headless: bool = False
+    ):
+        self.id = simulation_id
+        self.scenario_id = scenario_id
+        self.scenario_text = scenario_text
+        self.priority_class = priority_class
+        self.status = STATUS_PENDING
+        # 排队位置，开始执行后为 0
+        self.queue_position: Optional[int] = None
+        # 传给对话运行器的额外参数（人设覆盖、采样温度、随机种子等）
+        self.options: Dict[str, Any] = options or {}
+        # 无界面模拟（如批量任务）不发布任何事件
+        self.headless = headless
+        self.messages: List[Dict[str, Any]] = []
+        self.usage: Dict[str, int] = {"prompt_tokens": 0, "completion_tokens": 0}
+        # 模拟结束（完成、取消或失败）时被设置
+        self.finished = asyncio.Event()
+        self.cancellation_token = CancellationToken()
+        self.task: Optional[asyncio.Task] = None
+        self.error: Optional[str] = None
+        # 结束原因，见 conversations.termination
+        self.stop_reason: Optional[Dict[str, Any]] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.status in (STATUS_RUNNING, STATUS_STOPPING)
+
+    @property
+    def is_active(self) -> bool:
+        """模拟尚未结束（排队中或运行中）"""
+        return self.status not in FINISHED_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        """返回可序列化的模拟状态"""
+        return {
+            "simulation_id": self.id,
+            "scenario_id": self.scenario_id,
+            "status": self.status,
+            "is_running": self.is_running,
+            "priority_class": self.priority_class,
+            "headless": self.headless,
+            "queue_position": self.queue_position,
+            "message_count": len(self.messages),
+            "usage": self.usage,
+            "error": self.error,
+            "stop_reason": self.stop_reason,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class SimulationManager:
+    """
+    模拟管理器
+
+    提交的模拟进入 JobQueue 排队，轮到时在独立的 asyncio 任务中运行，任务结束后根据结果更新状态；
+    运行中的模拟数量不超过 max_concurrent，排队中的模拟不超过 max_queued，
+    已结束的模拟只保留最近的 max_finished 个。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_SIMULATIONS,
+        max_finished: int = MAX_FINISHED_SIMULATIONS,
+        max_queued: int = MAX_QUEUED_JOBS,
+        on_queue_update: Optional[PositionCallback] = None
+    ):
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_finished = max_finished
+        self.on_queue_update = on_queue_update
+        self.queue = JobQueue(self.max_concurrent, max_queued, on_position=self._on_position)
+        self._simulations: "OrderedDict[str, Simulation]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._simulations)
+
+    def get(self, simulation_id: str) -> Optional[Simulation]:
+        """按ID获取模拟"""
+        return self._simulations.get(simulation_id)
+
+    def list(self) -> List[Simulation]:
+        """按创建顺序返回所有已登记的模拟"""
+        return list(self._simulations.values())
+
+    def running(self) -> List[Simulation]:
+        """返回仍在运行的模拟"""
+        return [simulation for simulation in self._simulations.values() if simulation.is_running]
+
+    def latest_active(self) -> Optional[Simulation]:
+        """返回最近提交且尚未结束的模拟"""
+        for simulation in reversed(self._simulations.values()):
+            if simulation.is_active:
+                return simulation
+        return None
+
+    def create(
+        self,
+        scenario_id: str,
+        scenario_text: str,
+        priority_class: str = DEFAULT_PRIORITY_CLASS,
+        options: Optional[Dict[str, Any]] = None,
+        headless: bool = False,
+        simulation_id: Optional[str] = None
+    ) -> Simulation:
+        """
+        登记一个新的模拟
+
+        参数:
+            scenario_id: 场景ID
+            scenario_text: 场景文本
+            priority_class: 排队优先级类别
+            options: 传给对话运行器的额外参数
+            headless: 是否为无界面模拟
+            simulation_id: 模拟ID，从检查点恢复时沿用原来的ID，默认随机生成
+
+        返回:
+            Simulation: 新的模拟
+        """
+        simulation = Simulation(simulation_id or uuid.uuid4().hex[:12], scenario_id, scenario_text, priority_class, options, headless)
+        self._simulations[simulation.id] = simulation
+        return simulation
+
+    def submit(self, simulation: Simulation, runner: Callable[[Simulation], Awaitable[None]]) -> int:
+        """
+        把模拟提交到执行队列，轮到时在独立任务中运行
+
+        参数:
+            simulation: 已登记的模拟
+            runner: 运行模拟的协程函数
+
+        返回:
+            int: 排队位置，0 表示已立即开始运行
+
+        异常:
+            QueueFullError: 队列已满，模拟会从注册表中移除
+        """
+        async def run() -> None:
+            simulation.task = asyncio.current_task()
+            simulation.task.add_done_callback(lambda task: self._on_done(simulation, task))
+            if simulation.status == STATUS_STOPPING or simulation.cancellation_token.is_cancelled():
+                # 已出队但任务尚未开始执行时被停止，queue.cancel 取消不到它，在这里跳过，不调用 runner
+                logger.info(f"模拟在开始运行前已被停止: {simulation.id}")
+                return
+            simulation.status = STATUS_RUNNING
+            simulation.started_at = datetime.now()
+            logger.info(f"模拟已启动: {simulation.id}（运行中: {self.queue.running}/{self.max_concurrent}）")
+            await runner(simulation)
+
+        simulation.status = STATUS_QUEUED
+        try:
+            return self.queue.submit(simulation.id, run, simulation.priority_class)
+        except Exception:
+            del self._simulations[simulation.id]
+            raise
+
+    def stop(self, simulation_id: str) -> bool:
+        """
+        停止指定模拟，排队中的模拟直接移出队列
+
+        参数:
+            simulation_id: 模拟ID
+
+        返回:
+            bool: 模拟是否尚未结束并已发出取消请求；started_at 仍为空说明 runner 不会再运行
+        """
+        simulation = self._simulations.get(simulation_id)
+        if simulation is None or not simulation.is_active:
+            return False
+        if simulation.status == STATUS_QUEUED and self.queue.cancel(simulation_id):
+            simulation.status = STATUS_CANCELLED
+            simulation.queue_position = None
+            simulation.finished_at = datetime.now()
+            simulation.finished.set()
+            logger.info(f"已取消排队中的模拟: {simulation_id}")
+            return True
+        simulation.status = STATUS_STOPPING
+        simulation.cancellation_token.cancel()
+        if simulation.task is not None and not simulation.task.done():
+            simulation.task.cancel()
+        logger.info(f"已请求停止模拟: {simulation_id}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """返回运行中的模拟数量、上限和队列状态"""
+        return {
+            "running": len(self.running()),
+            "max_concurrent": self.max_concurrent,
+            "total": len(self._simulations),
+            "queue": self.queue.stats()
+        }
+
+    def _on_position(self, simulation_id: str, position: int, eta: Optional[float]) -> None:
+        """记录排队位置并转发给 on_queue_update"""
+        simulation = self._simulations.get(simulation_id)
+        if simulation is not None:
+            simulation.queue_position = position
+        if self.on_queue_update is not None:
+            self.on_queue_update(simulation_id, position, eta)
+
+    def _on_done(self, simulation: Simulation, task: asyncio.Task) -> None:
+        """模拟任务结束后更新状态并清理过期记录"""
+        simulation.finished_at = datetime.now()
+        if task.cancelled() or simulation.status == STATUS_STOPPING:
+            simulation.status = STATUS_CANCELLED
+        elif task.exception() is not None:
+            simulation.status = STATUS_FAILED
+            simulation.error = str(task.exception())
+        elif simulation.status == STATUS_RUNNING:
+            # 运行过程中已被标记为失败的模拟保持原状态
+            simulation.status = STATUS_COMPLETED
+        logger.info(f"模拟 {simulation.id} 已结束: {simulation.status}")
+        simulation.finished.set()
+        self._evict_finished()
+
+    def _evict_finished(self) -> None:
+        finished = [simulation.id for simulation in self._simulations.values() if not simulation.is_active]
+        for simulation_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._simulations[simulation_id]
@@ -0,0 +1,144 @@
+"""
+SSE响应类
+"""
+import os
+import zlib
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Optional
+
+import anyio
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# SSE响应的默认响应头
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Access-Control-Allow-Origin": "*",
+    "X-Accel-Buffering": "no"
+}
+
+# 流式压缩：auto 表示按 Accept-Encoding 协商，off 表示关闭
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "auto").lower()
+
+# zlib 压缩级别
+SSE_COMPRESSION_LEVEL = int(os.getenv("SSE_COMPRESSION_LEVEL", "6"))
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip/deflate
+    brotli = None
+
+# 按优先级排列的可用编码
+SUPPORTED_ENCODINGS = (("br",) if brotli is not None else ()) + ("gzip", "deflate")
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    根据 Accept-Encoding 请求头选择流式压缩编码
+
+    参数:
+        accept_encoding: 请求头的值
+
+    返回:
+        str: 选中的编码，不压缩时返回 None
+    """
+    if SSE_COMPRESSION == "off" or not accept_encoding:
+        return None
+
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    candidates = [encoding for encoding in SUPPORTED_ENCODINGS if accepted.get(encoding, 0) > 0]
+    if not candidates:
+        return None
+    # 质量值相同时按服务端优先级选择
+    return max(candidates, key=lambda encoding: accepted[encoding])
+
+
+class StreamCompressor:
+    """
+    单个连接的流式压缩器
+
+    压缩上下文在整个连接期间保留，重复出现的字段名和信封结构会被后续帧引用，
+    每写出一个事件都做一次同步刷新，保证事件不会滞留在压缩缓冲区中。
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor()
+        else:
+            # gzip 使用 gzip 头，deflate 按 HTTP 规范使用 zlib 格式
+            wbits = 31 if encoding == "gzip" else 15
+            self._zlib = zlib.compressobj(SSE_COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+
+    def compress(self, chunk: bytes) -> bytes:
+        """压缩一个事件并立即刷新"""
+        if self.encoding == "br":
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """结束压缩流"""
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+class EventSourceResponse(StreamingResponse):
+    """
+    SSE流式响应
+
+    写出事件的同时监听 ASGI receive 通道，收到 http.disconnect 后立即取消写出任务，
+    因此事件生成器可以无限期地等待下一个事件，而不需要轮询连接状态或设置超时。
+
+    指定 encoding 时对每个写出的事件做流式压缩（见 StreamCompressor）。
+    """
+
+    def __init__(
+        self,
+        content: AsyncIterable[Any],
+        headers: Optional[Dict[str, str]] = None,
+        encoding: Optional[str] = None,
+        **kwargs
+    ):
+        merged_headers = dict(SSE_HEADERS)
+        if encoding is not None:
+            merged_headers["Content-Encoding"] = encoding
+            merged_headers["Vary"] = "Accept-Encoding"
+            content = self._compress(content, StreamCompressor(encoding))
+        if headers:
+            merged_headers.update(headers)
+        super().__init__(content, media_type="text/event-stream", headers=merged_headers, **kwargs)
+
+    @staticmethod
+    async def _compress(content: AsyncIterable[Any], compressor: StreamCompressor) -> AsyncIterator[bytes]:
+        """逐个压缩事件，生成器正常结束时写出压缩流的结尾"""
+        async for chunk in content:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            yield compressor.compress(chunk)
+        yield compressor.finish()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async with anyio.create_task_group() as task_group:
+            async def stream_and_cancel() -> None:
+                await self.stream_response(send)
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(stream_and_cancel)
+            # 阻塞在 receive 上，直到客户端断开；期间不产生任何定时唤醒
+            await self.listen_for_disconnect(receive)
+            task_group.cancel_scope.cancel()
+
+        if self.background is not None:
+            await self.background()